@@ -1,16 +1,54 @@
 from __future__ import annotations
 
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from functools import lru_cache
 from pathlib import Path
+from typing import Annotated, Literal
 
-import joblib
 import numpy as np
 import pandas as pd
-from fastapi import FastAPI, HTTPException, Query
+import pyarrow as pa
+import pyarrow.compute as pc
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field
+
+from ml.aggregate import (
+    CUBE_ACTION_TYPES,
+    CUBE_GAME_STATES,
+    PLAYER_MATCH_STATS_FILENAME,
+    ZONE_CUBE_FILENAMES,
+    ZoneCube,
+    cube_heatmap,
+    load_zone_cube,
+    player_match_windows,
+    player_totals,
+    primary_team,
+)
+from ml.config import PipelineConfig
+from ml.hybrid import score_actions
+from ml.model import FEATURE_COLUMNS, MODEL_FILENAME, TrainedModel, load_shot_model
+from ml.serving import (
+    SERVED_ACTION_COLUMNS,
+    SERVED_ACTIONS_FILENAME,
+    load_served_actions,
+    player_rows,
+    read_release_manifest,
+    served_actions_table,
+)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 ARTIFACTS_DIR = BASE_DIR / "artifacts"
 PROCESSED_DIR = BASE_DIR / "data" / "processed"
+RELEASES_DIR = ARTIFACTS_DIR / "releases"
+RELOAD_INTERVAL_S = float(os.environ.get("XT_RELOAD_INTERVAL_S", "5"))
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+MAX_PAGE_SIZE = 100_000
+VALIDATION_KEYS = {"validation_auc", "bootstrap_samples", "bootstrap_ci", "correlations_by_team"}
 
 app = FastAPI(title="Hybrid xT API", version="0.1.0")
 
@@ -20,33 +58,265 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Offset"],
 )
 
 
+class RawAction(BaseModel):
+    start_x: float
+    start_y: float
+    end_x: float
+    end_y: float
+    type: str = "Pass"
+    under_pressure: bool = False
+    pressure_score: float = 0.0
+    minute: int = 0
+    score_diff: int = 0
+
+
+class ScoreRequest(BaseModel):
+    actions: list[RawAction] = Field(..., max_length=100_000)
+
+
 class Store:
-    xt_surface: np.ndarray | None = None
-    model = None
-    actions: pd.DataFrame | None = None
-    players: pd.DataFrame | None = None
+    def __init__(self, version: str = "unloaded") -> None:
+        self.version = version
+        self.cfg = PipelineConfig()
+        self.xt_surface: np.ndarray | None = None
+        self.model = None
+        self.actions: pa.Table | None = None
+        self.players: pd.DataFrame | None = None
+        self.player_rows: dict[str, tuple[int, int]] = {}
+        self.player_stats: dict[str, bytes] = {}
+        self.player_table: pd.DataFrame | None = None
+        self.zone_cubes: dict[str, ZoneCube] = {}
+        self.player_matches: pd.DataFrame | None = None
+        self.player_match_rows: dict[str, pd.DataFrame] = {}
+        self.validation: dict[str, object] = {}
+        self.surface_json: bytes | None = None
+        self.players_json: bytes | None = None
+        self.loaded_at: str | None = None
+        self.load_timings: dict[str, float] = {}
+        # Per-store cache, so a swapped-out store never serves into the new one's cache.
+        self.player_actions_payload = lru_cache(maxsize=512)(self._player_actions_payload)
+
+    def _player_actions_payload(self, player_name: str) -> bytes:
+        bounds = self.player_rows.get(player_name)
+        if bounds is None or self.actions is None:
+            return b"[]"
+        subset = self.actions.slice(bounds[0], bounds[1] - bounds[0]).to_pandas()
+        return subset.to_json(orient="records", double_precision=15).encode("utf-8")
 
 
 store = Store()
+reload_state: dict[str, object] = {"last_error": None, "last_checked_at": None}
+_stop_watching = threading.Event()
+
+
+def _json_response(payload: bytes) -> Response:
+    return Response(content=payload, media_type="application/json")
+
+
+def _load_actions(path: Path) -> pa.Table:
+    if path.suffix == ".feather":
+        return load_served_actions(path)
+    # Older single-file and streaming (partitioned dataset) outputs are projected in memory.
+    actions = pd.read_parquet(path, columns=SERVED_ACTION_COLUMNS)
+    return served_actions_table(actions.assign(match_id=actions["match_id"].astype("int64")))
+
+
+def _with_primary_team(players: pd.DataFrame, actions: pa.Table) -> pd.DataFrame:
+    # The team a player made most actions for; used by the /players team filter.
+    counts = actions.select(["player", "team"]).to_pandas().astype(str).value_counts()
+    primary = counts.reset_index().drop_duplicates("player").set_index("player")["team"]
+    table = players.assign(player=players["player"].astype(str))
+    return table.assign(team=table["player"].map(primary))
+
+
+def _wants_arrow(request: Request, fmt: str | None) -> bool:
+    return fmt == "arrow" or (fmt is None and ARROW_STREAM in request.headers.get("accept", ""))
+
+
+def _encode(frame: pd.DataFrame | pa.Table, fmt: str, headers: dict[str, str]) -> Response:
+    if fmt == "arrow":
+        if isinstance(frame, pa.Table):
+            table = frame
+        else:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        payload = sink.getvalue().to_pybytes()
+        return Response(content=payload, media_type=ARROW_STREAM, headers=headers)
+
+    df = frame.to_pandas() if isinstance(frame, pa.Table) else frame
+    if fmt == "columnar":
+        # One JSON array per column; keys are not repeated per row.
+        columns = ",".join(
+            f"{json.dumps(str(col))}:{df[col].to_json(orient='values', double_precision=15)}"
+            for col in df.columns
+        )
+        payload = f"{{{columns}}}".encode()
+    else:
+        payload = df.to_json(orient="records", double_precision=15).encode("utf-8")
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+
+def _in_date_range(
+    rows: pd.DataFrame, start_date: date | None, end_date: date | None
+) -> pd.DataFrame:
+    if start_date is not None:
+        rows = rows[rows["match_date"] >= pd.Timestamp(start_date)]
+    if end_date is not None:
+        rows = rows[rows["match_date"] <= pd.Timestamp(end_date)]
+    return rows
+
+
+def _player_window_table(rows: pd.DataFrame) -> pd.DataFrame:
+    # Same shape as Store.player_table, summed from the small per-match table.
+    table = player_totals(rows)
+    return table.assign(team=table["player"].map(primary_team(rows)))
+
+
+def _json_safe(value: object) -> object:
+    # Correlations are NaN for groups with fewer than three players; JSON has no NaN.
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _page_headers(total: int, offset: int, returned: int) -> dict[str, str]:
+    headers = {"X-Total-Count": str(total)}
+    if offset + returned < total:
+        headers["X-Next-Offset"] = str(offset + returned)
+    return headers
+
+
+def serving_config(metadata: dict) -> PipelineConfig:
+    # /score must use the grid, geometry, alpha and surface lookup the stored actions were scored
+    # with; keys missing from older metadata keep the PipelineConfig default.
+    fields = {k: metadata[k] for k in ("hybrid_alpha", "xt_interpolate") if k in metadata}
+    grouped = {
+        "grid": ("grid_y", "grid_x"),
+        "pitch": ("pitch_length", "pitch_width"),
+        "goal": ("goal_center_x", "goal_center_y", "goal_left_y", "goal_right_y"),
+    }
+    for key, names in grouped.items():
+        if key in metadata:
+            fields.update(zip(names, metadata[key], strict=True))
+    return PipelineConfig(**fields)
+
+
+def load_store(artifacts_dir: Path, processed_dir: Path, version: str) -> Store | None:
+    surface_path = artifacts_dir / "xt_surface.npy"
+    model_path = artifacts_dir / MODEL_FILENAME
+    players_path = processed_dir / "player_stats.parquet"
+    candidates = [SERVED_ACTIONS_FILENAME, "actions_hybrid_xt.parquet", "actions_hybrid_xt_dataset"]
+    actions_path = next(
+        (processed_dir / name for name in candidates if (processed_dir / name).exists()),
+        processed_dir / SERVED_ACTIONS_FILENAME,
+    )
+
+    if not (surface_path.exists() and model_path.exists() and actions_path.exists() and players_path.exists()):
+        return None
+
+    new = Store(version)
+    metadata_path = artifacts_dir / "metadata.json"
+    if metadata_path.exists():
+        metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+        new.cfg = serving_config(metadata)
+        new.validation = _json_safe(
+            {k: v for k, v in metadata.items() if k in VALIDATION_KEYS or "_xt_" in k}
+        )
+
+    # Memory-mapped surface and actions let uvicorn workers share pages instead of holding copies.
+    started = time.perf_counter()
+    new.xt_surface = np.load(surface_path, mmap_mode="r")
+    new.load_timings["surface_s"] = time.perf_counter() - started
+    started = time.perf_counter()
+    new.model = load_shot_model(model_path)
+    new.load_timings["model_s"] = time.perf_counter() - started
+    started = time.perf_counter()
+    new.actions = _load_actions(actions_path)
+    new.player_rows = player_rows(new.actions)
+    new.load_timings["actions_s"] = time.perf_counter() - started
+    started = time.perf_counter()
+    new.players = pd.read_parquet(players_path)
+    new.player_table = _with_primary_team(new.players, new.actions)
+
+    grid = new.xt_surface.reshape(new.cfg.grid_y, new.cfg.grid_x).tolist()
+    new.surface_json = json.dumps({"grid": grid}).encode("utf-8")
+    # Same rows (with team) as a filtered or paged /players response.
+    player_records = new.player_table.to_json(orient="records", double_precision=15)
+    new.players_json = player_records.encode("utf-8")
+    players = new.players.assign(player=new.players["player"].astype(str))
+    records = players.drop_duplicates("player").to_json(orient="records", double_precision=15)
+    new.player_stats = {
+        row["player"]: json.dumps(row).encode("utf-8") for row in json.loads(records)
+    }
+    new.load_timings["players_s"] = time.perf_counter() - started
+    started = time.perf_counter()
+    # Cubes are optional: releases published before they existed still load.
+    new.zone_cubes = {
+        key: load_zone_cube(processed_dir / name)
+        for key, name in ZONE_CUBE_FILENAMES.items()
+        if (processed_dir / name).exists()
+    }
+    new.load_timings["zone_cubes_s"] = time.perf_counter() - started
+    player_matches_path = processed_dir / PLAYER_MATCH_STATS_FILENAME
+    if player_matches_path.exists():
+        started = time.perf_counter()
+        new.player_matches = pd.read_parquet(player_matches_path)
+        new.player_match_rows = dict(tuple(new.player_matches.groupby("player", sort=False)))
+        new.load_timings["player_matches_s"] = time.perf_counter() - started
+    new.load_timings["total_s"] = sum(new.load_timings.values())
+    new.loaded_at = datetime.now(timezone.utc).isoformat()
+    return new
+
+
+def reload_if_changed() -> bool:
+    """Load the current release into a fresh store and swap it in; requests keep the old one."""
+    global store
+    reload_state["last_checked_at"] = datetime.now(timezone.utc).isoformat()
+    manifest = read_release_manifest(RELEASES_DIR)
+    if manifest is None:
+        if store.version != "unloaded":
+            return False
+        new = load_store(ARTIFACTS_DIR, PROCESSED_DIR, "unversioned")
+    elif manifest["version"] == store.version:
+        return False
+    else:
+        release_dir = RELEASES_DIR / manifest["version"]
+        new = load_store(release_dir, release_dir, manifest["version"])
+
+    if new is None:
+        return False
+    store = new
+    return True
+
+
+def _watch_releases() -> None:
+    while not _stop_watching.wait(RELOAD_INTERVAL_S):
+        try:
+            reload_if_changed()
+            reload_state["last_error"] = None
+        except Exception as exc:  # keep serving the previous release
+            reload_state["last_error"] = repr(exc)
 
 
 @app.on_event("startup")
 def startup() -> None:
-    surface_path = ARTIFACTS_DIR / "xt_surface.npy"
-    model_path = ARTIFACTS_DIR / "xgboost_shot_model.joblib"
-    actions_path = PROCESSED_DIR / "actions_hybrid_xt.parquet"
-    players_path = PROCESSED_DIR / "player_stats.parquet"
+    reload_if_changed()
+    if RELOAD_INTERVAL_S > 0:
+        _stop_watching.clear()
+        threading.Thread(target=_watch_releases, name="artifact-reloader", daemon=True).start()
 
-    if not (surface_path.exists() and model_path.exists() and actions_path.exists() and players_path.exists()):
-        return
 
-    store.xt_surface = np.load(surface_path)
-    store.model = joblib.load(model_path)
-    store.actions = pd.read_parquet(actions_path)
-    store.players = pd.read_parquet(players_path)
+@app.on_event("shutdown")
+def shutdown() -> None:
+    _stop_watching.set()
 
 
 @app.get("/health")
@@ -54,58 +324,186 @@ def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/version")
+def version() -> dict[str, object]:
+    current = store
+    return {
+        "version": current.version,
+        "loaded_at": current.loaded_at,
+        "load_timings": current.load_timings,
+        **reload_state,
+    }
+
+
+@app.get("/validation")
+def validation(team: str | None = None) -> dict[str, object]:
+    current = store
+    if not current.validation:
+        raise HTTPException(
+            status_code=404, detail="Validation metrics not found. Run pipeline first."
+        )
+    if team is None:
+        return current.validation
+
+    by_team = current.validation.get("correlations_by_team") or {}
+    if team not in by_team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    return {"team": team, **by_team[team]}
+
+
 @app.get("/surface")
-def surface() -> dict[str, list[list[float]]]:
-    if store.xt_surface is None:
+def surface() -> Response:
+    current = store
+    if current.surface_json is None:
         raise HTTPException(status_code=404, detail="xT surface not found. Run pipeline first.")
-
-    arr = store.xt_surface.reshape(12, 16).tolist()
-    return {"grid": arr}
+    return _json_response(current.surface_json)
 
 
 @app.get("/players")
-def players() -> list[dict]:
-    if store.players is None:
+def players(
+    request: Request,
+    team: str | None = None,
+    min_minutes: float = Query(0.0, ge=0),
+    sort_by: str | None = None,
+    ascending: bool = False,
+    top_k: int | None = Query(None, ge=1),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    start_date: date | None = None,
+    end_date: date | None = None,
+    format: Literal["records", "columnar", "arrow"] | None = None,
+) -> Response:
+    current = store
+    if current.players_json is None or current.player_table is None:
         raise HTTPException(status_code=404, detail="Player table not found. Run pipeline first.")
-    return store.players.to_dict(orient="records")
+
+    fmt = "arrow" if _wants_arrow(request, format) else format or "records"
+    dated = (start_date, end_date) != (None, None)
+    filtered = (team, sort_by, top_k, limit) != (None,) * 4 or min_minutes > 0 or offset > 0
+    if not (filtered or dated) and fmt == "records":
+        return _json_response(current.players_json)
+
+    table = current.player_table
+    if dated:
+        if current.player_matches is None:
+            raise HTTPException(
+                status_code=404, detail="Per-match player table not found. Run pipeline first."
+            )
+        table = _player_window_table(_in_date_range(current.player_matches, start_date, end_date))
+    if team is not None:
+        table = table[table["team"] == team]
+    if min_minutes > 0:
+        table = table[table["minutes_in_match"] >= min_minutes]
+    if sort_by is not None:
+        if sort_by not in table.columns:
+            raise HTTPException(status_code=400, detail=f"Unknown sort column: {sort_by}")
+        table = table.sort_values(sort_by, ascending=ascending, kind="stable", na_position="last")
+    if top_k is not None:
+        table = table.head(top_k)
+
+    total = len(table)
+    page = table.iloc[offset : offset + limit if limit is not None else None]
+    return _encode(page.reset_index(drop=True), fmt, _page_headers(total, offset, len(page)))
 
 
 @app.get("/player-actions")
-def player_actions(player_name: str = Query(..., min_length=2)) -> list[dict]:
-    if store.actions is None:
+def player_actions(
+    request: Request,
+    player_name: str = Query(..., min_length=2),
+    match_id: Annotated[list[int] | None, Query()] = None,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    format: Literal["records", "columnar", "arrow"] | None = None,
+) -> Response:
+    current = store
+    if current.actions is None:
         raise HTTPException(status_code=404, detail="Actions table not found. Run pipeline first.")
 
-    subset = store.actions[store.actions["player"] == player_name].copy()
-    if subset.empty:
-        return []
-
-    cols = [
-        "id",
-        "match_id",
-        "team",
-        "player",
-        "minute",
-        "type",
-        "start_x",
-        "start_y",
-        "end_x",
-        "end_y",
-        "xt_value",
-        "progressive_flag",
-        "under_pressure",
-        "pressure_score",
-    ]
-    existing = [c for c in cols if c in subset.columns]
-    subset = subset[existing].sort_values(["match_id", "minute"]).reset_index(drop=True)
-    return subset.to_dict(orient="records")
+    fmt = "arrow" if _wants_arrow(request, format) else format or "records"
+    if match_id is None and limit is None and offset == 0 and fmt == "records":
+        return _json_response(current.player_actions_payload(player_name))
+
+    # Rows stay a zero-copy slice of the memory-mapped table until they are encoded.
+    start, stop = current.player_rows.get(player_name, (0, 0))
+    table = current.actions.slice(start, stop - start)
+    if match_id:
+        wanted = pa.array(match_id, table["match_id"].type)
+        table = table.filter(pc.is_in(table["match_id"], value_set=wanted))
+
+    total = table.num_rows
+    page = table.slice(offset, limit if limit is not None else max(total - offset, 0))
+    return _encode(page, fmt, _page_headers(total, offset, page.num_rows))
+
+
+@app.get("/player-form")
+def player_form(
+    request: Request,
+    player_name: str = Query(..., min_length=2),
+    window: int | None = Query(None, ge=1),
+    start_date: date | None = None,
+    end_date: date | None = None,
+    format: Literal["records", "columnar", "arrow"] | None = None,
+) -> Response:
+    current = store
+    if current.player_matches is None:
+        raise HTTPException(
+            status_code=404, detail="Per-match player table not found. Run pipeline first."
+        )
+
+    rows = current.player_match_rows.get(player_name)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    # One row per match: cumulative totals (no window) or over the player's last `window` matches.
+    form = player_match_windows(_in_date_range(rows, start_date, end_date), window)
+    form["match_date"] = form["match_date"].dt.strftime("%Y-%m-%d")
+    fmt = "arrow" if _wants_arrow(request, format) else format or "records"
+    return _encode(form, fmt, {"X-Total-Count": str(len(form))})
 
 
 @app.get("/player-stats")
-def player_stats(player_name: str = Query(..., min_length=2)) -> dict:
-    if store.players is None:
+def player_stats(player_name: str = Query(..., min_length=2)) -> Response:
+    current = store
+    if current.players is None:
         raise HTTPException(status_code=404, detail="Player table not found. Run pipeline first.")
 
-    subset = store.players[store.players["player"] == player_name]
-    if subset.empty:
+    payload = current.player_stats.get(player_name)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Player not found")
-    return subset.iloc[0].to_dict()
+    return _json_response(payload)
+
+
+@app.get("/zone-heatmap")
+def zone_heatmap(
+    name: str = Query(..., min_length=1),
+    entity: Literal["player", "team"] = "player",
+    axis: Literal["start_zone", "end_zone", "pair"] = "start_zone",
+    action_type: Literal[CUBE_ACTION_TYPES] | None = None,
+    game_state: Literal[CUBE_GAME_STATES] | None = None,
+) -> dict[str, object]:
+    current = store
+    cube = current.zone_cubes.get(entity)
+    if cube is None:
+        raise HTTPException(status_code=404, detail="Zone cube not found. Run pipeline first.")
+    if not cube.has_entity(name):
+        raise HTTPException(status_code=404, detail=f"{entity.capitalize()} not found")
+    # Binary search to the entity's cells, then reduce only that slice.
+    return {"grid": list(cube.grid), **cube_heatmap(cube, name, axis, action_type, game_state)}
+
+
+@app.post("/score")
+def score(request: ScoreRequest) -> dict[str, list[float]]:
+    current = store
+    if current.model is None or current.xt_surface is None:
+        raise HTTPException(
+            status_code=404, detail="Model or xT surface not found. Run pipeline first."
+        )
+
+    # Column lists straight from the validated models; scoring never builds a DataFrame.
+    raw = {name: [getattr(a, name) for a in request.actions] for name in RawAction.model_fields}
+    trained = TrainedModel(
+        model=current.model, feature_columns=FEATURE_COLUMNS, validation_auc=float("nan")
+    )
+    scored = score_actions(
+        raw, trained, current.xt_surface, current.cfg, alpha=current.cfg.hybrid_alpha
+    )
+    return {col: values.astype(float).tolist() for col, values in scored.items()}
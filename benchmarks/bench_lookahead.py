@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import argparse
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import make_events
+from ml.model import build_shot_lookahead_target, build_shot_lookahead_targets
+
+
+def _reference_lookahead(events: pd.DataFrame, actions: pd.DataFrame, lookahead: int) -> pd.Series:
+    ev = events[["match_id", "index", "team", "possession", "type"]].copy()
+    ev = ev.sort_values(["match_id", "index"]).reset_index(drop=True)
+
+    labels = []
+    for _, act in actions.iterrows():
+        subset = ev[
+            (ev["match_id"] == act["match_id"])
+            & (ev["team"] == act["team"])
+            & (ev["possession"] == act["possession"])
+            & (ev["index"] > act["index"])
+        ].head(lookahead)
+        labels.append(int((subset["type"] == "Shot").any()))
+    return pd.Series(labels, index=actions.index, dtype=int)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark shot-lookahead labelling.")
+    parser.add_argument("--matches", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--lookaheads", type=int, nargs="+", default=[3, 5, 10])
+    parser.add_argument("--reference-max-matches", type=int, default=1)
+    args = parser.parse_args()
+
+    print(
+        f"{'matches':>8} {'events':>10} {'actions':>10} {'single_s':>10} {'multi_s':>10} "
+        f"{'reference_s':>12}"
+    )
+    for n_matches in args.matches:
+        events = make_events(n_matches)
+        actions = events[events["type"].isin(["Pass", "Carry"])]
+
+        t0 = time.perf_counter()
+        single = build_shot_lookahead_target(events, actions, lookahead=5)
+        single_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        build_shot_lookahead_targets(events, actions, args.lookaheads)
+        multi_s = time.perf_counter() - t0
+
+        reference = "-"
+        if n_matches <= args.reference_max_matches:
+            t0 = time.perf_counter()
+            expected = _reference_lookahead(events, actions, lookahead=5)
+            reference = f"{time.perf_counter() - t0:.3f}"
+            if not single.astype(int).equals(expected):
+                raise AssertionError("vectorised labels differ from the reference implementation")
+
+        print(
+            f"{n_matches:>8} {len(events):>10} {len(actions):>10} "
+            f"{single_s:>10.3f} {multi_s:>10.3f} {reference:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
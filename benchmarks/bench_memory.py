@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import make_events
+from ml.config import PipelineConfig
+from ml.data_ingestion import split_events
+from ml.features import add_spatial_features, build_game_state, encode_context_features
+from ml.model import build_shot_lookahead_target
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _measure(n_matches: int) -> dict[str, float]:
+    cfg = PipelineConfig()
+    events = make_events(n_matches)
+    wide_mb = events.memory_usage(deep=True).sum() / 1e6
+    rss_before = _peak_rss_mb()
+
+    t0 = time.perf_counter()
+    loaded = split_events(events, cfg)
+    del events
+    actions = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
+    actions = add_spatial_features(actions, cfg)
+    shots = add_spatial_features(loaded.shots, cfg)
+    actions = build_game_state(actions, shots)
+    actions = encode_context_features(actions)
+    actions["target_shot_next_5"] = build_shot_lookahead_target(loaded.events, actions, lookahead=5)
+
+    return {
+        "matches": n_matches,
+        "rows": len(actions),
+        "seconds": time.perf_counter() - t0,
+        "raw_events_mb": wide_mb,
+        "actions_mb": actions.memory_usage(deep=True).sum() / 1e6,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stage_rss_growth_mb": _peak_rss_mb() - rss_before,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Peak-RSS benchmark for ingestion and feature stages."
+    )
+    parser.add_argument("--matches", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(_measure(args.worker)))
+        return
+
+    cols = [
+        "matches",
+        "rows",
+        "seconds",
+        "raw_events_mb",
+        "actions_mb",
+        "peak_rss_mb",
+        "stage_rss_growth_mb",
+    ]
+    print(" ".join(f"{c:>20}" for c in cols))
+    for n_matches in args.matches:
+        # A fresh interpreter per size so ru_maxrss is not inherited from a larger run.
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_memory", "--worker", str(n_matches)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        row = json.loads(out.stdout.strip().splitlines()[-1])
+        cells = (f"{row[c]:>20.2f}" if isinstance(row[c], float) else f"{row[c]:>20}" for c in cols)
+        print(" ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""pytest-benchmark suite for the ml/ stages and the full pipeline on synthetic matches.
+
+    pytest benchmarks/bench_pipeline.py --benchmark-only
+    XT_BENCH_MATCHES=1,10,100,1000 pytest benchmarks/bench_pipeline.py --benchmark-only \\
+        --benchmark-json=bench.json
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, replace
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.synthetic import make_events, write_raw_cache  # noqa: E402
+from ml.aggregate import (  # noqa: E402
+    player_aggregation,
+    player_match_aggregation,
+    player_match_windows,
+    team_aggregation,
+    validate_correlations,
+)
+from ml.config import PipelineConfig  # noqa: E402
+from ml.data_ingestion import LoadedData, flatten_freeze_frames, split_events  # noqa: E402
+from ml.features import (  # noqa: E402
+    add_spatial_features,
+    build_game_state,
+    encode_context_features,
+)
+from ml.hybrid import compute_hybrid_xt, score_actions  # noqa: E402
+from ml.markov_xt import (  # noqa: E402
+    count_zone_transitions,
+    solve_xt,
+    zone_probabilities_from_counts,
+)
+from ml.model import (  # noqa: E402
+    TrainedModel,
+    append_start_end_shot_probs,
+    build_shot_lookahead_target,
+    train_xgboost,
+)
+from ml.pipeline import run_pipeline  # noqa: E402
+
+MATCHES = [int(n) for n in os.environ.get("XT_BENCH_MATCHES", "1,10").split(",")]
+EVENTS_PER_MATCH = int(os.environ.get("XT_BENCH_EVENTS_PER_MATCH", "3000"))
+ROUNDS = int(os.environ.get("XT_BENCH_ROUNDS", "3"))
+CFG = PipelineConfig()
+
+
+@dataclass
+class Stages:
+    n_matches: int
+    events: pd.DataFrame
+    loaded: LoadedData
+    spatial: pd.DataFrame
+    shots: pd.DataFrame
+    features: pd.DataFrame
+    counts_probs: tuple
+    xt_surface: object
+    trained: TrainedModel
+    scored: pd.DataFrame
+
+
+def _build_stages(n_matches: int) -> Stages:
+    # Each stage is benchmarked on the real output of the stage before it.
+    events = make_events(n_matches, EVENTS_PER_MATCH)
+    loaded = split_events(events, CFG)
+    actions = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
+    spatial = add_spatial_features(actions, CFG)
+    shots = add_spatial_features(loaded.shots, CFG)
+    features = encode_context_features(build_game_state(spatial, shots))
+    features["target_shot_next_5"] = build_shot_lookahead_target(
+        loaded.events, features, lookahead=5
+    )
+    probs = zone_probabilities_from_counts(count_zone_transitions(features, shots, CFG))
+    xt_surface = solve_xt(*probs, CFG).xt
+    trained = train_xgboost(features, CFG)
+    scored = append_start_end_shot_probs(features, trained)
+    scored = scored.assign(action_xg=0.0, is_action_goal=0)
+    scored = compute_hybrid_xt(scored, xt_surface, alpha=0.5, cfg=CFG)
+    return Stages(
+        n_matches, events, loaded, spatial, shots, features, probs, xt_surface, trained, scored
+    )
+
+
+@pytest.fixture(scope="module", params=MATCHES, ids=lambda n: f"{n}_matches")
+def stages(request) -> Stages:
+    # Module scope groups the tests by size, so each size is generated once.
+    return _build_stages(request.param)
+
+
+def _run(benchmark, fn, *args, **kwargs):
+    return benchmark.pedantic(fn, args=args, kwargs=kwargs, rounds=ROUNDS, iterations=1)
+
+
+def test_split_events(benchmark, stages):
+    _run(benchmark, split_events, stages.events, CFG)
+
+
+def test_flatten_freeze_frames(benchmark, stages):
+    _run(benchmark, flatten_freeze_frames, stages.events)
+
+
+def test_add_spatial_features(benchmark, stages):
+    loaded = stages.loaded
+    actions = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
+    _run(benchmark, add_spatial_features, actions, CFG)
+
+
+def test_build_game_state(benchmark, stages):
+    _run(benchmark, build_game_state, stages.spatial, stages.shots)
+
+
+def test_encode_context_features(benchmark, stages):
+    _run(benchmark, encode_context_features, build_game_state(stages.spatial, stages.shots))
+
+
+def test_build_shot_lookahead_target(benchmark, stages):
+    _run(benchmark, build_shot_lookahead_target, stages.loaded.events, stages.features, lookahead=5)
+
+
+def test_count_zone_transitions(benchmark, stages):
+    _run(benchmark, count_zone_transitions, stages.features, stages.shots, CFG)
+
+
+def test_solve_xt(benchmark, stages):
+    _run(benchmark, solve_xt, *stages.counts_probs, CFG)
+
+
+def test_train_xgboost(benchmark, stages):
+    _run(benchmark, train_xgboost, stages.features, CFG)
+
+
+def test_append_start_end_shot_probs(benchmark, stages):
+    _run(benchmark, append_start_end_shot_probs, stages.features, stages.trained)
+
+
+def test_compute_hybrid_xt(benchmark, stages):
+    _run(benchmark, compute_hybrid_xt, stages.scored, stages.xt_surface, alpha=0.5, cfg=CFG)
+
+
+def test_score_actions_1k(benchmark, stages):
+    # The POST /score path: one live batch of 1k raw actions.
+    raw = stages.features.head(1000)
+    cols = ["start_x", "start_y", "end_x", "end_y", "type", "under_pressure", "pressure_score"]
+    batch = {c: raw[c].to_numpy() for c in [*cols, "minute", "score_diff"]}
+    _run(benchmark, score_actions, batch, stages.trained, stages.xt_surface, CFG)
+
+
+def test_player_aggregation(benchmark, stages):
+    _run(benchmark, player_aggregation, stages.scored)
+
+
+def test_player_match_windows(benchmark, stages):
+    _run(benchmark, player_match_windows, player_match_aggregation(stages.scored), window=5)
+
+
+def test_validate_correlations_bootstrap(benchmark, stages):
+    _run(benchmark, validate_correlations, player_aggregation(stages.scored), n_bootstrap=1000)
+
+
+def test_team_aggregation(benchmark, stages):
+    _run(benchmark, team_aggregation, stages.scored)
+
+
+def test_run_pipeline(benchmark, stages, tmp_path):
+    cfg = replace(
+        CFG,
+        data_raw_dir=tmp_path / "raw",
+        data_processed_dir=tmp_path / "processed",
+        artifacts_dir=tmp_path / "artifacts",
+    )
+    write_raw_cache(cfg, stages.n_matches, EVENTS_PER_MATCH)
+    _run(benchmark, run_pipeline, cfg)
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import argparse
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import make_events
+from ml.config import PipelineConfig
+from ml.data_ingestion import link_shots, split_events
+from ml.hybrid import attach_shot_outcomes
+
+KEYS = ["match_id", "team", "player", "minute", "second"]
+
+
+def _five_key_merge(actions: pd.DataFrame, shots: pd.DataFrame) -> pd.DataFrame:
+    shot_meta = shots[[*KEYS, "shot_statsbomb_xg", "is_goal"]]
+    shot_meta = shot_meta.rename(columns={"shot_statsbomb_xg": "xg"})
+    return actions.merge(shot_meta, on=KEYS, how="left")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the action -> shot metadata join.")
+    parser.add_argument("--matches", type=int, nargs="+", default=[64, 380])
+    args = parser.parse_args()
+
+    cfg = PipelineConfig()
+    cols = ["matches", "actions", "link_s", "gather_s", "merge_s", "merge_rows", "merge_extra_rows"]
+    print(" ".join(f"{c:>16}" for c in cols))
+    for n_matches in args.matches:
+        events = make_events(n_matches)
+        loaded = split_events(events, cfg)
+        actions = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
+
+        t0 = time.perf_counter()
+        link_shots(events)
+        link_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        gathered = attach_shot_outcomes(actions, loaded.shots)
+        gather_s = time.perf_counter() - t0
+        if len(gathered) != len(actions):
+            raise AssertionError("id-keyed gather changed the action row count")
+
+        t0 = time.perf_counter()
+        merged = _five_key_merge(actions, loaded.shots)
+        merge_s = time.perf_counter() - t0
+
+        extra_rows = len(merged) - len(actions)
+        row = [n_matches, len(actions), link_s, gather_s, merge_s, len(merged), extra_rows]
+        print(" ".join(f"{v:>16.4f}" if isinstance(v, float) else f"{v:>16}" for v in row))
+
+
+if __name__ == "__main__":
+    main()
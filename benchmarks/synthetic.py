@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+import numpy as np
+import pandas as pd
+
+from ml.config import PipelineConfig
+from ml.data_ingestion import _raw_events_path, _write_parquet_atomic
+
+TEAMS = [f"Team {i:02d}" for i in range(32)]
+FIRST_MATCH_ID = 100_000
+
+
+def _locations(x: np.ndarray, y: np.ndarray) -> list:
+    return [[float(a), float(b)] for a, b in zip(x, y, strict=True)]
+
+
+def _freeze_frames(rng: np.random.Generator, x: np.ndarray, y: np.ndarray) -> list:
+    frames = []
+    for sx, sy in zip(x, y, strict=True):
+        n = int(rng.integers(2, 10))
+        px = np.clip(sx + rng.normal(0, 6, n), 0, 120)
+        py = np.clip(sy + rng.normal(0, 6, n), 0, 80)
+        frames.append(
+            [
+                {
+                    "location": [float(a), float(b)],
+                    "player": {"id": int(i), "name": f"FF {i}"},
+                    "position": {"id": 1, "name": "Center Back"},
+                    "teammate": bool(rng.random() < 0.3),
+                }
+                for i, (a, b) in enumerate(zip(px, py, strict=True))
+            ]
+        )
+    return frames
+
+
+def _make_match(rng: np.random.Generator, match_id: int, events_per_match: int) -> pd.DataFrame:
+    home, away = rng.choice(len(TEAMS), size=2, replace=False)
+    n = events_per_match
+
+    # Possessions alternate between the two sides and last a geometric number of events.
+    lengths = rng.geometric(1.0 / 8.0, size=n)
+    possession = np.repeat(np.arange(1, n + 1), lengths)[:n]
+    owner = np.where(possession % 2 == 1, TEAMS[home], TEAMS[away])
+    other = np.where(possession % 2 == 1, TEAMS[away], TEAMS[home])
+
+    kinds = ["Pass", "Carry", "Ball Receipt*", "Pressure"]
+    kind = rng.choice(kinds, size=n, p=[0.35, 0.3, 0.25, 0.1])
+    last_in_possession = np.append(possession[1:] != possession[:-1], True)
+    kind = np.where(last_in_possession & (rng.random(n) < 0.12), "Shot", kind)
+    team = np.where(kind == "Pressure", other, owner)
+    player = np.char.add(np.char.add(team.astype(str), " #"), rng.integers(1, 15, n).astype(str))
+
+    seconds = np.sort(rng.integers(0, 95 * 60, size=n))
+    period = np.where(seconds < 45 * 60, 1, 2)
+    period_seconds = seconds - (period - 1) * 45 * 60
+    timestamp = [f"00:{s // 60:02d}:{s % 60:02d}.000" for s in period_seconds]
+
+    x = np.clip(rng.normal(60, 25, n), 0.1, 119.9)
+    y = rng.uniform(0.1, 79.9, n)
+    is_shot = kind == "Shot"
+    x = np.where(is_shot, rng.uniform(88, 119, n), x)
+    end_x = np.clip(x + rng.normal(8, 12, n), 0.1, 119.9)
+    end_y = np.clip(y + rng.normal(0, 10, n), 0.1, 79.9)
+
+    ids = [f"{match_id}-{i}" for i in range(1, n + 1)]
+    related = [[ids[i - 1]] if i > 0 else np.nan for i in range(n)]
+
+    events = pd.DataFrame(
+        {
+            "id": ids,
+            "match_id": match_id,
+            "index": np.arange(1, n + 1),
+            "period": period,
+            "timestamp": timestamp,
+            "minute": seconds // 60,
+            "second": seconds % 60,
+            "team": team,
+            "possession_team": owner,
+            "player": player,
+            "type": kind,
+            "possession": possession,
+            "play_pattern": "Regular Play",
+            "location": _locations(x, y),
+            "under_pressure": pd.Series(np.where(rng.random(n) < 0.2, True, None), dtype=object),
+            "related_events": related,
+        }
+    )
+
+    is_pass = kind == "Pass"
+    is_carry = kind == "Carry"
+    end_locations = pd.Series(_locations(end_x, end_y), dtype=object)
+    events["pass_end_location"] = end_locations.where(is_pass, np.nan)
+    events["pass_outcome"] = np.where(is_pass & (rng.random(n) < 0.2), "Incomplete", None)
+    events["pass_length"] = np.where(is_pass, np.hypot(end_x - x, end_y - y), np.nan)
+    events["carry_end_location"] = end_locations.where(is_carry, np.nan)
+
+    shot_idx = np.flatnonzero(is_shot)
+    goal = rng.random(len(shot_idx)) < 0.12
+    shot_end = pd.Series([np.nan] * n, dtype=object)
+    shot_end.iloc[shot_idx] = [[120.0, float(rng.uniform(36, 44)), 1.0] for _ in shot_idx]
+    events["shot_end_location"] = shot_end
+    events["shot_outcome"] = None
+    events.loc[shot_idx, "shot_outcome"] = np.where(goal, "Goal", "Saved")
+    events["shot_statsbomb_xg"] = np.nan
+    events.loc[shot_idx, "shot_statsbomb_xg"] = np.clip(rng.beta(1.2, 9, len(shot_idx)), 0.01, 0.99)
+    freeze = pd.Series([np.nan] * n, dtype=object)
+    freeze.iloc[shot_idx] = _freeze_frames(rng, x[shot_idx], y[shot_idx])
+    events["shot_freeze_frame"] = freeze
+
+    return events
+
+
+def iter_matches(
+    n_matches: int, events_per_match: int = 3000, seed: int = 0
+) -> Iterator[tuple[int, pd.DataFrame]]:
+    rng = np.random.default_rng(seed)
+    for match_idx in range(n_matches):
+        match_id = FIRST_MATCH_ID + match_idx
+        yield match_id, _make_match(rng, match_id, events_per_match)
+
+
+def make_events(n_matches: int, events_per_match: int = 3000, seed: int = 0) -> pd.DataFrame:
+    """StatsBomb-shaped events, flattened the way ``statsbombpy.sb.events`` returns them."""
+    frames = [events for _, events in iter_matches(n_matches, events_per_match, seed)]
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_raw_cache(
+    cfg: PipelineConfig, n_matches: int, events_per_match: int = 3000, seed: int = 0
+) -> list[int]:
+    """Populate ``cfg.data_raw_dir`` so ``run_pipeline(cfg)`` runs without API access."""
+    cfg.data_raw_dir.mkdir(parents=True, exist_ok=True)
+    match_ids = []
+    for match_id, events in iter_matches(n_matches, events_per_match, seed):
+        _write_parquet_atomic(events, _raw_events_path(cfg, match_id))
+        match_ids.append(match_id)
+    matches_path = cfg.data_raw_dir / f"matches_{cfg.competition_id}_{cfg.season_id}.parquet"
+    _write_parquet_atomic(pd.DataFrame({"match_id": match_ids}), matches_path)
+    return match_ids
@@ -1,48 +1,155 @@
 from __future__ import annotations
 
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
-from scipy.stats import pearsonr, spearmanr
+from scipy.stats import ConstantInputWarning, pearsonr, rankdata, spearmanr
 
+from ml.config import PipelineConfig
 
-def _minutes_played(actions: pd.DataFrame) -> pd.DataFrame:
-    mins = (
-        actions.groupby(["match_id", "player"], as_index=False)["minute"]
-        .max()
-        .rename(columns={"minute": "minutes_in_match"})
-    )
-    total = mins.groupby("player", as_index=False)["minutes_in_match"].sum()
-    total["minutes_in_match"] = total["minutes_in_match"].clip(lower=1)
-    return total
+# Cube axes after the entity: start_zone, end_zone, action type, game state (ml.features codes).
+CUBE_ACTION_TYPES = ("Pass", "Carry")
+CUBE_GAME_STATES = ("losing", "drawing", "winning")
+ZONE_CUBE_FILENAMES = {"player": "player_zone_cube.npz", "team": "team_zone_cube.npz"}
+PLAYER_MATCH_STATS_FILENAME = "player_match_stats.parquet"
+CORRELATION_TARGETS = {"goals": "goals_per_90", "xg": "xg_per_90"}
+# Resampled values held per bootstrap batch (samples x players).
+BOOTSTRAP_BATCH_CELLS = 2_000_000
 
 
-def player_aggregation(actions: pd.DataFrame) -> pd.DataFrame:
-    mins = _minutes_played(actions)
+# Additive per-(player, match) columns: any window of matches is a plain sum of rows.
+PLAYER_MATCH_SUMS = [
+    "total_xt",
+    "total_actions",
+    "progressive_actions",
+    "pressure_actions",
+    "goals",
+    "xg",
+    "minutes_in_match",
+]
 
-    agg = (
-        actions.groupby("player", as_index=False)
-        .agg(
-            total_xt=("xt_value", "sum"),
-            total_actions=("id", "count"),
-            progressive_actions=("progressive_flag", "sum"),
-            pressure_action_rate=("under_pressure", "mean"),
-            goals=("is_action_goal", "sum"),
-            xg=("action_xg", "sum"),
-        )
-        .merge(mins, on="player", how="left")
+
+def player_match_aggregation(
+    actions: pd.DataFrame, match_dates: pd.Series | None = None
+) -> pd.DataFrame:
+    """One row per player and match; cumulative, rolling and date-range stats derive from these."""
+    per_match = actions.groupby(["player", "match_id", "team"], as_index=False, observed=True).agg(
+        total_xt=("xt_value", "sum"),
+        total_actions=("id", "count"),
+        progressive_actions=("progressive_flag", "sum"),
+        pressure_actions=("under_pressure", "sum"),
+        goals=("is_action_goal", "sum"),
+        xg=("action_xg", "sum"),
+        # Minutes are approximated by the player's last action minute in the match.
+        minutes_in_match=("minute", "max"),
     )
+    per_match["player"] = per_match["player"].astype(str)
+    per_match["team"] = per_match["team"].astype(str)
+    per_match["match_id"] = per_match["match_id"].astype("int64")
+    # Compact action dtypes (int8 minutes) would overflow once windows are summed.
+    counts = [
+        "total_actions",
+        "progressive_actions",
+        "pressure_actions",
+        "goals",
+        "minutes_in_match",
+    ]
+    per_match[counts] = per_match[counts].astype("int64")
+    per_match["xg"] = per_match["xg"].astype("float64")
+    if match_dates is None:
+        dates = pd.Series(dtype="datetime64[ns]")
+    else:
+        dates = pd.to_datetime(match_dates)
+    match_date = dates.reindex(per_match["match_id"]).to_numpy(dtype="datetime64[ns]")
+    per_match.insert(2, "match_date", match_date)
+    return per_match
+
 
+def _add_per_90(agg: pd.DataFrame) -> pd.DataFrame:
     agg["xt_per_90"] = agg["total_xt"] * 90.0 / agg["minutes_in_match"]
     agg["goals_per_90"] = agg["goals"] * 90.0 / agg["minutes_in_match"]
     agg["xg_per_90"] = agg["xg"] * 90.0 / agg["minutes_in_match"]
-    agg = agg.sort_values("xt_per_90", ascending=False).reset_index(drop=True)
+    return agg
+
+
+def _with_rates(agg: pd.DataFrame) -> pd.DataFrame:
+    agg["minutes_in_match"] = agg["minutes_in_match"].clip(lower=1)
+    agg["pressure_action_rate"] = agg.pop("pressure_actions") / agg["total_actions"]
+    return _add_per_90(agg)
+
+
+def player_totals(per_match: pd.DataFrame) -> pd.DataFrame:
+    """Whole-window player stats from per-match rows (filter the rows first for a date range)."""
+    agg = per_match.groupby("player", as_index=False, observed=True)[PLAYER_MATCH_SUMS].sum()
+    agg = _with_rates(agg)
+    cols = ["player", "total_xt", "total_actions", "progressive_actions", "pressure_action_rate"]
+    agg = agg[[*cols, "goals", "xg", "minutes_in_match", "xt_per_90", "goals_per_90", "xg_per_90"]]
+    return agg.sort_values("xt_per_90", ascending=False).reset_index(drop=True)
+
+
+def player_match_windows(per_match: pd.DataFrame, window: int | None = None) -> pd.DataFrame:
+    """Cumulative (``window=None``) or last-``window``-match stats as of each player's match."""
+    rows = per_match.sort_values(["player", "match_date", "match_id"], kind="stable")
+    rows = rows.reset_index(drop=True)
+    by_player = rows.groupby("player", observed=True, sort=False)
+    totals = by_player[PLAYER_MATCH_SUMS].cumsum()
+    matches = by_player.cumcount() + 1
+    if window is not None:
+        # Rolling sums are differences of cumulative sums taken `window` matches apart.
+        totals = totals - totals.groupby(rows["player"], sort=False).shift(window, fill_value=0)
+        matches = matches.clip(upper=window)
+    windows = rows[["player", "match_id", "match_date", "team"]].assign(matches=matches)
+    return _with_rates(pd.concat([windows, totals], axis=1))
 
+
+def primary_team(per_match: pd.DataFrame) -> pd.Series:
+    # The team each player made most actions for.
+    return (
+        per_match.groupby(["player", "team"], observed=True)["total_actions"]
+        .sum()
+        .sort_values(ascending=False, kind="stable")
+        .reset_index()
+        .drop_duplicates("player")
+        .set_index("player")["team"]
+    )
+
+
+def player_aggregation(actions: pd.DataFrame) -> pd.DataFrame:
+    return player_totals(player_match_aggregation(actions))
+
+
+def _combine_sums(stats: list[pd.DataFrame], key: str, sum_cols: list[str]) -> pd.DataFrame:
+    combined = pd.concat(stats, ignore_index=True)
+    combined["pressure_actions"] = combined["pressure_action_rate"] * combined["total_actions"]
+    grouped = combined.groupby(key, as_index=False, observed=True)
+    agg = grouped[[*sum_cols, "pressure_actions"]].sum()
+    agg["pressure_action_rate"] = agg.pop("pressure_actions") / agg["total_actions"]
     return agg
 
 
+def combine_player_aggregations(stats: list[pd.DataFrame]) -> pd.DataFrame:
+    # Player tables from disjoint sets of matches: totals and minutes add, rates are re-derived.
+    sum_cols = [
+        "total_xt",
+        "total_actions",
+        "progressive_actions",
+        "goals",
+        "xg",
+        "minutes_in_match",
+    ]
+    agg = _combine_sums(stats, "player", sum_cols)
+    cols = ["player", "total_xt", "total_actions", "progressive_actions", "pressure_action_rate"]
+    agg = _add_per_90(agg[[*cols, "goals", "xg", "minutes_in_match"]])
+    return agg.sort_values("xt_per_90", ascending=False).reset_index(drop=True)
+
+
 def team_aggregation(actions: pd.DataFrame) -> pd.DataFrame:
     agg = (
-        actions.groupby("team", as_index=False)
+        actions.groupby("team", as_index=False, observed=True)
         .agg(
             total_xt=("xt_value", "sum"),
             total_actions=("id", "count"),
@@ -55,24 +162,257 @@ def team_aggregation(actions: pd.DataFrame) -> pd.DataFrame:
     return agg
 
 
-def validate_correlations(player_stats: pd.DataFrame) -> dict[str, float]:
-    valid = player_stats.dropna(subset=["xt_per_90", "goals_per_90", "xg_per_90"])
-    if len(valid) < 3:
+def combine_team_aggregations(stats: list[pd.DataFrame]) -> pd.DataFrame:
+    agg = _combine_sums(stats, "team", ["total_xt", "total_actions", "progressive_actions"])
+    agg = agg[["team", "total_xt", "total_actions", "progressive_actions", "pressure_action_rate"]]
+    return agg.sort_values("total_xt", ascending=False).reset_index(drop=True)
+
+
+@dataclass
+class ZoneCube:
+    """Sparse (entity, start_zone, end_zone, action type, game state) counts and xT sums.
+
+    Rows are grouped by entity (CSR layout), so one entity's cells are a contiguous slice.
+    """
+
+    entities: np.ndarray
+    indptr: np.ndarray
+    cells: np.ndarray
+    counts: np.ndarray
+    xt: np.ndarray
+    grid: tuple[int, int]
+
+    def _position(self, name: str) -> int | None:
+        pos = int(np.searchsorted(self.entities, name))
+        if pos == len(self.entities) or self.entities[pos] != name:
+            return None
+        return pos
+
+    def has_entity(self, name: str) -> bool:
+        return self._position(name) is not None
+
+    def entity_slice(self, name: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        pos = self._position(name)
+        if pos is None:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty.astype(np.float32)
+        lo, hi = self.indptr[pos], self.indptr[pos + 1]
+        return self.cells[lo:hi], self.counts[lo:hi], self.xt[lo:hi]
+
+    def __add__(self, other: ZoneCube) -> ZoneCube:
+        names = [np.repeat(cube.entities, np.diff(cube.indptr)) for cube in (self, other)]
+        return _build_cube(
+            np.concatenate(names),
+            np.concatenate([self.cells, other.cells]),
+            np.concatenate([self.counts, other.counts]),
+            np.concatenate([self.xt, other.xt]),
+            self.grid,
+        )
+
+
+def _n_cells(grid: tuple[int, int]) -> int:
+    n_zones = grid[0] * grid[1]
+    return n_zones * n_zones * len(CUBE_ACTION_TYPES) * len(CUBE_GAME_STATES)
+
+
+def _build_cube(
+    names: np.ndarray, cells: np.ndarray, counts: np.ndarray, xt: np.ndarray, grid: tuple[int, int]
+) -> ZoneCube:
+    entities, entity = np.unique(names.astype(str), return_inverse=True)
+    n_cells = _n_cells(grid)
+    keys, inverse = np.unique(entity.astype(np.int64) * n_cells + cells, return_inverse=True)
+    return ZoneCube(
+        entities=entities,
+        indptr=np.searchsorted(keys // n_cells, np.arange(len(entities) + 1)).astype(np.int64),
+        cells=(keys % n_cells).astype(np.int32),
+        counts=np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int32),
+        xt=np.bincount(inverse, weights=xt, minlength=len(keys)).astype(np.float32),
+        grid=grid,
+    )
+
+
+def zone_cube(actions: pd.DataFrame, key: str, grid: tuple[int, int]) -> ZoneCube:
+    n_zones = grid[0] * grid[1]
+    names = actions[key].to_numpy(dtype=object)
+    start = actions["start_zone"].to_numpy(dtype=np.int64)
+    end = actions["end_zone"].to_numpy(dtype=np.int64)
+    kind = actions["action_type_code"].to_numpy(dtype=np.int64)
+    state = actions["game_state_code"].to_numpy(dtype=np.int64)
+    mask = pd.notna(names) & (start >= 0) & (start < n_zones) & (end >= 0) & (end < n_zones)
+
+    pair = start * n_zones + end
+    cells = (pair * len(CUBE_ACTION_TYPES) + kind) * len(CUBE_GAME_STATES) + state
+    return _build_cube(
+        names[mask],
+        cells[mask],
+        np.ones(int(mask.sum())),
+        actions["xt_value"].to_numpy(dtype=np.float64)[mask],
+        grid,
+    )
+
+
+def cube_heatmap(
+    cube: ZoneCube,
+    name: str,
+    axis: str = "start_zone",
+    action_type: str | None = None,
+    game_state: str | None = None,
+) -> dict[str, list]:
+    """Reduce one entity's cells to a (grid_y, grid_x) map by start or end zone, or zone pairs."""
+    cells, counts, xt = cube.entity_slice(name)
+    n_zones = cube.grid[0] * cube.grid[1]
+    state = cells % len(CUBE_GAME_STATES)
+    kind = cells // len(CUBE_GAME_STATES) % len(CUBE_ACTION_TYPES)
+    pair = cells // (len(CUBE_GAME_STATES) * len(CUBE_ACTION_TYPES))
+
+    keep = np.ones(len(cells), dtype=bool)
+    if action_type is not None:
+        keep &= kind == CUBE_ACTION_TYPES.index(action_type)
+    if game_state is not None:
+        keep &= state == CUBE_GAME_STATES.index(game_state)
+    pair, counts, xt = pair[keep], counts[keep], xt[keep]
+
+    if axis == "pair":
+        pairs, inverse = np.unique(pair, return_inverse=True)
         return {
-            "pearson_xt_goals": np.nan,
-            "spearman_xt_goals": np.nan,
-            "pearson_xt_xg": np.nan,
-            "spearman_xt_xg": np.nan,
+            "start_zone": (pairs // n_zones).tolist(),
+            "end_zone": (pairs % n_zones).tolist(),
+            "count": np.bincount(inverse, weights=counts).astype(int).tolist(),
+            "xt": np.bincount(inverse, weights=xt).tolist(),
         }
 
-    p_g = pearsonr(valid["xt_per_90"], valid["goals_per_90"]).statistic
-    s_g = spearmanr(valid["xt_per_90"], valid["goals_per_90"]).statistic
-    p_xg = pearsonr(valid["xt_per_90"], valid["xg_per_90"]).statistic
-    s_xg = spearmanr(valid["xt_per_90"], valid["xg_per_90"]).statistic
-
+    zone = pair // n_zones if axis == "start_zone" else pair % n_zones
+    zone_counts = np.bincount(zone, weights=counts, minlength=n_zones).astype(int)
     return {
-        "pearson_xt_goals": float(p_g),
-        "spearman_xt_goals": float(s_g),
-        "pearson_xt_xg": float(p_xg),
-        "spearman_xt_xg": float(s_xg),
+        "count": zone_counts.reshape(cube.grid).tolist(),
+        "xt": np.bincount(zone, weights=xt, minlength=n_zones).reshape(cube.grid).tolist(),
     }
+
+
+def save_zone_cube(cube: ZoneCube, path: Path) -> None:
+    np.savez(
+        path,
+        entities=cube.entities,
+        indptr=cube.indptr,
+        cells=cube.cells,
+        counts=cube.counts,
+        xt=cube.xt,
+        grid=np.asarray(cube.grid),
+    )
+
+
+def load_zone_cube(path: Path) -> ZoneCube:
+    with np.load(path) as data:
+        return ZoneCube(
+            entities=data["entities"],
+            indptr=data["indptr"],
+            cells=data["cells"],
+            counts=data["counts"],
+            xt=data["xt"],
+            grid=tuple(int(v) for v in data["grid"]),
+        )
+
+
+def _row_pearson(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (x * y).sum(axis=1) / np.sqrt((x * x).sum(axis=1) * (y * y).sum(axis=1))
+
+
+def _bootstrap_batch(x: np.ndarray, y: np.ndarray, seed: np.random.SeedSequence, size: int):
+    idx = np.random.default_rng(seed).integers(0, len(x), size=(size, len(x)))
+    xs, ys = x[idx], y[idx]
+    # Ties from repeated draws get average ranks, as in spearmanr.
+    return _row_pearson(xs, ys), _row_pearson(rankdata(xs, axis=1), rankdata(ys, axis=1))
+
+
+def bootstrap_correlations(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_samples: int = 1000,
+    ci: float = 0.95,
+    seed: int = 42,
+    workers: int = 1,
+) -> dict[str, tuple[float, float]]:
+    """Percentile CIs for Pearson and Spearman from one (samples, n) resample matrix per batch."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    batch = max(1, BOOTSTRAP_BATCH_CELLS // len(x))
+    sizes = [min(batch, n_samples - start) for start in range(0, n_samples, batch)]
+    # One child seed per batch, so results do not depend on the worker count.
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            batches = zip(seeds, sizes, strict=True)
+            parts = list(pool.map(lambda args: _bootstrap_batch(x, y, *args), batches))
+    else:
+        parts = [_bootstrap_batch(x, y, s, size) for s, size in zip(seeds, sizes, strict=True)]
+
+    q = [(1 - ci) / 2, (1 + ci) / 2]
+    bounds = {}
+    for method, stats in zip(("pearson", "spearman"), zip(*parts, strict=True), strict=True):
+        samples = np.concatenate(stats)
+        samples = samples[~np.isnan(samples)]
+        low, high = np.quantile(samples, q) if len(samples) else (np.nan, np.nan)
+        bounds[method] = (float(low), float(high))
+    return bounds
+
+
+def validate_correlations(
+    player_stats: pd.DataFrame,
+    n_bootstrap: int = 0,
+    ci: float = 0.95,
+    seed: int = 42,
+    workers: int = 1,
+) -> dict[str, float]:
+    valid = player_stats.dropna(subset=["xt_per_90", *CORRELATION_TARGETS.values()])
+    corrs: dict[str, float] = {}
+    for target, col in CORRELATION_TARGETS.items():
+        keys = [f"pearson_xt_{target}", f"spearman_xt_{target}"]
+        if n_bootstrap > 0:
+            keys += [f"{k}_ci_{end}" for k in keys for end in ("low", "high")]
+        if len(valid) < 3:
+            corrs.update(dict.fromkeys(keys, np.nan))
+            continue
+
+        corrs[f"pearson_xt_{target}"] = float(pearsonr(valid["xt_per_90"], valid[col]).statistic)
+        corrs[f"spearman_xt_{target}"] = float(spearmanr(valid["xt_per_90"], valid[col]).statistic)
+        if n_bootstrap > 0:
+            bounds = bootstrap_correlations(
+                valid["xt_per_90"], valid[col], n_bootstrap, ci, seed, workers
+            )
+            for method, (low, high) in bounds.items():
+                corrs[f"{method}_xt_{target}_ci_low"] = low
+                corrs[f"{method}_xt_{target}_ci_high"] = high
+    return corrs
+
+
+def correlations_by_group(
+    player_stats: pd.DataFrame, groups: pd.Series, **kwargs
+) -> dict[str, dict[str, float]]:
+    """validate_correlations per group, with ``groups`` mapping player name to group label."""
+    labels = player_stats["player"].astype(str).map(groups)
+    # Small groups often have no goals at all; their correlations are NaN, not worth a warning.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConstantInputWarning)
+        return {
+            str(label): validate_correlations(part, **kwargs)
+            for label, part in player_stats.groupby(labels, sort=True)
+        }
+
+
+def compute_correlations(
+    player_stats: pd.DataFrame, player_matches: pd.DataFrame, cfg: PipelineConfig
+) -> dict:
+    options = {
+        "n_bootstrap": cfg.bootstrap_samples,
+        "ci": cfg.bootstrap_ci,
+        "seed": cfg.random_state,
+        "workers": cfg.bootstrap_workers,
+    }
+    corrs: dict = validate_correlations(player_stats, **options)
+    # Players are grouped under the team they made most actions for.
+    corrs["correlations_by_team"] = correlations_by_group(
+        player_stats, primary_team(player_matches), **options
+    )
+    return corrs
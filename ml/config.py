@@ -15,10 +15,45 @@ class PipelineConfig:
     goal_left_y: float = 36.0
     goal_right_y: float = 44.0
     xt_iterations: int = 50
+    xt_solver: str = "fixed"  # fixed | tolerance | direct | sparse_iterative
+    xt_tolerance: float = 1e-10
+    xt_max_iterations: int = 1000
+    sparse_transition_zones: int = 1024
+    xt_interpolate: bool = False
+    pressure_radius: float = 5.0
+    pressure_kernel: str = "inverse"  # inverse | linear | gaussian
     shot_lookahead_actions: int = 5
+    hybrid_alpha: float = 0.5  # weight of the zone xT delta; the shot-model delta gets 1 - alpha
+    predict_chunk_rows: int | None = 1_000_000
+    nthread: int | None = None  # XGBoost training and scoring threads; None uses all cores
     test_size: float = 0.2
     random_state: int = 42
+    xgb_n_estimators: int = 400
+    xgb_learning_rate: float = 0.05
+    xgb_max_depth: int = 6
+    xgb_min_child_weight: float = 2.0
+    xgb_subsample: float = 0.9
+    xgb_colsample_bytree: float = 0.9
+    xgb_reg_lambda: float = 1.0
+    xgb_tree_method: str = "hist"
+    xgb_early_stopping_rounds: int | None = None  # None always fits xgb_n_estimators trees
+    xgb_early_stopping_fraction: float = 0.1  # training rows held out to pick the stopping round
+    xgb_external_memory: bool = False  # streaming runs train from parquet chunks via a DataIter
+    bootstrap_samples: int = 1000  # correlation CI resamples; 0 reports point estimates only
+    bootstrap_ci: float = 0.95
+    bootstrap_workers: int = 1  # >1 computes resample batches in a thread pool
+
+    fetch_workers: int = 8
+    process_workers: int = 1  # >1 builds per-match features and labels in a process pool
+    stream_matches_per_chunk: int = 50
+    events_source_dir: Path | None = None  # local StatsBomb open-data "data/" checkout
+    refresh_match_list: bool = False
+
+    keep_releases: int = 3  # versioned copies of the served artifacts kept under artifacts/releases
+    profile_dir: Path | None = None  # per-stage cProfile dumps; timings always go to profile.json
+    sweep_workers: int = 1  # >1 runs independent sweep configurations in a process pool
 
     data_raw_dir: Path = Path("data/raw")
     data_processed_dir: Path = Path("data/processed")
     artifacts_dir: Path = Path("artifacts")
+    sweep_cache_dir: Path = Path("data/sweep_cache")
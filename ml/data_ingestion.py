@@ -1,14 +1,62 @@
 from __future__ import annotations
 
+import json
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from statsbombpy import entities as sb_entities
+from statsbombpy import helpers as sb_helpers
 from statsbombpy import sb
 
 from ml.config import PipelineConfig
 
+JSON_COLUMNS_KEY = b"xt_json_columns"
+FREEZE_FRAME_COLUMNS = ("freeze_frame", "shot_freeze_frame")
+
+# Compact action schema: only these columns survive ingestion.
+ACTION_COLUMNS = [
+    "id",
+    "match_id",
+    "index",
+    "period",
+    "timestamp",
+    "minute",
+    "second",
+    "team",
+    "player",
+    "type",
+    "possession",
+    "start_x",
+    "start_y",
+    "end_x",
+    "end_y",
+    "under_pressure",
+    "pressure_score",
+    "shot_id",
+]
+SHOT_COLUMNS = ("shot_statsbomb_xg", "is_goal")
+EVENT_COLUMNS = [
+    "id",
+    "match_id",
+    "index",
+    "period",
+    "minute",
+    "second",
+    "team",
+    "player",
+    "type",
+    "possession",
+]
+CATEGORY_COLUMNS = ("team", "player", "type")
+INT_COLUMNS = ("match_id", "index", "period", "minute", "second", "possession")
+FLOAT32_COLUMNS = ("start_x", "start_y", "end_x", "end_y", "pressure_score", "shot_statsbomb_xg")
+
 
 @dataclass
 class LoadedData:
@@ -16,6 +64,7 @@ class LoadedData:
     passes: pd.DataFrame
     carries: pd.DataFrame
     shots: pd.DataFrame
+    freeze_frames: pd.DataFrame
 
 
 def _safe_xy(val: Any) -> tuple[float, float]:
@@ -24,107 +73,311 @@ def _safe_xy(val: Any) -> tuple[float, float]:
     return np.nan, np.nan
 
 
-def _extract_pressure_score(row: pd.Series) -> float:
-    freeze = row.get("freeze_frame")
-    start_x = row.get("start_x")
-    start_y = row.get("start_y")
-    if not isinstance(freeze, list) or np.isnan(start_x) or np.isnan(start_y):
-        return 0.0
+def flatten_freeze_frames(events: pd.DataFrame) -> pd.DataFrame:
+    event_ids: list[Any] = []
+    teammates: list[bool] = []
+    xs: list[float] = []
+    ys: list[float] = []
 
-    score = 0.0
-    for actor in freeze:
-        if not isinstance(actor, dict):
-            continue
-        if actor.get("teammate") is True:
-            continue
-        loc = actor.get("location")
-        if not isinstance(loc, list) or len(loc) < 2:
+    seen: set[Any] = set()
+    for col in FREEZE_FRAME_COLUMNS:
+        if col not in events.columns:
             continue
-        dx = float(loc[0]) - float(start_x)
-        dy = float(loc[1]) - float(start_y)
-        d = float(np.hypot(dx, dy))
-        if 0 < d <= 5:
-            score += 1.0 / d
-    return score
-
-
-def _parse_base_columns(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    if "location" not in out.columns:
-        out["location"] = None
-    if "end_location" not in out.columns:
-        out["end_location"] = None
-    out["start_x"], out["start_y"] = zip(*out["location"].map(_safe_xy))
-    out["end_x"], out["end_y"] = zip(*out["end_location"].map(_safe_xy))
-    out["under_pressure"] = out.get("under_pressure", False).fillna(False).astype(int)
-    out["pressure_score"] = out.apply(_extract_pressure_score, axis=1)
-
-    if "timestamp" in out.columns:
-        out["timestamp"] = pd.to_timedelta(out["timestamp"].astype(str), errors="coerce")
+        frames = events[["id", col]].dropna(subset=[col])
+        for event_id, freeze in zip(frames["id"], frames[col], strict=True):
+            if not isinstance(freeze, list) or event_id in seen:
+                continue
+            seen.add(event_id)
+            for actor in freeze:
+                if not isinstance(actor, dict):
+                    continue
+                loc = actor.get("location")
+                if not isinstance(loc, list) or len(loc) < 2:
+                    continue
+                event_ids.append(event_id)
+                teammates.append(actor.get("teammate") is True)
+                xs.append(float(loc[0]))
+                ys.append(float(loc[1]))
+
+    return pd.DataFrame(
+        {
+            "event_id": pd.Series(event_ids, dtype=object),
+            "teammate": np.asarray(teammates, dtype=bool),
+            "x": np.asarray(xs, dtype=float),
+            "y": np.asarray(ys, dtype=float),
+        }
+    )
+
+
+def pressure_scores(
+    freeze_frames: pd.DataFrame,
+    event_ids: pd.Series,
+    start_x: pd.Series,
+    start_y: pd.Series,
+    cfg: PipelineConfig,
+) -> np.ndarray:
+    opponents = freeze_frames[~freeze_frames["teammate"]]
+    row = pd.Index(event_ids).get_indexer(opponents["event_id"])
+    opponents, row = opponents[row >= 0], row[row >= 0]
+
+    dist = np.hypot(
+        opponents["x"].to_numpy() - start_x.to_numpy(dtype=float)[row],
+        opponents["y"].to_numpy() - start_y.to_numpy(dtype=float)[row],
+    )
+    # NaN start locations fail the radius test, matching the old "no location, no pressure" rule.
+    near = (dist > 0) & (dist <= cfg.pressure_radius)
+    dist, row = dist[near], row[near]
+
+    if cfg.pressure_kernel == "inverse":
+        weight = 1.0 / dist
+    elif cfg.pressure_kernel == "linear":
+        weight = 1.0 - dist / cfg.pressure_radius
+    elif cfg.pressure_kernel == "gaussian":
+        weight = np.exp(-0.5 * (dist / (cfg.pressure_radius / 2.0)) ** 2)
+    else:
+        raise ValueError(f"Unknown pressure kernel: {cfg.pressure_kernel!r}")
+
+    return np.bincount(row, weights=weight, minlength=len(event_ids))
+
+
+def link_shots(events: pd.DataFrame) -> np.ndarray:
+    """Id of the shot each pass/carry leads to (via ``related_events``), one-to-one, else None."""
+    linked = np.full(len(events), None, dtype=object)
+    if "related_events" not in events.columns or len(events) == 0:
+        return linked
+
+    src_list: list[int] = []
+    related_ids: list[Any] = []
+    for row, ids in enumerate(events["related_events"]):
+        if isinstance(ids, list):
+            src_list.extend([row] * len(ids))
+            related_ids.extend(ids)
+    src = np.asarray(src_list, dtype=np.int64)
+    dst = pd.Index(events["id"]).get_indexer(related_ids) if related_ids else src
+    src, dst = src[dst >= 0], dst[dst >= 0]
+    # StatsBomb links carry <-> shot in both directions; either side is enough.
+    src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+
+    kind = events["type"].to_numpy(dtype=object)
+    is_action = (kind == "Pass") | (kind == "Carry")
+    player = pd.factorize(events["player"])[0]
+    match = events["match_id"].to_numpy()
+    keep = (
+        is_action[src]
+        & (kind[dst] == "Shot")
+        & (player[src] == player[dst])
+        & (player[src] >= 0)
+        & (match[src] == match[dst])
+    )
+    action, shot = src[keep], dst[keep]
+    if len(action) == 0:
+        return linked
+
+    # Each shot goes to its latest linked action; an action linked to several shots keeps the first.
+    order = np.lexsort((-action, shot))
+    action, shot = action[order], shot[order]
+    first = np.r_[True, shot[1:] != shot[:-1]]
+    action, shot = action[first], shot[first]
+    order = np.lexsort((shot, action))
+    action, shot = action[order], shot[order]
+    first = np.r_[True, action[1:] != action[:-1]]
+
+    linked[action[first]] = events["id"].to_numpy(dtype=object)[shot[first]]
+    return linked
+
+
+def _compact(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy(deep=False)
+    for col in INT_COLUMNS:
+        if col in out.columns:
+            out[col] = pd.to_numeric(out[col], downcast="integer")
+    for col in FLOAT32_COLUMNS:
+        if col in out.columns:
+            out[col] = out[col].astype(np.float32)
+    return out
+
+
+def _parse_base_columns(
+    df: pd.DataFrame,
+    freeze_frames: pd.DataFrame,
+    cfg: PipelineConfig,
+    extra_columns: tuple[str, ...] = (),
+) -> pd.DataFrame:
+    out = pd.DataFrame(index=df.index)
+    missing = pd.Series(None, index=df.index, dtype=object)
+    location = df["location"] if "location" in df.columns else missing
+    end_location = df["end_location"] if "end_location" in df.columns else missing
+    out["start_x"], out["start_y"] = (
+        zip(*location.map(_safe_xy), strict=True) if len(df) else ([], [])
+    )
+    out["end_x"], out["end_y"] = (
+        zip(*end_location.map(_safe_xy), strict=True) if len(df) else ([], [])
+    )
+    under_pressure = df.get("under_pressure", pd.Series(False, index=df.index))
+    out["under_pressure"] = under_pressure.fillna(False).astype(np.int8)
+
+    if "timestamp" in df.columns:
+        out["timestamp"] = pd.to_timedelta(df["timestamp"].astype(str), errors="coerce")
     else:
         out["timestamp"] = pd.to_timedelta("0s")
 
-    out["minute"] = out.get("minute", 0).fillna(0).astype(int)
-    out["second"] = out.get("second", 0).fillna(0).astype(int)
-
-    needed = [
-        "id",
-        "match_id",
-        "index",
-        "period",
-        "timestamp",
-        "minute",
-        "second",
-        "team",
-        "player",
-        "type",
-        "possession",
-        "start_x",
-        "start_y",
-        "end_x",
-        "end_y",
-        "under_pressure",
-        "pressure_score",
+    out["minute"] = df.get("minute", pd.Series(0, index=df.index)).fillna(0).astype(int)
+    out["second"] = df.get("second", pd.Series(0, index=df.index)).fillna(0).astype(int)
+
+    for col in [*ACTION_COLUMNS, *extra_columns]:
+        if col in out.columns:
+            continue
+        out[col] = df[col] if col in df.columns else np.nan
+
+    out["pressure_score"] = pressure_scores(
+        freeze_frames, out["id"], out["start_x"], out["start_y"], cfg
+    )
+    return _compact(out[[*ACTION_COLUMNS, *extra_columns]])
+
+
+def _raw_events_path(cfg: PipelineConfig, match_id: int) -> Path:
+    return cfg.data_raw_dir / f"events_{match_id}.parquet"
+
+
+def _json_or_none(value: Any) -> str | None:
+    return json.dumps(value) if isinstance(value, (list, dict)) else None
+
+
+def _write_parquet_atomic(df: pd.DataFrame, path: Path) -> None:
+    # Nested StatsBomb fields (locations, freeze frames, tactics) are stored as JSON text so they
+    # read back as the same Python lists/dicts the parsers expect.
+    nested = [
+        col
+        for col in df.columns
+        if df[col].dtype == object and df[col].map(lambda v: isinstance(v, (list, dict))).any()
     ]
-    for col in needed:
-        if col not in out.columns:
-            out[col] = np.nan
+    encoded = df.assign(**{col: df[col].map(_json_or_none) for col in nested})
+    table = pa.Table.from_pandas(encoded, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), JSON_COLUMNS_KEY: json.dumps(nested).encode()}
+    tmp_path = path.with_suffix(".tmp")
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    tmp_path.replace(path)
 
-    return out
 
+def _read_parquet(path: Path) -> pd.DataFrame:
+    table = pq.read_table(path)
+    nested = json.loads((table.schema.metadata or {}).get(JSON_COLUMNS_KEY, b"[]"))
+    df = table.to_pandas()
+    for col in nested:
+        df[col] = df[col].map(lambda v: json.loads(v) if isinstance(v, str) else np.nan)
+    return df
+
+
+def _read_local_json(path: Path) -> Any:
+    with path.open(encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def list_match_ids(cfg: PipelineConfig) -> list[int]:
+    cache_path = cfg.data_raw_dir / f"matches_{cfg.competition_id}_{cfg.season_id}.parquet"
+    if cache_path.exists() and not cfg.refresh_match_list:
+        return pd.read_parquet(cache_path)["match_id"].astype(int).tolist()
+
+    if cfg.events_source_dir is not None:
+        matches_dir = Path(cfg.events_source_dir) / "matches" / str(cfg.competition_id)
+        path = matches_dir / f"{cfg.season_id}.json"
+        matches = pd.DataFrame(_read_local_json(path))
+    else:
+        matches = sb.matches(competition_id=cfg.competition_id, season_id=cfg.season_id)
 
-def load_statsbomb_events(cfg: PipelineConfig) -> LoadedData:
-    matches = sb.matches(competition_id=cfg.competition_id, season_id=cfg.season_id)
-    match_ids = matches["match_id"].tolist()
+    matches = matches.assign(match_id=matches["match_id"].astype(int)).sort_values("match_id")
+    keep = [c for c in ("match_id", "match_date") if c in matches.columns]
+    cached = matches[keep].reset_index(drop=True)
+    cfg.data_raw_dir.mkdir(parents=True, exist_ok=True)
+    _write_parquet_atomic(cached, cache_path)
+    return cached["match_id"].tolist()
 
-    all_events: list[pd.DataFrame] = []
-    for match_id in match_ids:
-        events = sb.events(match_id=match_id)
+
+def load_match_dates(cfg: PipelineConfig) -> pd.Series:
+    # Kick-off dates by match_id from the cached match list; empty for caches written without them.
+    cache_path = cfg.data_raw_dir / f"matches_{cfg.competition_id}_{cfg.season_id}.parquet"
+    if not cache_path.exists():
+        return pd.Series(dtype="datetime64[ns]")
+    matches = pd.read_parquet(cache_path)
+    if "match_date" not in matches.columns:
+        return pd.Series(dtype="datetime64[ns]")
+    return pd.to_datetime(matches.set_index("match_id")["match_date"])
+
+
+def _fetch_match_events(match_id: int, cfg: PipelineConfig) -> pd.DataFrame:
+    if cfg.events_source_dir is None:
+        return sb.events(match_id=match_id)
+
+    # Same flattening statsbombpy applies to API responses, run on a local open-data checkout.
+    raw = _read_local_json(Path(cfg.events_source_dir) / "events" / f"{match_id}.json")
+    grouped = sb_helpers.filter_and_group_events(
+        sb_entities.events(raw, match_id), {}, "dataframe", True
+    )
+    frames = [pd.DataFrame(evs) for evs in grouped.values()]
+    return pd.concat(frames, axis=0, ignore_index=True, sort=True) if frames else pd.DataFrame()
+
+
+def cache_match_events(match_id: int, cfg: PipelineConfig) -> Path:
+    path = _raw_events_path(cfg, match_id)
+    if not path.exists():
+        events = _fetch_match_events(match_id, cfg)
         events["match_id"] = match_id
-        all_events.append(events)
+        _write_parquet_atomic(events, path)
+    return path
 
-    events_df = pd.concat(all_events, ignore_index=True)
+
+def load_cached_events(match_ids: list[int], cfg: PipelineConfig) -> pd.DataFrame:
+    cfg.data_raw_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(cfg.fetch_workers, 1)) as pool:
+        paths = list(pool.map(lambda mid: cache_match_events(mid, cfg), match_ids))
+        frames = list(pool.map(_read_parquet, paths))
+    return pd.concat(frames, ignore_index=True)
+
+
+def split_events(events_df: pd.DataFrame, cfg: PipelineConfig) -> LoadedData:
     events_df = events_df.sort_values(["match_id", "period", "minute", "second", "index"]).reset_index(
         drop=True
     )
+    # Shared categories keep pass/carry/shot frames concatenable without falling back to object.
+    for col in CATEGORY_COLUMNS:
+        if col in events_df.columns:
+            events_df[col] = events_df[col].astype("category")
+    events_df["shot_id"] = link_shots(events_df)
 
-    passes = events_df[events_df["type"] == "Pass"].copy()
-    passes["end_location"] = passes.get("pass_end_location")
+    passes = events_df[events_df["type"] == "Pass"]
     pass_outcome = (
         passes["pass_outcome"] if "pass_outcome" in passes.columns else pd.Series(index=passes.index, dtype=object)
     )
-    passes = passes[pass_outcome.isna()].copy()
+    passes = passes[pass_outcome.isna()]
+    passes = passes.assign(end_location=passes.get("pass_end_location"))
 
-    carries = events_df[events_df["type"] == "Carry"].copy()
-    carries["end_location"] = carries.get("carry_end_location")
-    carries = carries[carries["carry_end_location"].notna()].copy()
+    carries = events_df[events_df["type"] == "Carry"]
+    carries = carries[carries["carry_end_location"].notna()]
+    carries = carries.assign(end_location=carries.get("carry_end_location"))
 
-    shots = events_df[events_df["type"] == "Shot"].copy()
-    shots["end_location"] = shots.get("shot_end_location")
-    shots["is_goal"] = (shots.get("shot_outcome") == "Goal").astype(int)
+    shots = events_df[events_df["type"] == "Shot"]
+    shots = shots.assign(
+        end_location=shots.get("shot_end_location"),
+        is_goal=(shots.get("shot_outcome") == "Goal").astype(np.int8),
+    )
+    if "shot_statsbomb_xg" not in shots.columns:
+        shots = shots.assign(shot_statsbomb_xg=np.nan)
+
+    freeze_frames = flatten_freeze_frames(events_df)
+    passes = _parse_base_columns(passes, freeze_frames, cfg)
+    carries = _parse_base_columns(carries, freeze_frames, cfg)
+    shots = _parse_base_columns(shots, freeze_frames, cfg, extra_columns=SHOT_COLUMNS)
+
+    events = events_df.reindex(columns=EVENT_COLUMNS)
+    return LoadedData(
+        events=_compact(events),
+        passes=passes,
+        carries=carries,
+        shots=shots,
+        freeze_frames=freeze_frames,
+    )
 
-    passes = _parse_base_columns(passes)
-    carries = _parse_base_columns(carries)
-    shots = _parse_base_columns(shots)
 
-    return LoadedData(events=events_df, passes=passes, carries=carries, shots=shots)
+def load_statsbomb_events(cfg: PipelineConfig, match_ids: list[int] | None = None) -> LoadedData:
+    match_ids = list_match_ids(cfg) if match_ids is None else match_ids
+    return split_events(load_cached_events(match_ids, cfg), cfg)
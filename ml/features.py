@@ -1,16 +1,20 @@
 from __future__ import annotations
 
+from collections.abc import Iterator
+
 import numpy as np
 import pandas as pd
 
 from ml.config import PipelineConfig
 
+GAME_PHASE_BINS = [-1, 15, 60, 90, 200]
+
 
 def assign_zone(x: pd.Series, y: pd.Series, cfg: PipelineConfig) -> tuple[pd.Series, pd.Series, pd.Series]:
     zx = np.clip((x / cfg.pitch_length * cfg.grid_x).astype(int), 0, cfg.grid_x - 1)
     zy = np.clip((y / cfg.pitch_width * cfg.grid_y).astype(int), 0, cfg.grid_y - 1)
     z = zy * cfg.grid_x + zx
-    return zx, zy, z
+    return zx.astype(np.int16), zy.astype(np.int16), z.astype(np.int16)
 
 
 def _goal_mouth_angle(x: pd.Series, y: pd.Series, cfg: PipelineConfig) -> pd.Series:
@@ -23,80 +27,122 @@ def _goal_mouth_angle(x: pd.Series, y: pd.Series, cfg: PipelineConfig) -> pd.Ser
     return np.arctan2(num, den)
 
 
+def spatial_feature_arrays(
+    start_x: np.ndarray,
+    start_y: np.ndarray,
+    end_x: np.ndarray,
+    end_y: np.ndarray,
+    cfg: PipelineConfig,
+) -> dict[str, np.ndarray]:
+    cols: dict[str, np.ndarray] = {}
+
+    start_zone = assign_zone(start_x, start_y, cfg)
+    cols["start_zone_x"], cols["start_zone_y"], cols["start_zone"] = start_zone
+    cols["end_zone_x"], cols["end_zone_y"], cols["end_zone"] = assign_zone(end_x, end_y, cfg)
+
+    start_dx, start_dy = cfg.goal_center_x - start_x, cfg.goal_center_y - start_y
+    end_dx, end_dy = cfg.goal_center_x - end_x, cfg.goal_center_y - end_y
+    cols["start_goal_distance"] = np.hypot(start_dx, start_dy)
+    cols["end_goal_distance"] = np.hypot(end_dx, end_dy)
+
+    cols["start_goal_direction_angle"] = np.arctan2(start_dy, start_dx)
+    cols["end_goal_direction_angle"] = np.arctan2(end_dy, end_dx)
+
+    cols["start_goal_mouth_angle"] = _goal_mouth_angle(start_x, start_y, cfg)
+    cols["end_goal_mouth_angle"] = _goal_mouth_angle(end_x, end_y, cfg)
+
+    cols["progressive_flag"] = (
+        cols["end_goal_distance"] <= (2.0 / 3.0) * cols["start_goal_distance"]
+    ).astype(np.int8)
+    cols["action_distance"] = np.hypot(end_x - start_x, end_y - start_y)
+    return cols
+
+
 def add_spatial_features(df: pd.DataFrame, cfg: PipelineConfig) -> pd.DataFrame:
-    out = df.copy()
+    cols = spatial_feature_arrays(
+        df["start_x"].to_numpy(),
+        df["start_y"].to_numpy(),
+        df["end_x"].to_numpy(),
+        df["end_y"].to_numpy(),
+        cfg,
+    )
+    # One concat instead of a column insert per feature.
+    base = df.drop(columns=[c for c in cols if c in df.columns])
+    return pd.concat([base, pd.DataFrame(cols, index=df.index)], axis=1)
+
 
-    out["start_zone_x"], out["start_zone_y"], out["start_zone"] = assign_zone(
-        out["start_x"], out["start_y"], cfg
+def iter_match_chunks(df: pd.DataFrame, matches_per_chunk: int) -> Iterator[pd.DataFrame]:
+    match_ids = df["match_id"].drop_duplicates().sort_values().to_numpy()
+    step = max(matches_per_chunk, 1)
+    for start in range(0, len(match_ids), step):
+        yield df[df["match_id"].isin(match_ids[start : start + step])]
+
+
+def _time_key(df: pd.DataFrame) -> np.ndarray:
+    period = df["period"].to_numpy(dtype=np.int64)
+    minute = df["minute"].to_numpy(dtype=np.int64)
+    second = df["second"].to_numpy(dtype=np.int64)
+    return (period * 1_000 + minute) * 100 + second
+
+
+def _goals_up_to(
+    goal_keys: np.ndarray, query_keys: np.ndarray, match_base: np.ndarray
+) -> np.ndarray:
+    goal_keys = np.sort(goal_keys)
+    return np.searchsorted(goal_keys, query_keys, side="right") - np.searchsorted(
+        goal_keys, match_base, side="left"
     )
-    out["end_zone_x"], out["end_zone_y"], out["end_zone"] = assign_zone(out["end_x"], out["end_y"], cfg)
 
-    out["start_goal_distance"] = np.hypot(cfg.goal_center_x - out["start_x"], cfg.goal_center_y - out["start_y"])
-    out["end_goal_distance"] = np.hypot(cfg.goal_center_x - out["end_x"], cfg.goal_center_y - out["end_y"])
 
-    out["start_goal_direction_angle"] = np.arctan2(cfg.goal_center_y - out["start_y"], cfg.goal_center_x - out["start_x"])
-    out["end_goal_direction_angle"] = np.arctan2(cfg.goal_center_y - out["end_y"], cfg.goal_center_x - out["end_x"])
+def build_game_state(
+    actions: pd.DataFrame, shots: pd.DataFrame, matches_per_chunk: int | None = None
+) -> pd.DataFrame:
+    if matches_per_chunk is not None:
+        chunks = [
+            build_game_state(chunk, shots[shots["match_id"].isin(chunk["match_id"].unique())])
+            for chunk in iter_match_chunks(actions, matches_per_chunk)
+        ]
+        return pd.concat(chunks, ignore_index=True) if chunks else build_game_state(actions, shots)
 
-    out["start_goal_mouth_angle"] = _goal_mouth_angle(out["start_x"], out["start_y"], cfg)
-    out["end_goal_mouth_angle"] = _goal_mouth_angle(out["end_x"], out["end_y"], cfg)
+    out = actions.sort_values(["match_id", "period", "minute", "second", "index"])
+    out = out.reset_index(drop=True)
+    goals = shots[shots["is_goal"] == 1]
 
-    out["progressive_flag"] = (
-        out["end_goal_distance"] <= (2.0 / 3.0) * out["start_goal_distance"]
-    ).astype(int)
-    out["action_distance"] = np.hypot(out["end_x"] - out["start_x"], out["end_y"] - out["start_y"])
+    # Home is the first team seen in a match, away the second; matches with one side get no state.
+    sides = out[["match_id", "team"]].dropna().drop_duplicates()
+    sides = sides.assign(side=sides.groupby("match_id").cumcount())
+    sides = sides[sides["side"] < 2]
+    two_sided = sides.groupby("match_id")["side"].transform("size") == 2
+    sides = sides[two_sided.to_numpy()]
 
-    return out
+    match_codes, match_index = pd.factorize(out["match_id"])
+    time_span = 10_000_000
+    match_base = match_codes.astype(np.int64) * time_span
+    action_keys = match_base + _time_key(out)
+
+    goals = goals.merge(sides, on=["match_id", "team"], how="inner")
+    goal_match = match_index.get_indexer(goals["match_id"]).astype(np.int64)
+    goal_keys = goal_match * time_span + _time_key(goals)
+    goal_side = goals["side"].to_numpy()
 
+    home_goals = _goals_up_to(goal_keys[goal_side == 0], action_keys, match_base)
+    away_goals = _goals_up_to(goal_keys[goal_side == 1], action_keys, match_base)
 
-def build_game_state(actions: pd.DataFrame, shots: pd.DataFrame) -> pd.DataFrame:
-    out = actions.copy()
-    goals = shots[shots["is_goal"] == 1][["match_id", "period", "minute", "second", "team"]].copy()
-    goals["goal_for"] = 1
-
-    out = out.sort_values(["match_id", "period", "minute", "second", "index"]).reset_index(drop=True)
-
-    out["home_goals"] = 0
-    out["away_goals"] = 0
-
-    for match_id, group_idx in out.groupby("match_id").groups.items():
-        idx = list(group_idx)
-        match_actions = out.loc[idx].copy()
-        teams = match_actions["team"].dropna().unique().tolist()
-        if len(teams) < 2:
-            continue
-        home_team, away_team = teams[0], teams[1]
-
-        match_goals = goals[goals["match_id"] == match_id].copy()
-        match_goals = match_goals.sort_values(["period", "minute", "second"]) if not match_goals.empty else match_goals
-
-        hg = 0
-        ag = 0
-        gptr = 0
-        gvals = match_goals.to_dict("records")
-
-        for ridx in idx:
-            row = out.loc[ridx]
-            while gptr < len(gvals):
-                g = gvals[gptr]
-                if (
-                    (g["period"], g["minute"], g["second"])
-                    <= (row["period"], row["minute"], row["second"])
-                ):
-                    if g["team"] == home_team:
-                        hg += 1
-                    elif g["team"] == away_team:
-                        ag += 1
-                    gptr += 1
-                else:
-                    break
-            out.at[ridx, "home_goals"] = hg
-            out.at[ridx, "away_goals"] = ag
-            if row["team"] == home_team:
-                diff = hg - ag
-            else:
-                diff = ag - hg
-            out.at[ridx, "score_diff"] = diff
+    home_team = out["match_id"].map(sides[sides["side"] == 0].set_index("match_id")["team"])
+    has_state = home_team.notna().to_numpy()
+    is_home = (out["team"] == home_team).to_numpy()
 
+    out["home_goals"] = np.where(has_state, home_goals, 0).astype(np.int16)
+    out["away_goals"] = np.where(has_state, away_goals, 0).astype(np.int16)
+    out["score_diff"] = np.where(
+        has_state, np.where(is_home, home_goals - away_goals, away_goals - home_goals), np.nan
+    ).astype(np.float32)
+
+    return add_game_context(out)
+
+
+def add_game_context(actions: pd.DataFrame) -> pd.DataFrame:
+    out = actions.copy(deep=False)
     out["game_state"] = np.where(
         out["score_diff"] > 0,
         "winning",
@@ -105,7 +151,7 @@ def build_game_state(actions: pd.DataFrame, shots: pd.DataFrame) -> pd.DataFrame
 
     out["game_phase"] = pd.cut(
         out["minute"],
-        bins=[-1, 15, 60, 90, 200],
+        bins=GAME_PHASE_BINS,
         labels=["early", "mid", "late", "extra"],
     ).astype(str)
 
@@ -113,10 +159,29 @@ def build_game_state(actions: pd.DataFrame, shots: pd.DataFrame) -> pd.DataFrame
 
 
 def encode_context_features(actions: pd.DataFrame) -> pd.DataFrame:
-    out = actions.copy()
-    out["game_state_code"] = out["game_state"].map({"losing": 0, "drawing": 1, "winning": 2}).fillna(1)
-    out["game_phase_code"] = out["game_phase"].map({"early": 0, "mid": 1, "late": 2, "extra": 3}).fillna(1)
-    out["action_type_code"] = out["type"].map({"Pass": 0, "Carry": 1}).fillna(0)
-    out["under_pressure"] = out["under_pressure"].fillna(0).astype(int)
-    out["pressure_score"] = out["pressure_score"].fillna(0.0).astype(float)
+    out = actions.copy(deep=False)
+    game_state = out["game_state"].map({"losing": 0, "drawing": 1, "winning": 2})
+    game_phase = out["game_phase"].map({"early": 0, "mid": 1, "late": 2, "extra": 3})
+    action_type = out["type"].astype(object).map({"Pass": 0, "Carry": 1})
+    out["game_state_code"] = game_state.fillna(1).astype(np.int8)
+    out["game_phase_code"] = game_phase.fillna(1).astype(np.int8)
+    out["action_type_code"] = action_type.fillna(0).astype(np.int8)
+    out["under_pressure"] = out["under_pressure"].fillna(0).astype(np.int8)
+    out["pressure_score"] = out["pressure_score"].fillna(0.0).astype(np.float32)
     return out
+
+
+def context_code_arrays(
+    score_diff: np.ndarray, minute: np.ndarray, action_type: np.ndarray
+) -> dict[str, np.ndarray]:
+    """The ``*_code`` columns of ``add_game_context`` + ``encode_context_features``, from arrays."""
+    score_diff = np.asarray(score_diff, dtype=float)
+    game_state = np.where(score_diff > 0, 2, np.where(score_diff < 0, 0, 1))
+    # pd.cut bins are right-closed; minutes outside them map to "mid" like the unmatched label.
+    phase = np.searchsorted(GAME_PHASE_BINS, np.asarray(minute, dtype=float), side="left") - 1
+    phase = np.where((phase >= 0) & (phase < len(GAME_PHASE_BINS) - 1), phase, 1)
+    return {
+        "game_state_code": game_state.astype(np.int8),
+        "game_phase_code": phase.astype(np.int8),
+        "action_type_code": (np.asarray(action_type, dtype=object) == "Carry").astype(np.int8),
+    }
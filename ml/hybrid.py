@@ -1,15 +1,159 @@
 from __future__ import annotations
 
+from collections.abc import Mapping
+
 import numpy as np
 import pandas as pd
 
+from ml.config import PipelineConfig
+from ml.features import context_code_arrays, spatial_feature_arrays
+from ml.model import TrainedModel, append_start_end_shot_probs, predict_start_end_matrix
+
+SCORE_COLUMNS = ["xt_value", "xt_zone_delta", "xt_ml_delta", "shot_prob_start", "shot_prob_end"]
+
+
+def interpolate_surface(
+    xt_surface: np.ndarray, x: np.ndarray, y: np.ndarray, cfg: PipelineConfig
+) -> np.ndarray:
+    # Bilinear interpolation between zone centres; takes one surface (zones,) or a stack (S, zones).
+    grid = np.asarray(xt_surface, dtype=float).reshape(-1, cfg.grid_y, cfg.grid_x)
+    fx = np.asarray(x, dtype=float) / cfg.pitch_length * cfg.grid_x - 0.5
+    fy = np.asarray(y, dtype=float) / cfg.pitch_width * cfg.grid_y - 0.5
+    fx, fy = np.clip(fx, 0, cfg.grid_x - 1), np.clip(fy, 0, cfg.grid_y - 1)
+    valid = ~(np.isnan(fx) | np.isnan(fy))
+    fx, fy = np.where(valid, fx, 0.0), np.where(valid, fy, 0.0)
+
+    x0, y0 = fx.astype(np.intp), fy.astype(np.intp)
+    x1, y1 = np.minimum(x0 + 1, cfg.grid_x - 1), np.minimum(y0 + 1, cfg.grid_y - 1)
+    wx, wy = fx - x0, fy - y0
+    top = grid[:, y0, x0] * (1 - wx) + grid[:, y0, x1] * wx
+    bottom = grid[:, y1, x0] * (1 - wx) + grid[:, y1, x1] * wx
+    values = np.where(valid, top * (1 - wy) + bottom * wy, np.nan)
+    return values[0] if np.ndim(xt_surface) == 1 else values
 
-def compute_hybrid_xt(actions: pd.DataFrame, xt_surface: np.ndarray, alpha: float = 0.5) -> pd.DataFrame:
-    out = actions.copy()
-    out["xt_zone_start"] = out["start_zone"].astype(int).map(lambda z: float(xt_surface[z]))
-    out["xt_zone_end"] = out["end_zone"].astype(int).map(lambda z: float(xt_surface[z]))
+
+def _surface_lookup(
+    actions: Mapping[str, np.ndarray] | pd.DataFrame,
+    xt_surface: np.ndarray,
+    prefix: str,
+    cfg: PipelineConfig | None,
+    interpolate: bool,
+) -> np.ndarray:
+    zones = np.asarray(actions[f"{prefix}_zone"], dtype=np.intp)
+    values = np.asarray(xt_surface, dtype=float)[..., zones]
+    if not interpolate:
+        return values
+    if cfg is None:
+        raise ValueError(
+            "Interpolated surface lookup needs a PipelineConfig for pitch and grid size."
+        )
+    x = np.asarray(actions[f"{prefix}_x"])
+    y = np.asarray(actions[f"{prefix}_y"])
+    smooth = interpolate_surface(xt_surface, x, y, cfg)
+    # Actions without coordinates keep their zone value.
+    return np.where(np.isnan(smooth), values, smooth)
+
+
+def compute_hybrid_xt(
+    actions: pd.DataFrame,
+    xt_surface: np.ndarray,
+    alpha: float = 0.5,
+    cfg: PipelineConfig | None = None,
+    interpolate: bool = False,
+) -> pd.DataFrame:
+    out = actions.copy(deep=False)
+    out["xt_zone_start"] = _surface_lookup(out, xt_surface, "start", cfg, interpolate)
+    out["xt_zone_end"] = _surface_lookup(out, xt_surface, "end", cfg, interpolate)
     out["xt_zone_delta"] = out["xt_zone_end"] - out["xt_zone_start"]
 
     out["xt_ml_delta"] = out["shot_prob_end"] - out["shot_prob_start"]
     out["xt_value"] = alpha * out["xt_zone_delta"] + (1 - alpha) * out["xt_ml_delta"]
     return out
+
+
+def attach_shot_outcomes(actions: pd.DataFrame, shots: pd.DataFrame) -> pd.DataFrame:
+    # Actions carry the id of the shot they lead to, so shot metadata is a positional gather and
+    # the row count cannot change. Unlinked rows (-1) read the trailing zero.
+    shot_row = pd.Index(shots["id"]).get_indexer(actions["shot_id"])
+    xg = np.append(shots["shot_statsbomb_xg"].fillna(0.0).to_numpy(dtype=np.float32), np.float32(0))
+    is_goal = np.append(shots["is_goal"].to_numpy(dtype=np.int8), np.int8(0))
+    return actions.assign(action_xg=xg[shot_row], is_action_goal=is_goal[shot_row])
+
+
+def score_actions_by_id(
+    actions: pd.DataFrame,
+    shots: pd.DataFrame,
+    trained: TrainedModel,
+    xt_surface: np.ndarray,
+    cfg: PipelineConfig,
+) -> pd.DataFrame:
+    # Pipeline actions with shot_id links: shot probabilities, linked shot outcomes, hybrid xT.
+    actions = append_start_end_shot_probs(
+        actions, trained, chunk_rows=cfg.predict_chunk_rows, nthread=cfg.nthread
+    )
+    return compute_hybrid_xt(
+        attach_shot_outcomes(actions, shots),
+        xt_surface,
+        alpha=cfg.hybrid_alpha,
+        cfg=cfg,
+        interpolate=cfg.xt_interpolate,
+    )
+
+
+def hybrid_xt_variants(
+    actions: pd.DataFrame,
+    xt_surfaces: np.ndarray,
+    alphas: np.ndarray,
+    cfg: PipelineConfig | None = None,
+    interpolate: bool = False,
+) -> np.ndarray:
+    # Hybrid xT for every (surface, alpha) pair, shaped (n_surfaces, n_alphas, n_actions).
+    surfaces = np.atleast_2d(np.asarray(xt_surfaces, dtype=float))
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))[None, :, None]
+
+    zone_delta = _surface_lookup(actions, surfaces, "end", cfg, interpolate) - _surface_lookup(
+        actions, surfaces, "start", cfg, interpolate
+    )
+    start_prob = actions["shot_prob_start"].to_numpy(dtype=float)
+    ml_delta = actions["shot_prob_end"].to_numpy(dtype=float) - start_prob
+    return alphas * zone_delta[:, None, :] + (1 - alphas) * ml_delta[None, None, :]
+
+
+def score_actions(
+    raw: Mapping[str, np.ndarray] | pd.DataFrame,
+    trained: TrainedModel,
+    xt_surface: np.ndarray,
+    cfg: PipelineConfig,
+    alpha: float = 0.5,
+) -> dict[str, np.ndarray]:
+    """Hybrid xT and its components (``SCORE_COLUMNS``) for a batch of raw actions.
+
+    Raw actions carry start/end coordinates, type, pressure, minute and score_diff; game state is
+    taken from score_diff instead of being reconstructed from match goals. Features are built as
+    plain arrays with the pipeline's own definitions, so there is no per-column DataFrame work.
+    """
+    features = {
+        c: np.asarray(raw[c], dtype=np.float32)
+        for c in ("start_x", "start_y", "end_x", "end_y", "under_pressure", "pressure_score")
+    }
+    features.update(
+        spatial_feature_arrays(
+            features["start_x"], features["start_y"], features["end_x"], features["end_y"], cfg
+        )
+    )
+    features.update(context_code_arrays(raw["score_diff"], raw["minute"], raw["type"]))
+    matrix = np.column_stack([features[c] for c in trained.feature_columns]).astype(np.float32)
+    matrix[np.isnan(matrix)] = 0.0
+    # Live batches are small enough that hashing rows for dedup costs about as much as predicting.
+    start_prob, end_prob = predict_start_end_matrix(matrix, trained, dedupe=False)
+
+    start_xt = _surface_lookup(features, xt_surface, "start", cfg, cfg.xt_interpolate)
+    zone_delta = _surface_lookup(features, xt_surface, "end", cfg, cfg.xt_interpolate) - start_xt
+    ml_delta = end_prob - start_prob
+    return {
+        "xt_value": alpha * zone_delta + (1 - alpha) * ml_delta,
+        "xt_zone_delta": zone_delta,
+        "xt_ml_delta": ml_delta,
+        "shot_prob_start": start_prob,
+        "shot_prob_end": end_prob,
+    }
@@ -1,39 +1,182 @@
 from __future__ import annotations
 
+import warnings
+from dataclasses import dataclass, replace
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
 
 from ml.config import PipelineConfig
 
 
-def compute_zone_probabilities(
-    actions: pd.DataFrame, shots: pd.DataFrame, cfg: PipelineConfig
-) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+@dataclass
+class ZoneCounts:
+    shot_counts: np.ndarray
+    move_counts: np.ndarray
+    total_counts: np.ndarray
+    goal_shot_counts: np.ndarray
+    trans_counts: np.ndarray | sparse.csr_matrix
+
+    def __add__(self, other: ZoneCounts) -> ZoneCounts:
+        trans = self.trans_counts + other.trans_counts
+        return ZoneCounts(
+            shot_counts=self.shot_counts + other.shot_counts,
+            move_counts=self.move_counts + other.move_counts,
+            total_counts=self.total_counts + other.total_counts,
+            goal_shot_counts=self.goal_shot_counts + other.goal_shot_counts,
+            trans_counts=trans.tocsr() if sparse.issparse(trans) else trans,
+        )
+
+
+def _valid_zones(
+    frame: pd.DataFrame, columns: list[str], n: int
+) -> tuple[list[np.ndarray], np.ndarray]:
+    zones = [frame[col].to_numpy(dtype=np.int64) for col in columns]
+    mask = np.ones(len(frame), dtype=bool)
+    for z in zones:
+        mask &= (z >= 0) & (z < n)
+    return [z[mask] for z in zones], mask
+
+
+def _weights(frame: pd.DataFrame, weight_col: str | None) -> np.ndarray:
+    if weight_col is None:
+        return np.ones(len(frame))
+    return frame[weight_col].to_numpy(dtype=float)
+
+
+def count_zone_transitions(
+    actions: pd.DataFrame,
+    shots: pd.DataFrame,
+    cfg: PipelineConfig,
+    weight_col: str | None = None,
+) -> ZoneCounts:
+    n = cfg.grid_x * cfg.grid_y
+
+    (start, end), mask = _valid_zones(actions, ["start_zone", "end_zone"], n)
+    move_w = _weights(actions, weight_col)[mask]
+    move_counts = np.bincount(start, weights=move_w, minlength=n)
+
+    if n >= cfg.sparse_transition_zones:
+        trans_counts = sparse.coo_matrix((move_w, (start, end)), shape=(n, n)).tocsr()
+    else:
+        trans_counts = np.bincount(start * n + end, weights=move_w, minlength=n * n).reshape(n, n)
+
+    (shot_zone,), mask = _valid_zones(shots, ["start_zone"], n)
+    shot_w = _weights(shots, weight_col)[mask]
+    is_goal = shots["is_goal"].to_numpy(dtype=float)[mask]
+    shot_counts = np.bincount(shot_zone, weights=shot_w, minlength=n)
+    goal_shot_counts = np.bincount(shot_zone, weights=shot_w * is_goal, minlength=n)
+
+    return ZoneCounts(
+        shot_counts=shot_counts,
+        move_counts=move_counts,
+        total_counts=move_counts + shot_counts,
+        goal_shot_counts=goal_shot_counts,
+        trans_counts=trans_counts,
+    )
+
+
+def save_zone_counts(counts: ZoneCounts, path: Path) -> None:
+    arrays = {
+        "shot_counts": counts.shot_counts,
+        "move_counts": counts.move_counts,
+        "total_counts": counts.total_counts,
+        "goal_shot_counts": counts.goal_shot_counts,
+    }
+    if sparse.issparse(counts.trans_counts):
+        trans = counts.trans_counts.tocsr()
+        arrays.update(trans_data=trans.data, trans_indices=trans.indices, trans_indptr=trans.indptr)
+    else:
+        arrays["trans_counts"] = counts.trans_counts
+    np.savez(path, **arrays)
+
+
+def load_zone_counts(path: Path) -> ZoneCounts:
+    with np.load(path) as data:
+        n = len(data["shot_counts"])
+        if "trans_counts" in data:
+            trans = data["trans_counts"]
+        else:
+            trans = sparse.csr_matrix(
+                (data["trans_data"], data["trans_indices"], data["trans_indptr"]), shape=(n, n)
+            )
+        return ZoneCounts(
+            shot_counts=data["shot_counts"],
+            move_counts=data["move_counts"],
+            total_counts=data["total_counts"],
+            goal_shot_counts=data["goal_shot_counts"],
+            trans_counts=trans,
+        )
+
+
+def _group_codes(
+    actions: pd.DataFrame, shots: pd.DataFrame, group_cols: list[str]
+) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    keys = pd.concat([actions[group_cols], shots[group_cols]], ignore_index=True)
+    codes = keys.groupby(group_cols, sort=True, dropna=True, observed=True).ngroup()
+    codes = codes.fillna(-1).to_numpy(dtype=np.int64)
+    unique = keys.assign(_group=codes)[codes >= 0].drop_duplicates("_group").sort_values("_group")
+    return unique[group_cols].reset_index(drop=True), codes[: len(actions)], codes[len(actions) :]
+
+
+def count_grouped_zone_transitions(
+    actions: pd.DataFrame,
+    shots: pd.DataFrame,
+    cfg: PipelineConfig,
+    group_cols: str | list[str],
+    weight_col: str | None = None,
+) -> tuple[pd.DataFrame, ZoneCounts]:
+    group_cols = [group_cols] if isinstance(group_cols, str) else list(group_cols)
     n = cfg.grid_x * cfg.grid_y
+    keys, action_groups, shot_groups = _group_codes(actions, shots, group_cols)
+    g = len(keys)
+
+    (start, end), mask = _valid_zones(actions, ["start_zone", "end_zone"], n)
+    move_w = _weights(actions, weight_col)[mask]
+    move_group = action_groups[mask]
+    keep = move_group >= 0
+    start, end, move_w, move_group = start[keep], end[keep], move_w[keep], move_group[keep]
+
+    rows = move_group * n + start
+    move_counts = np.bincount(rows, weights=move_w, minlength=g * n).reshape(g, n)
+    if n >= cfg.sparse_transition_zones:
+        # Group blocks stacked row-wise: rows i * n .. (i + 1) * n hold group i's transitions.
+        trans_counts = sparse.coo_matrix((move_w, (rows, end)), shape=(g * n, n)).tocsr()
+    else:
+        trans_counts = np.bincount(
+            rows * n + end, weights=move_w, minlength=g * n * n
+        ).reshape(g, n, n)
 
-    shot_counts = np.zeros(n)
-    move_counts = np.zeros(n)
-    total_counts = np.zeros(n)
-    goal_shot_counts = np.zeros(n)
-
-    trans_counts = np.zeros((n, n))
-
-    for _, row in actions.iterrows():
-        s = int(row["start_zone"])
-        e = int(row["end_zone"])
-        if s < 0 or s >= n or e < 0 or e >= n:
-            continue
-        total_counts[s] += 1
-        move_counts[s] += 1
-        trans_counts[s, e] += 1
-
-    for _, row in shots.iterrows():
-        s = int(row["start_zone"])
-        if s < 0 or s >= n:
-            continue
-        total_counts[s] += 1
-        shot_counts[s] += 1
-        goal_shot_counts[s] += int(row["is_goal"])
+    (shot_zone,), mask = _valid_zones(shots, ["start_zone"], n)
+    shot_w = _weights(shots, weight_col)[mask]
+    is_goal = shots["is_goal"].to_numpy(dtype=float)[mask]
+    shot_group = shot_groups[mask]
+    keep = shot_group >= 0
+    flat = shot_group[keep] * n + shot_zone[keep]
+    shot_counts = np.bincount(flat, weights=shot_w[keep], minlength=g * n).reshape(g, n)
+    goal_w = (shot_w * is_goal)[keep]
+    goal_shot_counts = np.bincount(flat, weights=goal_w, minlength=g * n).reshape(g, n)
+
+    return keys, ZoneCounts(
+        shot_counts=shot_counts,
+        move_counts=move_counts,
+        total_counts=move_counts + shot_counts,
+        goal_shot_counts=goal_shot_counts,
+        trans_counts=trans_counts,
+    )
+
+
+def zone_probabilities_from_counts(
+    counts: ZoneCounts,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray | sparse.csr_matrix]:
+    shot_counts = counts.shot_counts
+    move_counts = counts.move_counts
+    total_counts = counts.total_counts
+    goal_shot_counts = counts.goal_shot_counts
+    trans_counts = counts.trans_counts
 
     shot_prob = np.divide(shot_counts, total_counts, out=np.zeros_like(shot_counts), where=total_counts > 0)
     move_prob = np.divide(move_counts, total_counts, out=np.zeros_like(move_counts), where=total_counts > 0)
@@ -44,22 +187,240 @@ def compute_zone_probabilities(
         where=shot_counts > 0,
     )
 
-    row_sums = trans_counts.sum(axis=1, keepdims=True)
+    if sparse.issparse(trans_counts):
+        row_sums = np.asarray(trans_counts.sum(axis=1)).ravel()
+        inv = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+        trans = sparse.diags(inv) @ trans_counts
+        return shot_prob, move_prob, goal_prob, trans.tocsr()
+
+    row_sums = trans_counts.sum(axis=-1, keepdims=True)
     trans = np.divide(trans_counts, row_sums, out=np.zeros_like(trans_counts), where=row_sums > 0)
 
     return shot_prob, move_prob, goal_prob, trans
 
 
+def compute_zone_probabilities(
+    actions: pd.DataFrame,
+    shots: pd.DataFrame,
+    cfg: PipelineConfig,
+    weight_col: str | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray | sparse.csr_matrix]:
+    counts = count_zone_transitions(actions, shots, cfg, weight_col=weight_col)
+    return zone_probabilities_from_counts(counts)
+
+
+@dataclass
+class XtSolution:
+    xt: np.ndarray
+    solver: str
+    iterations: int
+    residual: float
+
+
+def _bellman_residual(
+    xt: np.ndarray,
+    reward: np.ndarray,
+    move_prob: np.ndarray,
+    transition: np.ndarray | sparse.csr_matrix,
+) -> float:
+    return float(np.max(np.abs(reward + move_prob * (transition @ xt) - xt), initial=0.0))
+
+
+def _reaching_zones(
+    reward: np.ndarray, move_prob: np.ndarray, transition: np.ndarray | sparse.csr_matrix
+) -> np.ndarray:
+    # Zones with a positive-probability path to a zone that yields goals; every other zone has xT 0.
+    if sparse.issparse(transition):
+        steps = sparse.diags(move_prob) @ transition
+
+        def _spread(mask: np.ndarray) -> np.ndarray:
+            return steps @ mask
+    else:
+        steps = move_prob[..., None] * transition
+
+        def _spread(mask: np.ndarray) -> np.ndarray:
+            return np.matmul(steps, mask[..., None])[..., 0]
+
+    reach = reward > 0
+    while True:
+        grown = reach | (_spread(reach.astype(float)) > 0)
+        if np.array_equal(grown, reach):
+            return reach
+        reach = grown
+
+
+def _linear_xt(
+    reward: np.ndarray,
+    move_prob: np.ndarray,
+    transition: np.ndarray | sparse.csr_matrix,
+    cfg: PipelineConfig,
+) -> tuple[np.ndarray | None, int]:
+    n = len(reward)
+    iterations = 0
+    # Dropping the moves of zones that never reach a shot turns their rows into identity rows
+    # (xT 0), so pure self-loops (move_prob 1) no longer make I - diag(m)T singular.
+    move_prob = np.where(_reaching_zones(reward, move_prob, transition), move_prob, 0.0)
+
+    if cfg.xt_solver == "direct":
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", sparse_linalg.MatrixRankWarning)
+            if sparse.issparse(transition):
+                system = sparse.identity(n, format="csc") - sparse.diags(move_prob) @ transition
+                return sparse_linalg.spsolve(system.tocsc(), reward), iterations
+            try:
+                xt = np.linalg.solve(np.eye(n) - move_prob[:, None] * transition, reward)
+            except np.linalg.LinAlgError:
+                return None, iterations
+            return xt, iterations
+
+    steps = sparse.diags(move_prob) @ sparse.csr_matrix(transition)
+    system = sparse.identity(n, format="csr") - steps
+
+    def _count(_: np.ndarray) -> None:
+        nonlocal iterations
+        iterations += 1
+
+    xt, info = sparse_linalg.bicgstab(
+        system, reward, rtol=cfg.xt_tolerance, maxiter=cfg.xt_max_iterations, callback=_count
+    )
+    return (xt if info == 0 else None), iterations
+
+
+def solve_xt(
+    shot_prob: np.ndarray,
+    move_prob: np.ndarray,
+    goal_prob: np.ndarray,
+    transition: np.ndarray | sparse.csr_matrix,
+    cfg: PipelineConfig,
+) -> XtSolution:
+    reward = shot_prob * goal_prob
+    iterations = 0
+
+    if cfg.xt_solver in ("fixed", "tolerance"):
+        max_iter = cfg.xt_iterations if cfg.xt_solver == "fixed" else cfg.xt_max_iterations
+        xt = np.zeros_like(shot_prob, dtype=float)
+        for _ in range(max_iter):
+            updated = reward + move_prob * (transition @ xt)
+            iterations += 1
+            delta = np.max(np.abs(updated - xt), initial=0.0)
+            xt = updated
+            if cfg.xt_solver == "tolerance" and delta <= cfg.xt_tolerance:
+                break
+    elif cfg.xt_solver in ("direct", "sparse_iterative"):
+        xt, iterations = _linear_xt(reward, move_prob, transition, cfg)
+        if xt is None or not np.all(np.isfinite(xt)):
+            # Numerically singular or non-converged: value iteration still has a fixed point.
+            fallback = replace(cfg, xt_solver="tolerance")
+            return solve_xt(shot_prob, move_prob, goal_prob, transition, fallback)
+    else:
+        raise ValueError(f"Unknown xT solver: {cfg.xt_solver!r}")
+
+    xt = np.asarray(xt, dtype=float)
+    return XtSolution(
+        xt=xt,
+        solver=cfg.xt_solver,
+        iterations=iterations,
+        residual=_bellman_residual(xt, reward, move_prob, transition),
+    )
+
+
 def value_iteration(
     shot_prob: np.ndarray,
     move_prob: np.ndarray,
     goal_prob: np.ndarray,
-    transition: np.ndarray,
+    transition: np.ndarray | sparse.csr_matrix,
     cfg: PipelineConfig,
 ) -> np.ndarray:
-    xt = np.zeros_like(shot_prob, dtype=float)
+    return solve_xt(shot_prob, move_prob, goal_prob, transition, cfg).xt
+
+
+@dataclass
+class SurfaceBatch:
+    keys: pd.DataFrame
+    surfaces: np.ndarray
+    solver: str
+    iterations: int
+    residuals: np.ndarray
+
+
+def _group_transition(
+    transition: np.ndarray | sparse.csr_matrix, i: int, n: int
+) -> np.ndarray | sparse.csr_matrix:
+    if sparse.issparse(transition):
+        return transition[i * n : (i + 1) * n]
+    return transition[i]
+
+
+def solve_xt_batch(
+    shot_prob: np.ndarray,
+    move_prob: np.ndarray,
+    goal_prob: np.ndarray,
+    transition: np.ndarray | sparse.csr_matrix,
+    cfg: PipelineConfig,
+) -> tuple[np.ndarray, int, np.ndarray]:
+    reward = shot_prob * goal_prob
+    g, n = reward.shape
+    iterations = 0
+
+    def _solve_group(i: int) -> XtSolution:
+        group_transition = _group_transition(transition, i, n)
+        return solve_xt(shot_prob[i], move_prob[i], goal_prob[i], group_transition, cfg)
+
+    if sparse.issparse(transition) or cfg.xt_solver == "sparse_iterative":
+        # Large grids keep one sparse system per group instead of a dense (g, n, n) tensor.
+        solutions = [_solve_group(i) for i in range(g)]
+        xt = np.stack([sol.xt for sol in solutions]) if solutions else np.zeros((0, n))
+        iterations = max((sol.iterations for sol in solutions), default=0)
+        return xt, iterations, np.array([sol.residual for sol in solutions])
+
+    if cfg.xt_solver in ("fixed", "tolerance"):
+        max_iter = cfg.xt_iterations if cfg.xt_solver == "fixed" else cfg.xt_max_iterations
+        xt = np.zeros((g, n))
+        for _ in range(max_iter):
+            updated = reward + move_prob * np.matmul(transition, xt[:, :, None])[:, :, 0]
+            iterations += 1
+            delta = np.max(np.abs(updated - xt), initial=0.0)
+            xt = updated
+            if cfg.xt_solver == "tolerance" and delta <= cfg.xt_tolerance:
+                break
+    elif cfg.xt_solver == "direct":
+        # Same dead-end reduction as solve_xt, applied to every group at once.
+        active = np.where(_reaching_zones(reward, move_prob, transition), move_prob, 0.0)
+        system = np.eye(n)[None, :, :] - active[:, :, None] * transition
+        try:
+            xt = np.linalg.solve(system, reward[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            xt = np.full((g, n), np.nan)
+        # A singular group only re-solves itself (with solve_xt's fallback), not the batch.
+        for i in np.flatnonzero(~np.isfinite(xt).all(axis=1)):
+            solution = _solve_group(i)
+            xt[i] = solution.xt
+            iterations = max(iterations, solution.iterations)
+    else:
+        raise ValueError(f"Unknown xT solver: {cfg.xt_solver!r}")
 
-    for _ in range(cfg.xt_iterations):
-        xt = shot_prob * goal_prob + move_prob * (transition @ xt)
+    bellman = reward + move_prob * np.matmul(transition, xt[:, :, None])[:, :, 0] - xt
+    return xt, iterations, np.max(np.abs(bellman), axis=1, initial=0.0)
 
-    return xt
+
+def compute_grouped_surfaces(
+    actions: pd.DataFrame,
+    shots: pd.DataFrame,
+    cfg: PipelineConfig,
+    group_cols: str | list[str],
+    weight_col: str | None = None,
+) -> SurfaceBatch:
+    keys, counts = count_grouped_zone_transitions(
+        actions, shots, cfg, group_cols, weight_col=weight_col
+    )
+    shot_prob, move_prob, goal_prob, transition = zone_probabilities_from_counts(counts)
+    surfaces, iterations, residuals = solve_xt_batch(
+        shot_prob, move_prob, goal_prob, transition, cfg
+    )
+    return SurfaceBatch(
+        keys=keys,
+        surfaces=surfaces,
+        solver=cfg.xt_solver,
+        iterations=iterations,
+        residuals=residuals,
+    )
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+from collections.abc import Callable, Iterable
 from dataclasses import dataclass
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
@@ -11,6 +13,9 @@ from sklearn.model_selection import train_test_split
 from ml.config import PipelineConfig
 
 
+MODEL_FILENAME = "xgboost_shot_model.ubj"  # XGBoost native UBJSON
+TARGET_COLUMN = "target_shot_next_5"
+
 FEATURE_COLUMNS = [
     "start_zone",
     "end_zone",
@@ -35,27 +40,79 @@ class TrainedModel:
     model: xgb.XGBClassifier
     feature_columns: list[str]
     validation_auc: float
+    best_iteration: int | None = None
+
+
+def build_shot_lookahead_targets(
+    events: pd.DataFrame, actions: pd.DataFrame, lookaheads: Iterable[int]
+) -> pd.DataFrame:
+    keys = ["match_id", "team", "possession"]
+    ev = events[[*keys, "index", "type"]].dropna(subset=[*keys, "index"])
+    ev = ev.assign(_group=ev.groupby(keys, sort=False, observed=True).ngroup())
+    ev = ev.sort_values(["_group", "index"], kind="stable")
+
+    groups = ev[[*keys, "_group"]].drop_duplicates(subset="_group")
+    act_group = actions[keys].merge(groups, on=keys, how="left")["_group"].to_numpy()
+    act_index = pd.to_numeric(actions["index"], errors="coerce").to_numpy(dtype=float)
+
+    ev_group = ev["_group"].to_numpy(dtype=np.int64)
+    ev_index = ev["index"].to_numpy(dtype=float)
+    n_events = len(ev)
+
+    # Per-group composite key so a single searchsorted locates the first event after each action.
+    low = ev_index.min() if n_events else 0.0
+    span = (ev_index.max() - low + 2.0) if n_events else 1.0
+    ev_key = ev_group * span + (ev_index - low)
+    valid = ~np.isnan(act_group) & ~np.isnan(act_index)
+    act_offset = np.clip(np.nan_to_num(act_index) - low, -0.5, span - 1.0)
+    act_key = np.where(valid, np.nan_to_num(act_group) * span + act_offset, -1.0)
+    first_after = np.searchsorted(ev_key, act_key, side="right")
+
+    n_groups = ev_group.max() + 1 if n_events else 0
+    group_end = np.searchsorted(ev_group, np.arange(n_groups), side="right")
+    act_group_end = np.zeros(len(actions), dtype=np.int64)
+    act_group_end[valid] = group_end[act_group[valid].astype(np.int64)]
+
+    # Position of the next shot at or after each event position (n_events when none remain).
+    positions = np.where(ev["type"].to_numpy() == "Shot", np.arange(n_events), n_events)
+    next_shot = np.append(np.minimum.accumulate(positions[::-1])[::-1], n_events)[first_after]
+    no_shot = np.iinfo(np.int64).max
+    gap = np.where(valid & (next_shot < act_group_end), next_shot - first_after, no_shot)
+
+    return pd.DataFrame(
+        {f"target_shot_next_{n}": (gap < n).astype(np.int8) for n in lookaheads},
+        index=actions.index,
+    )
 
 
 def build_shot_lookahead_target(events: pd.DataFrame, actions: pd.DataFrame, lookahead: int) -> pd.Series:
-    ev = events[["match_id", "index", "team", "possession", "type"]].copy()
-    ev = ev.sort_values(["match_id", "index"]).reset_index(drop=True)
+    targets = build_shot_lookahead_targets(events, actions, [lookahead])
+    return targets[f"target_shot_next_{lookahead}"].rename(None)
+
 
-    labels = []
-    for _, act in actions.iterrows():
-        subset = ev[
-            (ev["match_id"] == act["match_id"])
-            & (ev["team"] == act["team"])
-            & (ev["possession"] == act["possession"])
-            & (ev["index"] > act["index"])
-        ].head(lookahead)
-        labels.append(int((subset["type"] == "Shot").any()))
-    return pd.Series(labels, index=actions.index, dtype=int)
+def _xgb_params(cfg: PipelineConfig) -> dict:
+    return {
+        "objective": "binary:logistic",
+        "eval_metric": "auc",
+        "tree_method": cfg.xgb_tree_method,
+        "learning_rate": cfg.xgb_learning_rate,
+        "max_depth": cfg.xgb_max_depth,
+        "min_child_weight": cfg.xgb_min_child_weight,
+        "subsample": cfg.xgb_subsample,
+        "colsample_bytree": cfg.xgb_colsample_bytree,
+        "reg_lambda": cfg.xgb_reg_lambda,
+    }
+
+
+def best_iteration(booster: xgb.Booster) -> int:
+    # Set by early stopping; otherwise every boosted round is used.
+    best = booster.attr("best_iteration")
+    return int(best) if best is not None else booster.num_boosted_rounds() - 1
 
 
 def train_xgboost(actions: pd.DataFrame, cfg: PipelineConfig) -> TrainedModel:
     X = actions[FEATURE_COLUMNS].fillna(0.0)
-    y = actions["target_shot_next_5"].astype(int)
+    y = actions[TARGET_COLUMN].astype(int)
 
     X_train, X_val, y_train, y_val = train_test_split(
         X,
@@ -65,45 +122,230 @@ def train_xgboost(actions: pd.DataFrame, cfg: PipelineConfig) -> TrainedModel:
         stratify=y,
     )
 
+    eval_set = [(X_val, y_val)]
+    if cfg.xgb_early_stopping_rounds is not None:
+        # The stopping round is picked on rows split off the training set, so X_val stays unseen
+        # and validation_auc is not biased towards the chosen iteration.
+        X_train, X_stop, y_train, y_stop = train_test_split(
+            X_train,
+            y_train,
+            test_size=cfg.xgb_early_stopping_fraction,
+            random_state=cfg.random_state,
+            stratify=y_train,
+        )
+        eval_set = [(X_stop, y_stop)]
+
     model = xgb.XGBClassifier(
-        n_estimators=400,
-        learning_rate=0.05,
-        max_depth=6,
-        min_child_weight=2,
-        subsample=0.9,
-        colsample_bytree=0.9,
-        reg_lambda=1.0,
-        objective="binary:logistic",
-        eval_metric="auc",
+        n_estimators=cfg.xgb_n_estimators,
+        early_stopping_rounds=cfg.xgb_early_stopping_rounds,
+        n_jobs=cfg.nthread,
         random_state=cfg.random_state,
+        **_xgb_params(cfg),
     )
 
     model.fit(
         X_train,
         y_train,
-        eval_set=[(X_val, y_val)],
+        eval_set=eval_set,
         verbose=False,
     )
 
+    # With early stopping, predict_proba already stops at the best iteration.
     val_pred = model.predict_proba(X_val)[:, 1]
     auc = float(roc_auc_score(y_val, val_pred)) if len(np.unique(y_val)) > 1 else 0.5
 
-    return TrainedModel(model=model, feature_columns=FEATURE_COLUMNS, validation_auc=auc)
+    return TrainedModel(
+        model=model,
+        feature_columns=FEATURE_COLUMNS,
+        validation_auc=auc,
+        best_iteration=best_iteration(model.get_booster()),
+    )
+
+
+TRAIN, EARLY_STOPPING, VALIDATION = 0, 1, 2
+
+
+def _row_roles(n_rows: int, cfg: PipelineConfig, chunk: int) -> np.ndarray:
+    # Seeded per chunk, so every pass over the chunks draws the same split. Validation rows are a
+    # test_size share; with early stopping, a share of the remaining rows picks the stopping round.
+    draw = np.random.default_rng([cfg.random_state, chunk]).random(n_rows)
+    roles = np.where(draw < cfg.test_size, VALIDATION, TRAIN)
+    if cfg.xgb_early_stopping_rounds is not None:
+        stop_below = cfg.test_size + (1 - cfg.test_size) * cfg.xgb_early_stopping_fraction
+        roles[(draw >= cfg.test_size) & (draw < stop_below)] = EARLY_STOPPING
+    return roles
+
+
+def _read_training_chunk(
+    path: Path, cfg: PipelineConfig, chunk: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    frame = pd.read_parquet(path, columns=[*FEATURE_COLUMNS, TARGET_COLUMN])
+    X = frame[FEATURE_COLUMNS].fillna(0.0).to_numpy(dtype=np.float32)
+    y = frame[TARGET_COLUMN].to_numpy(dtype=np.int8)
+    return X, y, _row_roles(len(frame), cfg, chunk)
+
 
+class ParquetChunkIter(xgb.DataIter):
+    """Feeds XGBoost one parquet chunk at a time: the rows of each with one ``_row_roles`` role."""
 
-def append_start_end_shot_probs(actions: pd.DataFrame, trained: TrainedModel) -> pd.DataFrame:
-    out = actions.copy()
+    def __init__(
+        self, paths: list[Path], cfg: PipelineConfig, role: int, cache_prefix: Path
+    ) -> None:
+        self._paths = paths
+        self._cfg = cfg
+        self._role = role
+        self._chunk = 0
+        super().__init__(cache_prefix=str(cache_prefix))
 
-    base = out[trained.feature_columns].fillna(0.0).copy()
-    end_prob = trained.model.predict_proba(base)[:, 1]
+    def next(self, input_data: Callable) -> bool:
+        if self._chunk == len(self._paths):
+            return False
+        X, y, roles = _read_training_chunk(self._paths[self._chunk], self._cfg, self._chunk)
+        keep = roles == self._role
+        input_data(data=X[keep], label=y[keep])
+        self._chunk += 1
+        return True
 
-    start_state = base.copy()
-    start_state["end_zone"] = start_state["start_zone"]
-    start_state["end_goal_distance"] = start_state["start_goal_distance"]
-    start_state["end_goal_direction_angle"] = start_state["start_goal_direction_angle"]
-    start_state["end_goal_mouth_angle"] = start_state["start_goal_mouth_angle"]
-    start_prob = trained.model.predict_proba(start_state)[:, 1]
+    def reset(self) -> None:
+        self._chunk = 0
 
+
+def train_xgboost_external(paths: list[Path], cfg: PipelineConfig, cache_dir: Path) -> TrainedModel:
+    """Train from parquet chunks with XGBoost external memory; only one chunk is in RAM at a time.
+
+    Validation rows are a seeded random ``test_size`` share of each chunk (not stratified). They
+    are only used for ``validation_auc``; early stopping watches its own share of training rows.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    external = hasattr(xgb, "ExtMemQuantileDMatrix")  # xgboost >= 3.0, hist only
+    train_iter = ParquetChunkIter(paths, cfg, TRAIN, cache_prefix=cache_dir / "train")
+    if external:
+        dtrain = xgb.ExtMemQuantileDMatrix(train_iter, nthread=cfg.nthread)
+    else:
+        dtrain = xgb.DMatrix(train_iter, nthread=cfg.nthread)
+    evals = []
+    if cfg.xgb_early_stopping_rounds is not None:
+        stop_iter = ParquetChunkIter(
+            paths, cfg, EARLY_STOPPING, cache_prefix=cache_dir / "early_stopping"
+        )
+        if external:
+            dstop = xgb.ExtMemQuantileDMatrix(stop_iter, ref=dtrain, nthread=cfg.nthread)
+        else:
+            dstop = xgb.DMatrix(stop_iter, nthread=cfg.nthread)
+        evals = [(dstop, "early_stopping")]
+
+    params = {**_xgb_params(cfg), "seed": cfg.random_state}
+    if cfg.nthread is not None:
+        params["nthread"] = cfg.nthread
+    booster = xgb.train(
+        params,
+        dtrain,
+        num_boost_round=cfg.xgb_n_estimators,
+        evals=evals,
+        early_stopping_rounds=cfg.xgb_early_stopping_rounds,
+        verbose_eval=False,
+    )
+
+    # Wrapped as a classifier so scoring and saving match the in-memory path.
+    model = xgb.XGBClassifier()
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    preds, labels = [], []
+    for chunk, path in enumerate(paths):
+        X, y, roles = _read_training_chunk(path, cfg, chunk)
+        is_val = roles == VALIDATION
+        if is_val.any():
+            preds.append(model.predict_proba(X[is_val])[:, 1])
+            labels.append(y[is_val])
+    y_val = np.concatenate(labels) if labels else np.zeros(0, dtype=np.int8)
+    auc = float(roc_auc_score(y_val, np.concatenate(preds))) if len(np.unique(y_val)) > 1 else 0.5
+
+    return TrainedModel(
+        model=model,
+        feature_columns=FEATURE_COLUMNS,
+        validation_auc=auc,
+        best_iteration=best_iteration(booster),
+    )
+
+
+def load_shot_model(path: Path) -> xgb.XGBClassifier:
+    model = xgb.XGBClassifier()
+    model.load_model(path)
+    return model
+
+
+# Start-state proxy: the action's end spatial fields replaced by its start fields.
+START_STATE_COLUMNS = {
+    "end_zone": "start_zone",
+    "end_goal_distance": "start_goal_distance",
+    "end_goal_direction_angle": "start_goal_direction_angle",
+    "end_goal_mouth_angle": "start_goal_mouth_angle",
+}
+
+
+def _unique_rows(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Hash-based dedup; verified against the matrix so a 64-bit collision falls back to np.unique.
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(matrix), index=False).to_numpy()
+    codes, uniques = pd.factorize(hashes)
+    first = np.full(len(uniques), len(matrix), dtype=np.int64)
+    np.minimum.at(first, codes, np.arange(len(matrix)))
+    unique_rows = matrix[first]
+    if not np.array_equal(unique_rows[codes], matrix):
+        unique_rows, codes = np.unique(matrix, axis=0, return_inverse=True)
+    return unique_rows, codes.ravel()
+
+
+def _predict_positive(
+    model: xgb.XGBClassifier, matrix: np.ndarray, chunk_rows: int | None, nthread: int | None
+) -> np.ndarray:
+    if nthread is not None:
+        model.set_params(n_jobs=nthread)
+    step = chunk_rows or len(matrix) or 1
+    chunks = [model.predict_proba(matrix[i : i + step])[:, 1] for i in range(0, len(matrix), step)]
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+
+def predict_start_end_shot_probs(
+    actions: pd.DataFrame,
+    trained: TrainedModel,
+    chunk_rows: int | None = None,
+    nthread: int | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    base = actions[trained.feature_columns].fillna(0.0).to_numpy(dtype=np.float32)
+    return predict_start_end_matrix(base, trained, chunk_rows=chunk_rows, nthread=nthread)
+
+
+def predict_start_end_matrix(
+    features: np.ndarray,
+    trained: TrainedModel,
+    chunk_rows: int | None = None,
+    nthread: int | None = None,
+    dedupe: bool = True,
+) -> tuple[np.ndarray, np.ndarray]:
+    # features: float32 rows in trained.feature_columns order, NaN already replaced by 0.
+    columns = {name: i for i, name in enumerate(trained.feature_columns)}
+    start = features.copy()
+    for end_col, start_col in START_STATE_COLUMNS.items():
+        start[:, columns[end_col]] = features[:, columns[start_col]]
+    stacked = np.vstack([start, features])
+    if dedupe:
+        # Start states repeat heavily (same zone, geometry and context): score distinct rows only.
+        unique_rows, codes = _unique_rows(stacked)
+        probs = _predict_positive(trained.model, unique_rows, chunk_rows, nthread)[codes]
+    else:
+        probs = _predict_positive(trained.model, stacked, chunk_rows, nthread)
+    return probs[: len(features)], probs[len(features) :]
+
+
+def append_start_end_shot_probs(
+    actions: pd.DataFrame,
+    trained: TrainedModel,
+    chunk_rows: int | None = None,
+    nthread: int | None = None,
+) -> pd.DataFrame:
+    out = actions.copy(deep=False)
+    start_prob, end_prob = predict_start_end_shot_probs(
+        out, trained, chunk_rows=chunk_rows, nthread=nthread
+    )
     out["shot_prob_start"] = start_prob
     out["shot_prob_end"] = end_prob
     return out
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+
+from ml.config import PipelineConfig
+
+SHARDS_PER_WORKER = 4
+
+
+def frame_to_ipc(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def frame_from_ipc(payload: bytes) -> pd.DataFrame:
+    table = pa.ipc.open_stream(payload).read_all()
+    df = table.to_pandas()
+    # Arrow strings come back as the str dtype; restore columns the sender held as object.
+    columns = (table.schema.pandas_metadata or {}).get("columns", [])
+    object_cols = [c["name"] for c in columns if c["numpy_type"] == "object" and c["name"] in df]
+    return df.astype(dict.fromkeys(object_cols, object)) if object_cols else df
+
+
+def concat_ipc_frames(payloads: list[bytes]) -> pd.DataFrame:
+    frames = [frame_from_ipc(p) for p in payloads]
+    first = frames[0]
+    categorical = [c for c in first.columns if isinstance(first[c].dtype, pd.CategoricalDtype)]
+    out = pd.concat(frames, ignore_index=True)
+    # Shards carry their own dictionaries (all values loaded for the shard, observed or not); their
+    # sorted union is the dictionary a single-process run builds.
+    for col in categorical:
+        out[col] = union_categoricals([f[col] for f in frames], sort_categories=True)
+    return out
+
+
+def shard_match_ids(match_ids: list[int], n_shards: int) -> list[list[int]]:
+    ordered = sorted(int(m) for m in match_ids)
+    n_shards = max(1, min(n_shards, len(ordered)))
+    bounds = np.linspace(0, len(ordered), n_shards + 1).astype(int)
+    return [ordered[a:b] for a, b in zip(bounds[:-1], bounds[1:], strict=True)]
+
+
+def map_match_shards(
+    fn: Callable[[PipelineConfig, list[int]], Any],
+    cfg: PipelineConfig,
+    match_ids: list[int],
+    workers: int,
+) -> list[Any]:
+    # Several shards per worker balance uneven match sizes; results come back in match_id order.
+    shards = shard_match_ids(match_ids, workers * SHARDS_PER_WORKER)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        return list(pool.map(fn, [cfg] * len(shards), shards))
@@ -1,89 +1,520 @@
 from __future__ import annotations
 
 import json
+import shutil
+from dataclasses import replace
 from pathlib import Path
 
-import joblib
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
 
-from ml.aggregate import player_aggregation, team_aggregation, validate_correlations
+from ml.aggregate import (
+    PLAYER_MATCH_STATS_FILENAME,
+    ZONE_CUBE_FILENAMES,
+    ZoneCube,
+    combine_player_aggregations,
+    combine_team_aggregations,
+    compute_correlations,
+    load_zone_cube,
+    player_match_aggregation,
+    player_totals,
+    save_zone_cube,
+    team_aggregation,
+    zone_cube,
+)
 from ml.config import PipelineConfig
-from ml.data_ingestion import load_statsbomb_events
+from ml.data_ingestion import LoadedData, list_match_ids, load_match_dates, load_statsbomb_events
 from ml.features import add_spatial_features, build_game_state, encode_context_features
-from ml.hybrid import compute_hybrid_xt
-from ml.markov_xt import compute_zone_probabilities, value_iteration
-from ml.model import append_start_end_shot_probs, build_shot_lookahead_target, train_xgboost
+from ml.hybrid import score_actions_by_id
+from ml.markov_xt import (
+    XtSolution,
+    count_zone_transitions,
+    load_zone_counts,
+    save_zone_counts,
+    solve_xt,
+    zone_probabilities_from_counts,
+)
+from ml.model import (
+    FEATURE_COLUMNS,
+    MODEL_FILENAME,
+    TrainedModel,
+    build_shot_lookahead_target,
+    load_shot_model,
+    train_xgboost,
+    train_xgboost_external,
+)
+from ml.parallel import concat_ipc_frames, frame_to_ipc, map_match_shards
+from ml.profiling import StageProfiler
+from ml.serving import (
+    SERVED_ACTION_COLUMNS,
+    SERVED_ACTIONS_FILENAME,
+    load_served_actions,
+    publish_release,
+    write_served_actions,
+)
 
+# Row-level outputs; each is a directory of parquet part files (see _write_parts).
+ACTIONS_DATASET = "actions_hybrid_xt.parquet"
+FREEZE_FRAMES_DATASET = "freeze_frames.parquet"
 
-def run_pipeline(cfg: PipelineConfig | None = None) -> dict[str, float]:
-    cfg = cfg or PipelineConfig()
 
-    cfg.data_raw_dir.mkdir(parents=True, exist_ok=True)
-    cfg.data_processed_dir.mkdir(parents=True, exist_ok=True)
-    cfg.artifacts_dir.mkdir(parents=True, exist_ok=True)
+def _manifest_path(cfg: PipelineConfig) -> Path:
+    return cfg.data_processed_dir / "manifest.json"
 
-    loaded = load_statsbomb_events(cfg)
 
-    actions = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
-    actions = add_spatial_features(actions, cfg)
-    shots = add_spatial_features(loaded.shots, cfg)
+def _part_paths(path: Path) -> list[Path]:
+    return sorted(path.glob("part-*.parquet"))
 
-    actions = build_game_state(actions, shots)
-    actions = encode_context_features(actions)
 
-    actions["target_shot_next_5"] = build_shot_lookahead_target(
-        loaded.events,
-        actions,
-        lookahead=cfg.shot_lookahead_actions,
-    )
+def _write_parts(frame: pd.DataFrame, path: Path) -> None:
+    # Row-level outputs are parquet datasets (a directory of part files, read back with
+    # pd.read_parquet(path)) so incremental runs can add matches without rewriting history.
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+    _append_part(frame, path)
 
-    shot_prob, move_prob, goal_prob, transition = compute_zone_probabilities(actions, shots, cfg)
-    xt_surface = value_iteration(shot_prob, move_prob, goal_prob, transition, cfg)
 
-    trained = train_xgboost(actions, cfg)
-    actions = append_start_end_shot_probs(actions, trained)
+def _append_part(frame: pd.DataFrame, path: Path) -> None:
+    if path.is_file():
+        # Single-file output from an older run becomes the dataset's first part.
+        legacy = path.rename(path.with_name(f"{path.name}.legacy"))
+        path.mkdir()
+        legacy.rename(path / "part-00000.parquet")
+    path.mkdir(parents=True, exist_ok=True)
+    frame.to_parquet(path / f"part-{len(_part_paths(path)):05d}.parquet", index=False)
 
-    shot_meta = shots[["match_id", "team", "player", "minute", "second", "shot_statsbomb_xg", "is_goal"]].copy()
-    shot_meta = shot_meta.rename(columns={"shot_statsbomb_xg": "xg"})
 
-    actions = actions.merge(
-        shot_meta,
-        on=["match_id", "team", "player", "minute", "second"],
-        how="left",
-    )
-    actions["action_xg"] = actions["xg"].fillna(0.0)
-    actions["is_action_goal"] = actions["is_goal"].fillna(0).astype(int)
+def _build_actions(
+    loaded: LoadedData, cfg: PipelineConfig, profiler: StageProfiler | None = None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    profiler = profiler or StageProfiler(stage_rss=False)
+    with profiler.stage("spatial_features") as stage:
+        actions = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
+        actions = add_spatial_features(actions, cfg)
+        # Like actions, shots get a fresh RangeIndex so shard outputs concatenate to the same frame.
+        shots = add_spatial_features(loaded.shots.reset_index(drop=True), cfg)
+        stage.rows = len(actions) + len(shots)
+
+    with profiler.stage("game_state") as stage:
+        actions = build_game_state(actions, shots)
+        actions = encode_context_features(actions)
+        stage.rows = len(actions)
+
+    with profiler.stage("labeling") as stage:
+        actions["target_shot_next_5"] = build_shot_lookahead_target(
+            loaded.events,
+            actions,
+            lookahead=cfg.shot_lookahead_actions,
+        )
+        stage.rows = len(actions)
+    return actions, shots
+
+
+def _build_shard(cfg: PipelineConfig, match_ids: list[int]) -> tuple[bytes, bytes, bytes]:
+    loaded = load_statsbomb_events(cfg, match_ids=match_ids)
+    actions, shots = _build_actions(loaded, cfg)
+    return frame_to_ipc(actions), frame_to_ipc(shots), frame_to_ipc(loaded.freeze_frames)
+
+
+def _load_and_build(
+    cfg: PipelineConfig, match_ids: list[int], profiler: StageProfiler | None = None
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    profiler = profiler or StageProfiler(stage_rss=False)
+    if cfg.process_workers <= 1 or len(match_ids) < 2:
+        with profiler.stage("ingestion") as stage:
+            loaded = load_statsbomb_events(cfg, match_ids=match_ids)
+            stage.rows = len(loaded.events)
+        actions, shots = _build_actions(loaded, cfg, profiler)
+        return actions, shots, loaded.freeze_frames
+
+    # Every per-match stage is independent, so shards are built in worker processes and returned
+    # as Arrow IPC buffers; concatenating them in match_id order reproduces the serial row order.
+    with profiler.stage("ingestion_and_features") as stage:
+        results = map_match_shards(_build_shard, cfg, match_ids, cfg.process_workers)
+        actions, shots, freeze_frames = (
+            concat_ipc_frames([r[i] for r in results]) for i in range(3)
+        )
+        stage.rows = len(actions) + len(shots)
+    return actions, shots, freeze_frames
+
+
+def _write_artifacts(
+    cfg: PipelineConfig,
+    xt_surface: np.ndarray,
+    transition: np.ndarray | sparse.csr_matrix,
+    trained: TrainedModel,
+    metadata: dict,
+) -> None:
+    np.save(cfg.artifacts_dir / "xt_surface.npy", xt_surface)
+    if sparse.issparse(transition):
+        sparse.save_npz(cfg.artifacts_dir / "transition_matrix.npz", transition)
+    else:
+        np.save(cfg.artifacts_dir / "transition_matrix.npy", transition)
+    trained.model.save_model(cfg.artifacts_dir / MODEL_FILENAME)
+
+    metadata_path = cfg.artifacts_dir / "metadata.json"
+    metadata_path.write_text(json.dumps(metadata, indent=2), encoding="utf-8")
+
+
+def _zone_cubes(actions: pd.DataFrame, cfg: PipelineConfig) -> dict[str, ZoneCube]:
+    return {key: zone_cube(actions, key, (cfg.grid_y, cfg.grid_x)) for key in ZONE_CUBE_FILENAMES}
+
 
-    actions = compute_hybrid_xt(actions, xt_surface, alpha=0.5)
+def _save_zone_cubes(cubes: dict[str, ZoneCube], cfg: PipelineConfig) -> None:
+    for key, cube in cubes.items():
+        save_zone_cube(cube, cfg.data_processed_dir / ZONE_CUBE_FILENAMES[key])
 
-    player_stats = player_aggregation(actions)
-    team_stats = team_aggregation(actions)
-    corrs = validate_correlations(player_stats)
 
-    actions_path = cfg.data_processed_dir / "actions_hybrid_xt.parquet"
+def _publish(cfg: PipelineConfig, metadata: dict) -> None:
+    sources = [
+        cfg.artifacts_dir / "xt_surface.npy",
+        cfg.artifacts_dir / MODEL_FILENAME,
+        cfg.artifacts_dir / "metadata.json",
+        cfg.data_processed_dir / SERVED_ACTIONS_FILENAME,
+        cfg.data_processed_dir / "player_stats.parquet",
+        cfg.data_processed_dir / PLAYER_MATCH_STATS_FILENAME,
+        cfg.data_processed_dir / "team_stats.parquet",
+        *(cfg.data_processed_dir / name for name in ZONE_CUBE_FILENAMES.values()),
+    ]
+    publish_release(sources, cfg.artifacts_dir / "releases", metadata, keep=cfg.keep_releases)
+
+
+def _write_outputs(
+    cfg: PipelineConfig,
+    player_stats: pd.DataFrame,
+    team_stats: pd.DataFrame,
+    xt_surface: np.ndarray,
+    transition: np.ndarray | sparse.csr_matrix,
+    trained: TrainedModel,
+    metadata: dict,
+    match_ids: list[int],
+) -> None:
     players_path = cfg.data_processed_dir / "player_stats.parquet"
     teams_path = cfg.data_processed_dir / "team_stats.parquet"
-    actions.to_parquet(actions_path, index=False)
     player_stats.to_parquet(players_path, index=False)
     team_stats.to_parquet(teams_path, index=False)
 
-    np.save(cfg.artifacts_dir / "xt_surface.npy", xt_surface)
-    np.save(cfg.artifacts_dir / "transition_matrix.npy", transition)
-    joblib.dump(trained.model, cfg.artifacts_dir / "xgboost_shot_model.joblib")
+    _write_artifacts(cfg, xt_surface, transition, trained, metadata)
+    _manifest_path(cfg).write_text(
+        json.dumps({"match_ids": sorted(int(m) for m in match_ids)}, indent=2), encoding="utf-8"
+    )
+    _publish(cfg, metadata)
+
 
-    metadata = {
+def _metadata(
+    cfg: PipelineConfig, xt_solution: XtSolution, trained: TrainedModel, corrs: dict
+) -> dict:
+    return {
         "competition_id": cfg.competition_id,
         "season_id": cfg.season_id,
         "grid": [cfg.grid_y, cfg.grid_x],
+        # Geometry and lookup settings the backend rebuilds its scoring config from.
+        "pitch": [cfg.pitch_length, cfg.pitch_width],
+        "goal": [cfg.goal_center_x, cfg.goal_center_y, cfg.goal_left_y, cfg.goal_right_y],
+        "xt_interpolate": cfg.xt_interpolate,
+        "xt_solver": xt_solution.solver,
+        "xt_iterations_used": xt_solution.iterations,
+        "xt_residual": xt_solution.residual,
+        "hybrid_alpha": cfg.hybrid_alpha,
         "validation_auc": trained.validation_auc,
+        "best_iteration": trained.best_iteration,
+        "xgb_tree_method": cfg.xgb_tree_method,
+        "xgb_early_stopping_rounds": cfg.xgb_early_stopping_rounds,
+        "bootstrap_samples": cfg.bootstrap_samples,
+        "bootstrap_ci": cfg.bootstrap_ci,
         **corrs,
     }
-    (cfg.artifacts_dir / "metadata.json").write_text(json.dumps(metadata, indent=2), encoding="utf-8")
+
+
+def run_pipeline(cfg: PipelineConfig | None = None) -> dict[str, float]:
+    cfg = cfg or PipelineConfig()
+    profiler = StageProfiler(cfg.profile_dir)
+
+    cfg.data_raw_dir.mkdir(parents=True, exist_ok=True)
+    cfg.data_processed_dir.mkdir(parents=True, exist_ok=True)
+    cfg.artifacts_dir.mkdir(parents=True, exist_ok=True)
+
+    match_ids = list_match_ids(cfg)
+    actions, shots, freeze_frames = _load_and_build(cfg, match_ids, profiler)
+
+    with profiler.stage("zone_probabilities") as stage:
+        counts = count_zone_transitions(actions, shots, cfg)
+        shot_prob, move_prob, goal_prob, transition = zone_probabilities_from_counts(counts)
+        stage.rows = len(actions) + len(shots)
+    with profiler.stage("value_iteration"):
+        xt_solution = solve_xt(shot_prob, move_prob, goal_prob, transition, cfg)
+        xt_surface = xt_solution.xt
+
+    with profiler.stage("training") as stage:
+        trained = train_xgboost(actions, cfg)
+        stage.rows = len(actions)
+    with profiler.stage("scoring") as stage:
+        actions = score_actions_by_id(actions, shots, trained, xt_surface, cfg)
+        stage.rows = len(actions)
+
+    with profiler.stage("aggregation") as stage:
+        player_matches = player_match_aggregation(actions, load_match_dates(cfg))
+        player_stats = player_totals(player_matches)
+        team_stats = team_aggregation(actions)
+        cubes = _zone_cubes(actions, cfg)
+        corrs = compute_correlations(player_stats, player_matches, cfg)
+        stage.rows = len(player_matches) + len(team_stats)
+
+    metadata = _metadata(cfg, xt_solution, trained, corrs)
+    with profiler.stage("writes") as stage:
+        save_zone_counts(counts, cfg.artifacts_dir / "zone_counts.npz")
+        _write_parts(actions, cfg.data_processed_dir / ACTIONS_DATASET)
+        write_served_actions(actions, cfg.data_processed_dir / SERVED_ACTIONS_FILENAME)
+        _write_parts(freeze_frames, cfg.data_processed_dir / FREEZE_FRAMES_DATASET)
+        _save_zone_cubes(cubes, cfg)
+        _write_parts(player_matches, cfg.data_processed_dir / PLAYER_MATCH_STATS_FILENAME)
+        _write_outputs(
+            cfg, player_stats, team_stats, xt_surface, transition, trained, metadata, match_ids
+        )
+        stage.rows = len(actions)
+    profiler.write(cfg.artifacts_dir / "profile.json")
+
+    return metadata
+
+
+def run_incremental_pipeline(
+    cfg: PipelineConfig | None = None, retrain: bool = False, offline: bool = False
+) -> dict[str, float]:
+    cfg = cfg or PipelineConfig()
+
+    manifest_path = _manifest_path(cfg)
+    counts_path = cfg.artifacts_dir / "zone_counts.npz"
+    if not (manifest_path.exists() and counts_path.exists()):
+        return run_pipeline(cfg)
+
+    # Re-fetch the match list so newly published matches are found; offline runs use the cache.
+    listing_cfg = cfg if offline else replace(cfg, refresh_match_list=True)
+    processed = set(json.loads(manifest_path.read_text(encoding="utf-8"))["match_ids"])
+    new_ids = [m for m in list_match_ids(listing_cfg) if m not in processed]
+    previous = json.loads((cfg.artifacts_dir / "metadata.json").read_text(encoding="utf-8"))
+    if not new_ids:
+        return previous
+
+    actions, shots, freeze_frames = _load_and_build(cfg, new_ids)
+
+    # Counts are additive across disjoint matches, so the surface is re-solved from stored + new.
+    counts = load_zone_counts(counts_path) + count_zone_transitions(actions, shots, cfg)
+    shot_prob, move_prob, goal_prob, transition = zone_probabilities_from_counts(counts)
+    xt_solution = solve_xt(shot_prob, move_prob, goal_prob, transition, cfg)
+    xt_surface = xt_solution.xt
+
+    actions_path = cfg.data_processed_dir / ACTIONS_DATASET
+    if retrain or not (cfg.artifacts_dir / MODEL_FILENAME).exists():
+        training_cols = [*FEATURE_COLUMNS, "target_shot_next_5"]
+        history = pd.read_parquet(actions_path, columns=training_cols)
+        training = pd.concat([history, actions[training_cols]], ignore_index=True)
+        trained = train_xgboost(training, cfg)
+    else:
+        model = load_shot_model(cfg.artifacts_dir / MODEL_FILENAME)
+        trained = TrainedModel(
+            model=model,
+            feature_columns=FEATURE_COLUMNS,
+            validation_auc=previous["validation_auc"],
+            best_iteration=previous.get("best_iteration"),
+        )
+
+    # Previously processed actions keep their scored values; only new matches are scored.
+    actions = score_actions_by_id(actions, shots, trained, xt_surface, cfg)
+
+    new_player_matches = player_match_aggregation(actions, load_match_dates(cfg))
+    player_matches_path = cfg.data_processed_dir / PLAYER_MATCH_STATS_FILENAME
+    if player_matches_path.exists():
+        player_matches = pd.concat(
+            [pd.read_parquet(player_matches_path), new_player_matches], ignore_index=True
+        )
+        player_stats = player_totals(player_matches)
+    else:
+        # Outputs from before per-match rows were stored: fold the new matches into the totals.
+        player_matches = new_player_matches
+        previous_totals = pd.read_parquet(cfg.data_processed_dir / "player_stats.parquet")
+        player_stats = combine_player_aggregations([previous_totals, player_totals(player_matches)])
+    team_stats = combine_team_aggregations(
+        [pd.read_parquet(cfg.data_processed_dir / "team_stats.parquet"), team_aggregation(actions)]
+    )
+    cubes = _zone_cubes(actions, cfg)
+    for key, name in ZONE_CUBE_FILENAMES.items():
+        if (cfg.data_processed_dir / name).exists():
+            cubes[key] = load_zone_cube(cfg.data_processed_dir / name) + cubes[key]
+    corrs = compute_correlations(player_stats, player_matches, cfg)
+
+    # Row-level outputs gain one part file each; only the player-sorted served file is rebuilt,
+    # from its own compact columns rather than from the stored actions.
+    served_path = cfg.data_processed_dir / SERVED_ACTIONS_FILENAME
+    served = load_served_actions(served_path).to_pandas()
+    served = pd.concat([served, actions[served.columns]], ignore_index=True)
+    categorical = [c for c in served.columns if isinstance(actions[c].dtype, pd.CategoricalDtype)]
+    write_served_actions(served.astype(dict.fromkeys(categorical, "category")), served_path)
+    _append_part(actions, actions_path)
+    _append_part(freeze_frames, cfg.data_processed_dir / FREEZE_FRAMES_DATASET)
+    _append_part(new_player_matches, player_matches_path)
+
+    metadata = _metadata(cfg, xt_solution, trained, corrs)
+    save_zone_counts(counts, counts_path)
+    _save_zone_cubes(cubes, cfg)
+    _write_outputs(
+        cfg,
+        player_stats,
+        team_stats,
+        xt_surface,
+        transition,
+        trained,
+        metadata,
+        [*processed, *new_ids],
+    )
+
+    return metadata
+
+
+def run_streaming_pipeline(
+    cfg: PipelineConfig | None = None, seasons: list[tuple[int, int]] | None = None
+) -> dict[str, float]:
+    cfg = cfg or PipelineConfig()
+    seasons = seasons or [(cfg.competition_id, cfg.season_id)]
+    step = max(cfg.stream_matches_per_chunk, 1)
+
+    cfg.data_raw_dir.mkdir(parents=True, exist_ok=True)
+    cfg.data_processed_dir.mkdir(parents=True, exist_ok=True)
+    cfg.artifacts_dir.mkdir(parents=True, exist_ok=True)
+    staging_dir = cfg.data_processed_dir / "_staging"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    staging_dir.mkdir(parents=True)
+
+    # Pass 1: featurise and label one bounded chunk of matches at a time, accumulating zone counts.
+    counts = None
+    n_chunks = 0
+    match_dates: list[pd.Series] = []
+    for competition_id, season_id in seasons:
+        season_cfg = replace(cfg, competition_id=competition_id, season_id=season_id)
+        match_ids = list_match_ids(season_cfg)
+        match_dates.append(load_match_dates(season_cfg))
+        for start in range(0, len(match_ids), step):
+            actions, shots, _ = _load_and_build(season_cfg, match_ids[start : start + step])
+
+            chunk_counts = count_zone_transitions(actions, shots, cfg)
+            counts = chunk_counts if counts is None else counts + chunk_counts
+
+            actions = actions.assign(competition_id=competition_id, season_id=season_id)
+            actions.to_parquet(staging_dir / f"actions_{n_chunks:05d}.parquet", index=False)
+            shots.to_parquet(staging_dir / f"shots_{n_chunks:05d}.parquet", index=False)
+            n_chunks += 1
+
+    if counts is None:
+        raise ValueError("No matches found for the requested seasons.")
+
+    shot_prob, move_prob, goal_prob, transition = zone_probabilities_from_counts(counts)
+    xt_solution = solve_xt(shot_prob, move_prob, goal_prob, transition, cfg)
+    xt_surface = xt_solution.xt
+
+    chunk_paths = [staging_dir / f"actions_{i:05d}.parquet" for i in range(n_chunks)]
+    if cfg.xgb_external_memory:
+        # XGBoost pages the staged chunks through an on-disk cache; one chunk is in RAM at a time.
+        trained = train_xgboost_external(chunk_paths, cfg, staging_dir / "xgb_cache")
+    else:
+        # Only the compact feature/target columns are materialised together for training.
+        training_cols = [*FEATURE_COLUMNS, "target_shot_next_5"]
+        chunks = [pd.read_parquet(path, columns=training_cols) for path in chunk_paths]
+        training = pd.concat(chunks, ignore_index=True)
+        trained = train_xgboost(training, cfg)
+        del training
+
+    # Pass 2: score each chunk, fold it into the aggregates and write its partitions.
+    dataset_dir = cfg.data_processed_dir / "actions_hybrid_xt_dataset"
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    dates = pd.concat(match_dates)
+    player_parts: list[pd.DataFrame] = []
+    team_parts: list[pd.DataFrame] = []
+    cubes: dict[str, ZoneCube] = {}
+    for i in range(n_chunks):
+        actions = pd.read_parquet(staging_dir / f"actions_{i:05d}.parquet")
+        shots = pd.read_parquet(staging_dir / f"shots_{i:05d}.parquet")
+        actions = score_actions_by_id(actions, shots, trained, xt_surface, cfg)
+
+        player_parts.append(player_match_aggregation(actions, dates))
+        team_parts.append(team_aggregation(actions))
+        for key, cube in _zone_cubes(actions, cfg).items():
+            cubes[key] = cubes[key] + cube if key in cubes else cube
+        pq.write_to_dataset(
+            pa.Table.from_pandas(actions, preserve_index=False),
+            dataset_dir,
+            partition_cols=["competition_id", "season_id", "match_id"],
+        )
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    served = pd.read_parquet(dataset_dir, columns=SERVED_ACTION_COLUMNS)
+    write_served_actions(
+        served.assign(match_id=served["match_id"].astype("int64")),
+        cfg.data_processed_dir / SERVED_ACTIONS_FILENAME,
+    )
+
+    player_matches = pd.concat(player_parts, ignore_index=True)
+    player_stats = player_totals(player_matches)
+    team_stats = combine_team_aggregations(team_parts)
+    corrs = compute_correlations(player_stats, player_matches, cfg)
+    player_stats.to_parquet(cfg.data_processed_dir / "player_stats.parquet", index=False)
+    _write_parts(player_matches, cfg.data_processed_dir / PLAYER_MATCH_STATS_FILENAME)
+    team_stats.to_parquet(cfg.data_processed_dir / "team_stats.parquet", index=False)
+    _save_zone_cubes(cubes, cfg)
+
+    metadata = _metadata(cfg, xt_solution, trained, corrs)
+    metadata["seasons"] = [list(season) for season in seasons]
+    _write_artifacts(cfg, xt_surface, transition, trained, metadata)
+    save_zone_counts(counts, cfg.artifacts_dir / "zone_counts.npz")
+    _publish(cfg, metadata)
 
     return metadata
 
 
 if __name__ == "__main__":
-    result = run_pipeline()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the hybrid xT pipeline.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process matches not yet in the manifest.",
+    )
+    parser.add_argument(
+        "--retrain", action="store_true", help="Retrain the shot model in incremental mode."
+    )
+    parser.add_argument(
+        "--refresh-matches",
+        action="store_true",
+        help="Re-fetch the competition's match list instead of using the cached one.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="In incremental mode, use the cached match list instead of re-fetching it.",
+    )
+    parser.add_argument(
+        "--profile-dir", type=Path, help="Dump a cProfile file per pipeline stage here."
+    )
+    parser.add_argument(
+        "--stream",
+        nargs="*",
+        metavar="COMPETITION:SEASON",
+        help=(
+            "Process matches in bounded chunks into a partitioned dataset "
+            "(default: configured season)."
+        ),
+    )
+    args = parser.parse_args()
+    cfg = PipelineConfig(profile_dir=args.profile_dir, refresh_match_list=args.refresh_matches)
+
+    if args.stream is not None:
+        seasons = [tuple(int(v) for v in item.split(":")) for item in args.stream] or None
+        result = run_streaming_pipeline(cfg, seasons=seasons)
+    elif args.incremental:
+        result = run_incremental_pipeline(cfg, retrain=args.retrain, offline=args.offline)
+    else:
+        result = run_pipeline(cfg)
     print(json.dumps(result, indent=2))
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import cProfile
+import json
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+
+CLEAR_REFS_PATH = Path("/proc/self/clear_refs")
+STATUS_PATH = Path("/proc/self/status")
+
+
+def peak_rss_mb(children: bool = False) -> float | None:
+    # Process-lifetime peak; with children=True, the largest terminated child (pool workers).
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Linux reports kilobytes, macOS bytes.
+    return peak.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else peak.ru_maxrss / 1024
+
+
+def reset_peak_rss() -> bool:
+    # Linux: writing 5 to clear_refs resets VmHWM (and ru_maxrss) to the current RSS.
+    try:
+        CLEAR_REFS_PATH.write_text("5")
+    except OSError:
+        return False
+    return True
+
+
+def current_peak_rss_mb() -> float | None:
+    # VmHWM: the high-water mark since the process started or since the last reset_peak_rss().
+    try:
+        status = STATUS_PATH.read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) / 1024
+    return None
+
+
+@dataclass
+class StageRecord:
+    name: str
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_rss_mb: float | None = None  # this stage only; None where the peak cannot be reset
+    children_peak_rss_mb: float | None = None  # largest worker that finished during the stage
+    rows: int | None = None
+
+
+class StageProfiler:
+    def __init__(self, profile_dir: Path | None = None, stage_rss: bool = True) -> None:
+        self.profile_dir = profile_dir
+        self.records: list[StageRecord] = []
+        # Per-stage peaks reset the high-water mark (and ru_maxrss), so the process peak is kept
+        # here. Throwaway profilers, e.g. in pool workers, pass stage_rss=False to leave it alone.
+        self.stage_rss = stage_rss
+        self.process_peak_rss_mb = peak_rss_mb()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        record = StageRecord(name=name)
+        profiler = cProfile.Profile() if self.profile_dir is not None else None
+        children_before = peak_rss_mb(children=True)
+        per_stage = self.stage_rss and reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(self.profile_dir / f"{len(self.records):02d}_{name}.prof")
+            record.wall_s = time.perf_counter() - wall
+            record.cpu_s = time.process_time() - cpu
+            if per_stage:
+                record.peak_rss_mb = current_peak_rss_mb()
+                self.process_peak_rss_mb = max(
+                    self.process_peak_rss_mb or 0.0, record.peak_rss_mb or 0.0
+                )
+            children = peak_rss_mb(children=True)
+            if children is not None and children != children_before:
+                record.children_peak_rss_mb = children
+            self.records.append(record)
+
+    def report(self) -> dict:
+        return {
+            "total_wall_s": sum(r.wall_s for r in self.records),
+            "total_cpu_s": sum(r.cpu_s for r in self.records),
+            "peak_rss_mb": self._process_peak(),
+            "stages": [asdict(r) for r in self.records],
+        }
+
+    def _process_peak(self) -> float | None:
+        current = current_peak_rss_mb() or peak_rss_mb()
+        return max(self.process_peak_rss_mb or 0.0, current or 0.0) or None
+
+    def write(self, path: Path) -> None:
+        path.write_text(json.dumps(self.report(), indent=2), encoding="utf-8")
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+PLAYER_ROWS_KEY = b"xt_player_rows"
+SERVED_ACTIONS_FILENAME = "actions_served.feather"
+RELEASE_MANIFEST = "current.json"
+
+# Only these action columns are served by the API.
+SERVED_ACTION_COLUMNS = [
+    "id",
+    "match_id",
+    "team",
+    "player",
+    "minute",
+    "type",
+    "start_x",
+    "start_y",
+    "end_x",
+    "end_y",
+    "xt_value",
+    "progressive_flag",
+    "under_pressure",
+    "pressure_score",
+]
+
+
+def served_actions_table(actions: pd.DataFrame) -> pa.Table:
+    # One stable sort by player keeps each player's rows contiguous and in (match_id, minute) order;
+    # the row ranges travel in the schema metadata so readers never scan the player column.
+    existing = [c for c in SERVED_ACTION_COLUMNS if c in actions.columns]
+    served = actions.loc[actions["player"].notna(), existing]
+    served = served.assign(player=served["player"].astype(str))
+    served = served.sort_values(["player", "match_id", "minute"], kind="stable")
+    served = served.reset_index(drop=True)
+
+    names = served["player"].to_numpy()
+    rows: dict[str, list[int]] = {}
+    if len(names):
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+        stops = np.r_[starts[1:], len(names)]
+        rows = {str(names[a]): [int(a), int(b)] for a, b in zip(starts, stops, strict=True)}
+
+    served = served.assign(player=served["player"].astype("category"))
+    table = pa.Table.from_pandas(served, preserve_index=False)
+    return table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), PLAYER_ROWS_KEY: json.dumps(rows).encode()}
+    )
+
+
+def player_rows(table: pa.Table) -> dict[str, tuple[int, int]]:
+    rows = json.loads((table.schema.metadata or {}).get(PLAYER_ROWS_KEY, b"{}"))
+    return {name: (start, stop) for name, (start, stop) in rows.items()}
+
+
+def write_served_actions(actions: pd.DataFrame, path: Path) -> None:
+    # Uncompressed Feather (Arrow IPC) so every API worker can memory-map the same pages.
+    tmp_path = path.with_suffix(".tmp")
+    feather.write_feather(served_actions_table(actions), tmp_path, compression="uncompressed")
+    tmp_path.replace(path)
+
+
+def load_served_actions(path: Path) -> pa.Table:
+    return feather.read_table(path, memory_map=True)
+
+
+def publish_release(sources: list[Path], releases_dir: Path, metadata: dict, keep: int = 3) -> dict:
+    """Copy served files into a new versioned directory and point the release manifest at it."""
+    created = datetime.now(timezone.utc)
+    payload = json.dumps(metadata, sort_keys=True, default=str).encode()
+    digest = hashlib.sha1(payload).hexdigest()[:8]
+    version = f"{created:%Y%m%dT%H%M%S%f}-{digest}"
+
+    release_dir = releases_dir / version
+    release_dir.mkdir(parents=True)
+    # Copies, not links: the pipeline rewrites some outputs in place on the next run.
+    for src in sources:
+        if src.is_dir():
+            shutil.copytree(src, release_dir / src.name)
+        else:
+            shutil.copy2(src, release_dir / src.name)
+
+    manifest = {
+        "version": version,
+        "created_at": created.isoformat(),
+        "files": sorted(src.name for src in sources),
+        "metadata": metadata,
+    }
+    tmp_path = releases_dir / f"{RELEASE_MANIFEST}.tmp"
+    tmp_path.write_text(json.dumps(manifest, indent=2, default=str), encoding="utf-8")
+    tmp_path.replace(releases_dir / RELEASE_MANIFEST)
+
+    # Version names sort chronologically; readers that still map a pruned file keep their pages.
+    for old in sorted(p for p in releases_dir.iterdir() if p.is_dir())[: -max(keep, 1)]:
+        shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def read_release_manifest(releases_dir: Path) -> dict | None:
+    path = releases_dir / RELEASE_MANIFEST
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
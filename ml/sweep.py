@@ -0,0 +1,357 @@
+"""Grid, lookahead, alpha and XGBoost sweeps over content-addressed, cached pipeline stages.
+
+    python -m ml.sweep --grid 16x12 24x16 --lookahead 3 5 --alpha 0.3 0.5 0.7 --max-depth 4 6
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields, replace
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ml.aggregate import compute_correlations, player_match_aggregation, player_totals
+from ml.config import PipelineConfig
+from ml.data_ingestion import list_match_ids, load_statsbomb_events
+from ml.features import add_spatial_features, assign_zone, build_game_state, encode_context_features
+from ml.hybrid import score_actions_by_id
+from ml.markov_xt import count_zone_transitions, solve_xt, zone_probabilities_from_counts
+from ml.model import (
+    FEATURE_COLUMNS,
+    TrainedModel,
+    build_shot_lookahead_target,
+    load_shot_model,
+    train_xgboost,
+)
+
+CACHE_VERSION = 3  # bump when a stage's code changes what it writes
+LABEL_EVENT_COLUMNS = ["match_id", "team", "possession", "index", "type"]
+ZONE_COLUMNS = [
+    "start_zone_x",
+    "start_zone_y",
+    "start_zone",
+    "end_zone_x",
+    "end_zone_y",
+    "end_zone",
+]
+
+# PipelineConfig fields each stage reads; a stage's key also covers the keys of its inputs.
+STAGE_FIELDS = {
+    "base": (
+        "competition_id",
+        "season_id",
+        "events_source_dir",
+        "pitch_length",
+        "pitch_width",
+        "goal_center_x",
+        "goal_center_y",
+        "goal_left_y",
+        "goal_right_y",
+        "pressure_radius",
+        "pressure_kernel",
+    ),
+    "zones": ("grid_x", "grid_y"),
+    "labels": ("shot_lookahead_actions",),
+    "surface": (
+        "xt_iterations",
+        "xt_solver",
+        "xt_tolerance",
+        "xt_max_iterations",
+        "sparse_transition_zones",
+    ),
+    "model": (
+        "test_size",
+        "random_state",
+        *(f.name for f in fields(PipelineConfig) if f.name.startswith("xgb_")),
+    ),
+    "metrics": ("hybrid_alpha", "xt_interpolate", "bootstrap_samples", "bootstrap_ci"),
+}
+
+
+@dataclass(frozen=True)
+class StageKeys:
+    base: str
+    zones: str
+    labels: str
+    surface: str
+    model: str
+    metrics: str
+
+
+def stage_key(stage: str, cfg: PipelineConfig, inputs: list[str], **extra) -> str:
+    payload = {
+        "stage": stage,
+        "version": CACHE_VERSION,
+        "inputs": inputs,
+        **{name: getattr(cfg, name) for name in STAGE_FIELDS[stage]},
+        **extra,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def stage_keys(cfg: PipelineConfig, match_ids: list[int]) -> StageKeys:
+    base = stage_key("base", cfg, [], match_ids=sorted(int(m) for m in match_ids))
+    zones = stage_key("zones", cfg, [base])
+    labels = stage_key("labels", cfg, [base])
+    surface = stage_key("surface", cfg, [zones])
+    model = stage_key("model", cfg, [zones, labels])
+    metrics = stage_key("metrics", cfg, [model, surface])
+    return StageKeys(base, zones, labels, surface, model, metrics)
+
+
+def _stage_dir(cfg: PipelineConfig, stage: str, key: str) -> Path:
+    return cfg.sweep_cache_dir / stage / key
+
+
+def _cached(cfg: PipelineConfig, stage: str, key: str, build: Callable[[Path], None]) -> bool:
+    """Build a stage into its key directory unless it exists; returns whether it was computed."""
+    path = _stage_dir(cfg, stage, key)
+    if path.exists():
+        return False
+    # Built in a private directory and renamed into place, so readers never see partial output.
+    tmp_path = path.with_name(f"{key}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    build(tmp_path)
+    try:
+        tmp_path.rename(path)
+    except OSError:  # another worker finished the same stage first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return True
+
+
+def _build_base(cfg: PipelineConfig, match_ids: list[int], out: Path) -> None:
+    loaded = load_statsbomb_events(cfg, match_ids=match_ids)
+    moves = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
+    actions = add_spatial_features(moves, cfg)
+    shots = add_spatial_features(loaded.shots, cfg)
+    actions = encode_context_features(build_game_state(actions, shots))
+    actions.to_parquet(out / "actions.parquet", index=False)
+    shots.to_parquet(out / "shots.parquet", index=False)
+    loaded.events[LABEL_EVENT_COLUMNS].to_parquet(out / "events.parquet", index=False)
+
+
+def _zone_frame(df: pd.DataFrame, cfg: PipelineConfig) -> pd.DataFrame:
+    cols: dict[str, np.ndarray] = {}
+    for prefix in ("start", "end"):
+        x, y = df[f"{prefix}_x"].to_numpy(), df[f"{prefix}_y"].to_numpy()
+        zx, zy, z = assign_zone(x, y, cfg)
+        cols[f"{prefix}_zone_x"], cols[f"{prefix}_zone_y"], cols[f"{prefix}_zone"] = zx, zy, z
+    return pd.DataFrame(cols)
+
+
+class _Frames:
+    """Base actions and shots with one grid's zones and one lookahead's labels, read lazily."""
+
+    def __init__(self, cfg: PipelineConfig, keys: StageKeys) -> None:
+        self.cfg = cfg
+        self.keys = keys
+        self._actions: pd.DataFrame | None = None
+        self._shots: pd.DataFrame | None = None
+        self.computed: list[str] = []
+
+    def _load(self) -> None:
+        cfg, keys = self.cfg, self.keys
+        base = _stage_dir(cfg, "base", keys.base)
+        actions = pd.read_parquet(base / "actions.parquet")
+        shots = pd.read_parquet(base / "shots.parquet")
+
+        def build_zones(out: Path) -> None:
+            _zone_frame(actions, cfg).to_parquet(out / "actions.parquet", index=False)
+            _zone_frame(shots, cfg).to_parquet(out / "shots.parquet", index=False)
+
+        def build_labels(out: Path) -> None:
+            events = pd.read_parquet(base / "events.parquet")
+            target = build_shot_lookahead_target(
+                events, actions, lookahead=cfg.shot_lookahead_actions
+            )
+            labels = pd.DataFrame({"target_shot_next_5": target.to_numpy()})
+            labels.to_parquet(out / "labels.parquet", index=False)
+
+        for stage, build in (("zones", build_zones), ("labels", build_labels)):
+            if _cached(cfg, stage, getattr(keys, stage), build):
+                self.computed.append(stage)
+        zones = _stage_dir(cfg, "zones", keys.zones)
+        labels = pd.read_parquet(_stage_dir(cfg, "labels", keys.labels) / "labels.parquet")
+        # The training label keeps its pipeline column name whatever the lookahead.
+        actions[ZONE_COLUMNS] = pd.read_parquet(zones / "actions.parquet")[ZONE_COLUMNS].to_numpy()
+        actions["target_shot_next_5"] = labels["target_shot_next_5"].to_numpy()
+        shots[ZONE_COLUMNS] = pd.read_parquet(zones / "shots.parquet")[ZONE_COLUMNS].to_numpy()
+        self._actions, self._shots = actions, shots
+
+    @property
+    def actions(self) -> pd.DataFrame:
+        if self._actions is None:
+            self._load()
+        return self._actions
+
+    @property
+    def shots(self) -> pd.DataFrame:
+        if self._shots is None:
+            self._load()
+        return self._shots
+
+
+def _evaluate(cfg: PipelineConfig, keys: StageKeys, frames: _Frames) -> dict:
+    def build_surface(out: Path) -> None:
+        counts = count_zone_transitions(frames.actions, frames.shots, cfg)
+        solution = solve_xt(*zone_probabilities_from_counts(counts), cfg)
+        np.save(out / "xt_surface.npy", solution.xt)
+        (out / "solution.json").write_text(
+            json.dumps(
+                {"xt_iterations_used": solution.iterations, "xt_residual": solution.residual}
+            ),
+            encoding="utf-8",
+        )
+
+    def build_model(out: Path) -> None:
+        trained = train_xgboost(frames.actions[[*FEATURE_COLUMNS, "target_shot_next_5"]], cfg)
+        trained.model.save_model(out / "model.ubj")
+        info = {"validation_auc": trained.validation_auc, "best_iteration": trained.best_iteration}
+        (out / "model.json").write_text(json.dumps(info), encoding="utf-8")
+
+    def build_metrics(out: Path) -> None:
+        surface_dir = _stage_dir(cfg, "surface", keys.surface)
+        model_dir = _stage_dir(cfg, "model", keys.model)
+        model_info = json.loads((model_dir / "model.json").read_text(encoding="utf-8"))
+        model = load_shot_model(model_dir / "model.ubj")
+        trained = TrainedModel(
+            model, FEATURE_COLUMNS, model_info["validation_auc"], model_info["best_iteration"]
+        )
+        scored = score_actions_by_id(
+            frames.actions, frames.shots, trained, np.load(surface_dir / "xt_surface.npy"), cfg
+        )
+        player_matches = player_match_aggregation(scored)
+        corrs = compute_correlations(player_totals(player_matches), player_matches, cfg)
+        corrs.pop("correlations_by_team")
+        metrics = {
+            **model_info,
+            **json.loads((surface_dir / "solution.json").read_text(encoding="utf-8")),
+            **corrs,
+        }
+        (out / "metrics.json").write_text(json.dumps(metrics), encoding="utf-8")
+
+    computed = []
+    stages = (("surface", build_surface), ("model", build_model), ("metrics", build_metrics))
+    for stage, build in stages:
+        if _cached(cfg, stage, getattr(keys, stage), build):
+            computed.append(stage)
+    # Zones and labels are built on first access to the frames, inside one of the stages above.
+    computed, frames.computed = [*frames.computed, *computed], []
+    metrics_path = _stage_dir(cfg, "metrics", keys.metrics) / "metrics.json"
+    metrics = json.loads(metrics_path.read_text(encoding="utf-8"))
+    return {**metrics, "computed_stages": ",".join(computed)}
+
+
+def _run_group(items: list[tuple[PipelineConfig, StageKeys]]) -> list[dict]:
+    # Every item in a group shares zones, labels and the model, so frames are read at most once.
+    frames = _Frames(*items[0])
+    rows = []
+    for cfg, keys in items:
+        started = time.perf_counter()
+        row = _evaluate(cfg, keys, frames)
+        row["elapsed_s"] = time.perf_counter() - started
+        rows.append(row)
+    return rows
+
+
+def run_sweep(points: list[dict], cfg: PipelineConfig | None = None) -> pd.DataFrame:
+    """Evaluate each point (PipelineConfig overrides), recomputing only stages with new inputs."""
+    cfg = cfg or PipelineConfig()
+    cfgs = [replace(cfg, **point) for point in points]
+    seasons = {(c.competition_id, c.season_id) for c in cfgs}
+    match_ids = {
+        season: list_match_ids(replace(cfg, competition_id=season[0], season_id=season[1]))
+        for season in seasons
+    }
+    keys = [stage_keys(c, match_ids[(c.competition_id, c.season_id)]) for c in cfgs]
+
+    # Ingestion and base features are shared by most points, so each distinct base is built once.
+    bases = {k.base: (c, k) for c, k in zip(cfgs, keys, strict=True)}
+    for c, k in bases.values():
+        season_ids = match_ids[(c.competition_id, c.season_id)]
+        _cached(c, "base", k.base, lambda out, c=c, ids=season_ids: _build_base(c, ids, out))
+
+    groups: dict[str, list[int]] = {}
+    for i, k in enumerate(keys):
+        groups.setdefault(k.model, []).append(i)
+    tasks = [[(cfgs[i], keys[i]) for i in members] for members in groups.values()]
+    if cfg.sweep_workers > 1 and len(tasks) > 1:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=cfg.sweep_workers, mp_context=context) as pool:
+            results = list(pool.map(_run_group, tasks))
+    else:
+        results = [_run_group(task) for task in tasks]
+
+    rows: list[dict] = [{} for _ in cfgs]
+    for members, group_rows in zip(groups.values(), results, strict=True):
+        for i, row in zip(members, group_rows, strict=True):
+            rows[i] = {**points[i], **row}
+    return pd.DataFrame(rows)
+
+
+def sweep_points(options: dict[str, list]) -> list[dict]:
+    """Cartesian product of PipelineConfig overrides; ``grid`` values are (grid_x, grid_y) pairs."""
+    names = [name for name, values in options.items() if values]
+    points = []
+    for combo in itertools.product(*(options[name] for name in names)):
+        point: dict = {}
+        for name, value in zip(names, combo, strict=True):
+            if name == "grid":
+                point["grid_x"], point["grid_y"] = value
+            else:
+                point[name] = value
+        points.append(point)
+    return points
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def grid_size(value: str) -> tuple[int, int]:
+        grid_x, grid_y = value.lower().split("x")
+        return int(grid_x), int(grid_y)
+
+    parser = argparse.ArgumentParser(
+        description="Sweep grid size, lookahead, alpha and XGBoost parameters."
+    )
+    parser.add_argument(
+        "--grid", type=grid_size, nargs="+", help="Grid sizes as XxY, e.g. 16x12 24x16."
+    )
+    parser.add_argument("--lookahead", type=int, nargs="+", help="shot_lookahead_actions values.")
+    parser.add_argument("--alpha", type=float, nargs="+", help="hybrid_alpha values.")
+    parser.add_argument("--n-estimators", type=int, nargs="+")
+    parser.add_argument("--learning-rate", type=float, nargs="+")
+    parser.add_argument("--max-depth", type=int, nargs="+")
+    parser.add_argument("--min-child-weight", type=float, nargs="+")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Independent configurations run in parallel."
+    )
+    parser.add_argument("--output", type=Path, default=Path("artifacts/sweep_results.csv"))
+    args = parser.parse_args()
+
+    points = sweep_points(
+        {
+            "grid": args.grid,
+            "shot_lookahead_actions": args.lookahead,
+            "hybrid_alpha": args.alpha,
+            "xgb_n_estimators": args.n_estimators,
+            "xgb_learning_rate": args.learning_rate,
+            "xgb_max_depth": args.max_depth,
+            "xgb_min_child_weight": args.min_child_weight,
+        }
+    )
+    table = run_sweep(points, PipelineConfig(sweep_workers=args.workers))
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.output, index=False)
+    print(table.to_string(index=False))
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.main as backend
+from backend.main import load_store, serving_config
+from benchmarks.synthetic import write_raw_cache
+from ml.config import PipelineConfig
+from ml.hybrid import score_actions
+from ml.model import FEATURE_COLUMNS, TrainedModel
+from ml.pipeline import run_pipeline
+
+RAW_COLUMNS = [
+    "start_x",
+    "start_y",
+    "end_x",
+    "end_y",
+    "type",
+    "under_pressure",
+    "pressure_score",
+    "minute",
+    "score_diff",
+]
+
+
+def _run_pipeline(tmp_path, **overrides) -> PipelineConfig:
+    cfg = PipelineConfig(
+        xgb_n_estimators=20,
+        bootstrap_samples=0,
+        fetch_workers=1,
+        data_raw_dir=tmp_path / "raw",
+        data_processed_dir=tmp_path / "processed",
+        artifacts_dir=tmp_path / "artifacts",
+        **overrides,
+    )
+    write_raw_cache(cfg, n_matches=2, events_per_match=600)
+    run_pipeline(cfg)
+    return cfg
+
+
+def test_serving_config_defaults_for_old_metadata() -> None:
+    assert serving_config({"grid": [12, 16], "hybrid_alpha": 0.5}) == PipelineConfig()
+
+
+@pytest.mark.parametrize("interpolate", [False, True])
+def test_score_reproduces_stored_xt(tmp_path, interpolate: bool) -> None:
+    cfg = _run_pipeline(
+        tmp_path, grid_x=24, grid_y=16, hybrid_alpha=0.3, xt_interpolate=interpolate
+    )
+    metadata = json.loads((cfg.artifacts_dir / "metadata.json").read_text(encoding="utf-8"))
+
+    store = load_store(cfg.artifacts_dir, cfg.data_processed_dir, "test")
+
+    assert metadata["xt_interpolate"] is interpolate
+    assert store.cfg == serving_config(metadata)
+    assert (store.cfg.grid_x, store.cfg.xt_interpolate) == (24, interpolate)
+    stored = pd.read_parquet(cfg.data_processed_dir / "actions_hybrid_xt.parquet")
+    trained = TrainedModel(store.model, FEATURE_COLUMNS, validation_auc=float("nan"))
+    raw = {c: stored[c].to_numpy() for c in RAW_COLUMNS}
+    scored = score_actions(raw, trained, store.xt_surface, store.cfg, alpha=store.cfg.hybrid_alpha)
+    np.testing.assert_allclose(scored["xt_value"], stored["xt_value"], rtol=0, atol=1e-7)
+
+
+def test_players_rows_have_one_shape(tmp_path, monkeypatch) -> None:
+    cfg = _run_pipeline(tmp_path)
+    monkeypatch.setattr(
+        backend, "store", load_store(cfg.artifacts_dir, cfg.data_processed_dir, "test")
+    )
+    client = TestClient(backend.app)
+
+    unfiltered = client.get("/players").json()
+    paged = client.get("/players", params={"limit": len(unfiltered)}).json()
+    team = client.get("/players", params={"team": unfiltered[0]["team"]}).json()
+
+    assert "team" in unfiltered[0]
+    assert unfiltered == paged
+    assert {tuple(row) for row in team} == {tuple(unfiltered[0])}
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from ml.data_ingestion import link_shots
+
+
+def _events(rows: list[tuple]) -> pd.DataFrame:
+    return pd.DataFrame(
+        rows, columns=["id", "match_id", "player", "type", "related_events"]
+    ).astype({"related_events": object})
+
+
+def test_one_shot_linked_from_several_actions_goes_to_the_latest() -> None:
+    events = _events(
+        [
+            ("a1", 1, "P", "Pass", ["s1"]),
+            ("a2", 1, "P", "Carry", ["s1"]),
+            ("s1", 1, "P", "Shot", None),
+        ]
+    )
+
+    assert link_shots(events).tolist() == [None, "s1", None]
+
+
+def test_one_action_linked_to_several_shots_keeps_the_first() -> None:
+    events = _events(
+        [
+            ("a1", 1, "P", "Carry", ["s1", "s2"]),
+            ("s1", 1, "P", "Shot", None),
+            ("s2", 1, "P", "Shot", None),
+        ]
+    )
+
+    assert link_shots(events).tolist() == ["s1", None, None]
+
+
+def test_links_are_followed_in_both_directions() -> None:
+    events = _events(
+        [
+            ("a1", 1, "P", "Carry", None),
+            ("s1", 1, "P", "Shot", ["a1"]),
+            ("a2", 1, "P", "Pass", ["s2"]),
+            ("s2", 1, "P", "Shot", None),
+        ]
+    )
+
+    assert link_shots(events).tolist() == ["s1", None, "s2", None]
+
+
+def test_links_across_players_or_matches_are_rejected() -> None:
+    events = _events(
+        [
+            ("a1", 1, "P", "Pass", ["s1"]),
+            ("s1", 1, "Q", "Shot", None),
+            ("a2", 1, "P", "Pass", ["s2"]),
+            ("s2", 2, "P", "Shot", None),
+            ("a3", 1, None, "Pass", ["s3"]),
+            ("s3", 1, None, "Shot", None),
+            ("a4", 1, "P", "Pass", ["missing"]),
+        ]
+    )
+
+    assert link_shots(events).tolist() == [None] * len(events)
+
+
+def test_each_shot_is_linked_at_most_once() -> None:
+    rng = np.random.default_rng(0)
+    rows = []
+    for i in range(200):
+        related = [f"e{j}" for j in rng.integers(0, 200, size=rng.integers(0, 4))]
+        kind = rng.choice(["Pass", "Carry", "Shot"])
+        rows.append((f"e{i}", int(rng.integers(1, 3)), f"P{rng.integers(0, 3)}", kind, related))
+    events = _events(rows)
+
+    linked = pd.Series(link_shots(events)).dropna()
+
+    assert len(linked) > 0
+    assert linked.is_unique
+    shot_ids = set(events.loc[events["type"] == "Shot", "id"])
+    assert set(linked) <= shot_ids
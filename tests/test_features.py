@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_events
+from ml.config import PipelineConfig
+from ml.data_ingestion import split_events
+from ml.features import build_game_state
+
+STATE_COLUMNS = ["home_goals", "away_goals", "score_diff", "game_state", "game_phase"]
+
+
+def _reference_game_state(actions: pd.DataFrame, shots: pd.DataFrame) -> pd.DataFrame:
+    # The original row-by-row loop the columnar engine replaced.
+    out = actions.copy()
+    goals = shots[shots["is_goal"] == 1][["match_id", "period", "minute", "second", "team"]].copy()
+    out = out.sort_values(["match_id", "period", "minute", "second", "index"])
+    out = out.reset_index(drop=True)
+    out["home_goals"] = 0
+    out["away_goals"] = 0
+
+    for match_id, group_idx in out.groupby("match_id").groups.items():
+        idx = list(group_idx)
+        teams = out.loc[idx, "team"].dropna().unique().tolist()
+        if len(teams) < 2:
+            continue
+        home_team, away_team = teams[0], teams[1]
+        match_goals = goals[goals["match_id"] == match_id]
+        match_goals = match_goals.sort_values(["period", "minute", "second"])
+
+        hg = ag = gptr = 0
+        gvals = match_goals.to_dict("records")
+        for ridx in idx:
+            row = out.loc[ridx]
+            while gptr < len(gvals):
+                g = gvals[gptr]
+                if (g["period"], g["minute"], g["second"]) > (
+                    row["period"],
+                    row["minute"],
+                    row["second"],
+                ):
+                    break
+                if g["team"] == home_team:
+                    hg += 1
+                elif g["team"] == away_team:
+                    ag += 1
+                gptr += 1
+            out.at[ridx, "home_goals"] = hg
+            out.at[ridx, "away_goals"] = ag
+            out.at[ridx, "score_diff"] = hg - ag if row["team"] == home_team else ag - hg
+
+    out["game_state"] = np.where(
+        out["score_diff"] > 0,
+        "winning",
+        np.where(out["score_diff"] < 0, "losing", "drawing"),
+    )
+    out["game_phase"] = pd.cut(
+        out["minute"],
+        bins=[-1, 15, 60, 90, 200],
+        labels=["early", "mid", "late", "extra"],
+    ).astype(str)
+    return out
+
+
+@pytest.fixture(scope="module")
+def synthetic_actions() -> tuple[pd.DataFrame, pd.DataFrame]:
+    loaded = split_events(make_events(6, events_per_match=500), PipelineConfig())
+    actions = pd.concat([loaded.passes, loaded.carries], ignore_index=True)
+    # A one-sided match gets no score state in either implementation.
+    lone = actions[actions["match_id"] == actions["match_id"].iloc[0]].head(20)
+    lone = lone.assign(match_id=1, team=lone["team"].iloc[0])
+    return pd.concat([actions, lone], ignore_index=True), loaded.shots
+
+
+@pytest.mark.parametrize("matches_per_chunk", [None, 1, 4])
+def test_game_state_matches_reference(synthetic_actions, matches_per_chunk: int | None) -> None:
+    actions, shots = synthetic_actions
+    expected = _reference_game_state(actions, shots)
+
+    out = build_game_state(actions, shots, matches_per_chunk=matches_per_chunk)
+
+    assert (expected["home_goals"] + expected["away_goals"]).max() > 0
+    assert list(out.columns) == list(expected.columns)
+    # Values must match exactly; the columnar engine stores the counts in compact dtypes.
+    pd.testing.assert_frame_equal(
+        out[STATE_COLUMNS], expected[STATE_COLUMNS], check_dtype=False, check_exact=True
+    )
+    pd.testing.assert_frame_equal(
+        out.drop(columns=STATE_COLUMNS), expected.drop(columns=STATE_COLUMNS)
+    )
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_events
+from ml.config import PipelineConfig
+from ml.data_ingestion import split_events
+from ml.features import (
+    add_game_context,
+    add_spatial_features,
+    build_game_state,
+    encode_context_features,
+)
+from ml.hybrid import SCORE_COLUMNS, attach_shot_outcomes, compute_hybrid_xt, score_actions
+from ml.markov_xt import compute_zone_probabilities, solve_xt
+from ml.model import append_start_end_shot_probs, build_shot_lookahead_target, train_xgboost
+
+RAW_COLUMNS = [
+    "start_x",
+    "start_y",
+    "end_x",
+    "end_y",
+    "type",
+    "under_pressure",
+    "pressure_score",
+    "minute",
+    "score_diff",
+]
+
+
+@pytest.fixture(scope="module")
+def fitted() -> tuple:
+    cfg = PipelineConfig(xgb_n_estimators=20)
+    loaded = split_events(make_events(2, events_per_match=1500), cfg)
+    actions = add_spatial_features(pd.concat([loaded.passes, loaded.carries]), cfg)
+    shots = add_spatial_features(loaded.shots, cfg)
+    actions = encode_context_features(build_game_state(actions, shots))
+    actions["target_shot_next_5"] = build_shot_lookahead_target(loaded.events, actions, 5)
+    surface = solve_xt(*compute_zone_probabilities(actions, shots, cfg), cfg).xt
+    return cfg, train_xgboost(actions, cfg), surface, actions
+
+
+def _raw_actions(actions: pd.DataFrame) -> pd.DataFrame:
+    dtypes = {"type": object, "under_pressure": bool, "minute": np.int64, "score_diff": float}
+    raw = actions[RAW_COLUMNS].astype(dtypes).reset_index(drop=True)
+    # Out-of-range minutes and a missing score state exercise the fallback codes.
+    raw.loc[:2, "minute"] = [-5, 15, 250]
+    raw.loc[3, "score_diff"] = np.nan
+    return raw
+
+
+def _pipeline_scores(raw: pd.DataFrame, trained, surface, cfg, alpha: float) -> pd.DataFrame:
+    # The DataFrame feature path the pipeline scores its own actions with.
+    coords = ["start_x", "start_y", "end_x", "end_y", "pressure_score"]
+    actions = add_spatial_features(raw.astype({c: np.float32 for c in coords}), cfg)
+    actions = encode_context_features(add_game_context(actions))
+    actions = append_start_end_shot_probs(actions, trained)
+    return compute_hybrid_xt(
+        actions, surface, alpha=alpha, cfg=cfg, interpolate=cfg.xt_interpolate
+    )
+
+
+@pytest.mark.parametrize("interpolate", [False, True])
+def test_score_actions_matches_pipeline_feature_path(fitted, interpolate: bool) -> None:
+    cfg, trained, surface, actions = fitted
+    cfg = replace(cfg, xt_interpolate=interpolate)
+    raw = _raw_actions(actions.head(1000))
+    expected = _pipeline_scores(raw, trained, surface, cfg, alpha=0.3)
+
+    scored = score_actions(
+        {c: raw[c].to_list() for c in RAW_COLUMNS}, trained, surface, cfg, alpha=0.3
+    )
+
+    assert list(scored) == SCORE_COLUMNS
+    for col in SCORE_COLUMNS:
+        np.testing.assert_array_equal(scored[col], expected[col].to_numpy(), err_msg=col)
+
+
+def test_score_actions_empty_batch(fitted) -> None:
+    cfg, trained, surface, _ = fitted
+
+    scored = score_actions({c: [] for c in RAW_COLUMNS}, trained, surface, cfg)
+
+    assert all(len(values) == 0 for values in scored.values())
+
+
+def test_attach_shot_outcomes_keeps_one_row_per_action() -> None:
+    actions = pd.DataFrame({"id": ["a1", "a2", "a3"], "shot_id": ["s2", None, "s1"]})
+    shots = pd.DataFrame(
+        {"id": ["s1", "s2"], "shot_statsbomb_xg": [0.1, np.nan], "is_goal": [1, 0]}
+    )
+
+    out = attach_shot_outcomes(actions, shots)
+
+    assert out["id"].tolist() == ["a1", "a2", "a3"]
+    np.testing.assert_allclose(out["action_xg"], [0.0, 0.0, 0.1], rtol=1e-6)
+    assert out["is_action_goal"].tolist() == [0, 0, 1]
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+from ml.config import PipelineConfig
+from ml.markov_xt import (
+    compute_grouped_surfaces,
+    compute_zone_probabilities,
+    count_grouped_zone_transitions,
+    solve_xt,
+)
+
+LINEAR_SOLVERS = ["direct", "sparse_iterative"]
+
+
+def _degenerate_zones() -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # 0 -> 1 -> shot; 2 only ever moves to itself (move_prob 1); 3 has no events.
+    shot_prob = np.array([0.0, 0.5, 0.0, 0.0])
+    move_prob = np.array([1.0, 0.5, 1.0, 0.0])
+    goal_prob = np.array([0.0, 0.2, 0.0, 0.0])
+    transition = np.array(
+        [
+            [0.0, 1.0, 0.0, 0.0],
+            [0.5, 0.5, 0.0, 0.0],
+            [0.0, 0.0, 1.0, 0.0],
+            [0.0, 0.0, 0.0, 0.0],
+        ]
+    )
+    return shot_prob, move_prob, goal_prob, transition
+
+
+def _reference(shot_prob, move_prob, goal_prob, transition) -> np.ndarray:
+    cfg = PipelineConfig(xt_solver="tolerance", xt_tolerance=1e-14, xt_max_iterations=10_000)
+    return solve_xt(shot_prob, move_prob, goal_prob, transition, cfg).xt
+
+
+@pytest.mark.parametrize("solver", LINEAR_SOLVERS)
+@pytest.mark.parametrize("as_sparse", [False, True])
+def test_linear_solvers_handle_self_loop_zone(solver: str, as_sparse: bool) -> None:
+    shot_prob, move_prob, goal_prob, transition = _degenerate_zones()
+    expected = _reference(shot_prob, move_prob, goal_prob, transition)
+    if as_sparse:
+        transition = sparse.csr_matrix(transition)
+
+    cfg = PipelineConfig(xt_solver=solver)
+    solution = solve_xt(shot_prob, move_prob, goal_prob, transition, cfg)
+
+    assert np.all(np.isfinite(solution.xt))
+    assert solution.xt[2] == 0.0
+    assert solution.xt[3] == 0.0
+    np.testing.assert_allclose(solution.xt, expected, atol=1e-8)
+    assert solution.residual < 1e-8
+
+
+@pytest.mark.parametrize("solver", LINEAR_SOLVERS)
+def test_linear_solvers_on_sparse_grid_with_dead_zones(solver: str) -> None:
+    cfg = PipelineConfig(grid_x=48, grid_y=32, xt_solver=solver)
+    n = cfg.grid_x * cfg.grid_y
+    # A chain of moves into a shooting zone, plus a zone whose only action is a self-pass.
+    actions = pd.DataFrame(
+        {
+            "start_zone": [10, 11, 12, 12, 700, 700],
+            "end_zone": [11, 12, 13, 12, 700, 700],
+        }
+    )
+    shots = pd.DataFrame({"start_zone": [13, 13, 12], "is_goal": [1, 0, 0]})
+    shot_prob, move_prob, goal_prob, transition = compute_zone_probabilities(actions, shots, cfg)
+    assert sparse.issparse(transition)
+    expected = _reference(shot_prob, move_prob, goal_prob, transition)
+
+    solution = solve_xt(shot_prob, move_prob, goal_prob, transition, cfg)
+
+    assert solution.xt.shape == (n,)
+    assert np.all(np.isfinite(solution.xt))
+    assert solution.xt[700] == 0.0
+    np.testing.assert_allclose(solution.xt, expected, atol=1e-8)
+
+
+def test_non_converged_iterative_solve_falls_back_to_tolerance() -> None:
+    shot_prob, move_prob, goal_prob, transition = _degenerate_zones()
+    cfg = PipelineConfig(xt_solver="sparse_iterative", xt_max_iterations=1, xt_tolerance=1e-300)
+
+    solution = solve_xt(shot_prob, move_prob, goal_prob, transition, cfg)
+
+    assert solution.solver == "tolerance"
+    assert np.all(np.isfinite(solution.xt))
+
+
+def _grouped_events() -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Match 2 has a zone whose only action is a self-pass; match 1 is well behaved.
+    actions = pd.DataFrame(
+        {
+            "match_id": [1, 1, 1, 2, 2, 2, 2],
+            "start_zone": [10, 11, 12, 10, 11, 40, 40],
+            "end_zone": [11, 12, 12, 11, 12, 40, 40],
+        }
+    )
+    shots = pd.DataFrame(
+        {"match_id": [1, 1, 2], "start_zone": [12, 12, 12], "is_goal": [1, 0, 1]}
+    )
+    return actions, shots
+
+
+@pytest.mark.parametrize("solver", LINEAR_SOLVERS)
+@pytest.mark.parametrize("sparse_zones", [1024, 1])
+def test_grouped_surfaces_survive_singular_group(solver: str, sparse_zones: int) -> None:
+    actions, shots = _grouped_events()
+    reference_cfg = PipelineConfig(
+        xt_solver="tolerance", xt_tolerance=1e-14, xt_max_iterations=10_000
+    )
+    expected = compute_grouped_surfaces(actions, shots, reference_cfg, "match_id").surfaces
+    cfg = PipelineConfig(xt_solver=solver, sparse_transition_zones=sparse_zones)
+
+    batch = compute_grouped_surfaces(actions, shots, cfg, "match_id")
+
+    assert batch.keys["match_id"].tolist() == [1, 2]
+    assert np.all(np.isfinite(batch.surfaces))
+    assert batch.surfaces[1, 40] == 0.0
+    np.testing.assert_allclose(batch.surfaces, expected, atol=1e-8)
+    assert np.all(batch.residuals < 1e-8)
+
+
+def test_large_grouped_grids_use_stacked_sparse_transitions() -> None:
+    actions, shots = _grouped_events()
+    dense_cfg = PipelineConfig()
+    sparse_cfg = PipelineConfig(sparse_transition_zones=1)
+
+    _, counts = count_grouped_zone_transitions(actions, shots, sparse_cfg, "match_id")
+    n = sparse_cfg.grid_x * sparse_cfg.grid_y
+    assert sparse.issparse(counts.trans_counts)
+    assert counts.trans_counts.shape == (2 * n, n)
+
+    dense = compute_grouped_surfaces(actions, shots, dense_cfg, "match_id").surfaces
+    stacked = compute_grouped_surfaces(actions, shots, sparse_cfg, "match_id").surfaces
+    np.testing.assert_allclose(stacked, dense, atol=1e-12)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+
+from benchmarks.synthetic import make_events
+from ml.config import PipelineConfig
+from ml.model import (
+    EARLY_STOPPING,
+    FEATURE_COLUMNS,
+    TARGET_COLUMN,
+    TRAIN,
+    VALIDATION,
+    _row_roles,
+    build_shot_lookahead_target,
+    build_shot_lookahead_targets,
+    train_xgboost,
+    train_xgboost_external,
+)
+
+LOOKAHEADS = [1, 3, 5, 10]
+
+
+def _reference_lookahead(events: pd.DataFrame, actions: pd.DataFrame, lookahead: int) -> pd.Series:
+    # The original per-action scan the vectorised labeller replaced.
+    ev = events[["match_id", "index", "team", "possession", "type"]].copy()
+    ev = ev.sort_values(["match_id", "index"]).reset_index(drop=True)
+
+    labels = []
+    for _, act in actions.iterrows():
+        subset = ev[
+            (ev["match_id"] == act["match_id"])
+            & (ev["team"] == act["team"])
+            & (ev["possession"] == act["possession"])
+            & (ev["index"] > act["index"])
+        ].head(lookahead)
+        labels.append(int((subset["type"] == "Shot").any()))
+    return pd.Series(labels, index=actions.index, dtype=int)
+
+
+@pytest.fixture(scope="module")
+def synthetic_events() -> tuple[pd.DataFrame, pd.DataFrame]:
+    events = make_events(3, events_per_match=400)
+    # Shuffled rows and a non-default index must not change the labels.
+    events = events.sample(frac=1.0, random_state=0)
+    actions = events[events["type"].isin(["Pass", "Carry"])]
+    return events, actions
+
+
+@pytest.mark.parametrize("lookahead", LOOKAHEADS)
+def test_lookahead_labels_match_reference(synthetic_events, lookahead: int) -> None:
+    events, actions = synthetic_events
+    expected = _reference_lookahead(events, actions, lookahead)
+
+    labels = build_shot_lookahead_target(events, actions, lookahead)
+
+    assert expected.sum() > 0
+    pd.testing.assert_series_equal(labels.astype(int), expected)
+
+
+def test_multiple_lookaheads_in_one_pass(synthetic_events) -> None:
+    events, actions = synthetic_events
+
+    targets = build_shot_lookahead_targets(events, actions, LOOKAHEADS)
+
+    assert list(targets.columns) == [f"target_shot_next_{n}" for n in LOOKAHEADS]
+    for n in LOOKAHEADS:
+        single = build_shot_lookahead_target(events, actions, n)
+        pd.testing.assert_series_equal(targets[f"target_shot_next_{n}"].rename(None), single)
+
+
+@pytest.fixture(scope="module")
+def training_actions() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    X = rng.random((2000, len(FEATURE_COLUMNS)))
+    frame = pd.DataFrame(X, columns=FEATURE_COLUMNS)
+    frame[TARGET_COLUMN] = (X[:, 0] + rng.normal(0, 0.3, len(X)) > 0.8).astype(int)
+    return frame
+
+
+def test_default_fits_every_tree(training_actions, tmp_path) -> None:
+    cfg = replace(PipelineConfig(), xgb_n_estimators=30)
+    assert cfg.xgb_early_stopping_rounds is None
+
+    assert train_xgboost(training_actions, cfg).best_iteration == 29
+
+    paths = [tmp_path / "chunk_0.parquet", tmp_path / "chunk_1.parquet"]
+    training_actions.iloc[:1000].to_parquet(paths[0])
+    training_actions.iloc[1000:].to_parquet(paths[1])
+    assert train_xgboost_external(paths, cfg, tmp_path / "cache").best_iteration == 29
+
+
+def test_early_stopping_rows_are_not_validation_rows(training_actions, monkeypatch) -> None:
+    cfg = replace(PipelineConfig(), xgb_n_estimators=30, xgb_early_stopping_rounds=5)
+    seen = {}
+    fit, predict_proba = xgb.XGBClassifier.fit, xgb.XGBClassifier.predict_proba
+
+    def spy_fit(self, X, y, *, eval_set, **kwargs):
+        seen["train"], seen["stop"] = X.index, eval_set[0][0].index
+        return fit(self, X, y, eval_set=eval_set, **kwargs)
+
+    def spy_predict_proba(self, X, *args, **kwargs):
+        seen["validation"] = X.index
+        return predict_proba(self, X, *args, **kwargs)
+
+    monkeypatch.setattr(xgb.XGBClassifier, "fit", spy_fit)
+    monkeypatch.setattr(xgb.XGBClassifier, "predict_proba", spy_predict_proba)
+    train_xgboost(training_actions, cfg)
+
+    assert len(seen["stop"]) > 0
+    assert seen["stop"].intersection(seen["validation"]).empty
+    assert seen["stop"].intersection(seen["train"]).empty
+    assert len(seen["train"]) + len(seen["stop"]) + len(seen["validation"]) == len(training_actions)
+
+
+def test_external_row_roles() -> None:
+    cfg = PipelineConfig(test_size=0.2)
+    stopping = replace(cfg, xgb_early_stopping_rounds=5, xgb_early_stopping_fraction=0.25)
+
+    roles = _row_roles(10_000, cfg, chunk=3)
+    stop_roles = _row_roles(10_000, stopping, chunk=3)
+
+    assert set(np.unique(roles)) == {TRAIN, VALIDATION}
+    # Early stopping only takes rows from training; the validation rows do not move.
+    np.testing.assert_array_equal(stop_roles == VALIDATION, roles == VALIDATION)
+    assert (roles[stop_roles == EARLY_STOPPING] == TRAIN).all()
+    assert abs((stop_roles == EARLY_STOPPING).mean() - 0.8 * 0.25) < 0.02
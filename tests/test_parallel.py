@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from dataclasses import replace
+
+import pandas as pd
+
+from benchmarks.synthetic import write_raw_cache
+from ml.config import PipelineConfig
+from ml.pipeline import _load_and_build
+
+
+def test_process_pool_matches_serial_build(tmp_path) -> None:
+    cfg = PipelineConfig(data_raw_dir=tmp_path / "raw", fetch_workers=1)
+    match_ids = write_raw_cache(cfg, n_matches=4, events_per_match=600)
+
+    serial = _load_and_build(cfg, match_ids)
+    sharded = _load_and_build(replace(cfg, process_workers=2), match_ids)
+
+    for expected, actual in zip(serial, sharded, strict=True):
+        pd.testing.assert_frame_equal(actual, expected)
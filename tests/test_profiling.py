@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from ml.profiling import CLEAR_REFS_PATH, StageProfiler, peak_rss_mb
+
+ALLOC_MB = 200
+
+pytestmark = pytest.mark.skipif(
+    not os.access(CLEAR_REFS_PATH, os.W_OK),
+    reason="per-stage peak RSS needs a resettable VmHWM (Linux)",
+)
+
+
+def test_stage_peak_rss_is_per_stage() -> None:
+    profiler = StageProfiler()
+
+    with profiler.stage("large"):
+        block = np.ones(ALLOC_MB * 1024 * 1024 // 8)
+        del block
+    with profiler.stage("small"):
+        pass
+
+    large, small = profiler.records
+    assert large.peak_rss_mb - small.peak_rss_mb > 0.8 * ALLOC_MB
+    assert profiler.report()["peak_rss_mb"] >= large.peak_rss_mb
+
+
+def test_stage_records_child_process_peak() -> None:
+    profiler = StageProfiler()
+    # RUSAGE_CHILDREN keeps the largest child so far, so outgrow any earlier test's workers.
+    alloc_mb = int(max(ALLOC_MB, (peak_rss_mb(children=True) or 0.0) + 50))
+
+    with profiler.stage("workers"):
+        code = f"block = b'x' * ({alloc_mb} * 1024 * 1024)"
+        subprocess.run([sys.executable, "-c", code], check=True)
+    with profiler.stage("serial"):
+        pass
+
+    workers, serial = profiler.records
+    assert workers.children_peak_rss_mb > alloc_mb
+    assert serial.children_peak_rss_mb is None